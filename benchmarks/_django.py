@@ -0,0 +1,18 @@
+"""Import this first in benchmarks that need the Django project configured."""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dogs_project.settings')
+os.environ.setdefault('Django_KEY', 'benchmark-only-key')
+os.environ.setdefault('DJANGO_DEVELOPMENT', 'True')
+# The stubs have no quota, benchmarks measure our code and not the request budgets (subprocesses inherit these)
+os.environ.setdefault('THEDOGAPI_BUDGET_RATE', '0')
+os.environ.setdefault('GIPHY_BUDGET_RATE', '0')
+
+import django  # noqa: E402
+
+django.setup()
@@ -0,0 +1,56 @@
+"""Synthetic search history for the benchmarks, written straight into dogs_breed and dogs_dogbreed."""
+import random
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from dogs.fake_upstream import DEFAULT_BREEDS
+from dogs.models import breed_key
+
+
+INSERT_BREED = "INSERT INTO dogs_breed (key, name, description, image_url) VALUES (%s, %s, %s, %s)"
+INSERT = "INSERT INTO dogs_dogbreed (breed_id, time) VALUES (%s, %s)"
+
+
+def breed_id(cursor, breed_ids, name, description, image_url):
+    key = breed_key(name, description, image_url)
+    if key not in breed_ids:
+        cursor.execute(INSERT_BREED, (key, name, description, image_url))
+        breed_ids[key] = cursor.lastrowid
+    return breed_ids[key]
+
+
+def generate_history(rows, seed=1, days=30, quiet=False):
+    """
+    `rows` searches spread evenly over the last `days` days, oldest first. Half of them get
+    a random mix of traits instead of their breed's temperament, so keyword searches don't
+    all match the same rows, and each mix is a breed row of its own. The FTS index is kept
+    in sync by its triggers.
+    """
+    rng = random.Random(seed)
+    breeds = [(breed['name'], breed['temperament']) for breed in DEFAULT_BREEDS]
+    traits = sorted({trait for _, temperament in breeds for trait in temperament.split(', ')})
+    end = timezone.now()
+    step = timedelta(days=days) / max(rows, 1)
+    start = time.perf_counter()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT key, id FROM dogs_breed")
+        breed_ids = dict(cursor.fetchall())
+        batch = []
+        for i in range(rows):
+            name, temperament = rng.choice(breeds)
+            if rng.random() < 0.5:
+                temperament = ', '.join(rng.sample(traits, 5))
+            searched_at = end - step * (rows - i)
+            image_url = f"https://media.giphy.test/{name.lower().replace(' ', '-')}.gif"
+            batch.append((breed_id(cursor, breed_ids, name, temperament, image_url), searched_at))
+            if len(batch) == 10000:
+                cursor.executemany(INSERT, batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT, batch)
+    if not quiet:
+        print(f"generated {rows} history rows (FTS kept in sync by triggers) in {time.perf_counter() - start:.1f} s")
+    return end
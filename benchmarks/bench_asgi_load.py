@@ -0,0 +1,246 @@
+"""
+Sync WSGI vs ASGI under load: gunicorn is started once per SERVER_MODE (see
+gunicorn.conf.py) against stub upstreams in their own process, then hammered by
+--clients concurrent keep-alive clients for --duration seconds.
+
+    details  POST /api/breeds/details/ (wsgi) vs /api/breeds/details/async/ (asgi), every
+             request waits on Giphy (--giphy-latency): the gif cache is off and each
+             request asks for another of --breeds breeds, so lookups are rarely coalesced
+    breeds   GET /api/breeds/?filter=... vs /api/breeds/async/?filter=..., no upstream at
+             all, what the event loop and the middleware chain cost
+
+The load generator runs on the same machine (--load-procs processes), so CPU-bound
+numbers are pessimistic for both modes.
+
+Run from the project root:
+    python benchmarks/bench_asgi_load.py [--clients 500] [--duration 15] [--workers 2]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import httpx
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+from dogs.catalog import BreedCatalog, save_snapshot  # noqa: E402
+from dogs.fake_upstream import FakeUpstream  # noqa: E402
+
+
+SCENARIOS = {
+    'details': {
+        'wsgi': ('POST', '/api/breeds/details/'),
+        'asgi': ('POST', '/api/breeds/details/async/'),
+    },
+    'breeds': {
+        'wsgi': ('GET', '/api/breeds/'),
+        'asgi': ('GET', '/api/breeds/async/'),
+    },
+}
+# Production settings redirect plain HTTP, in front of gunicorn the platform's proxy says the client used HTTPS
+PROXY_HEADERS = {'X-Forwarded-Proto': 'https'}
+TRAITS = ['loyal', 'friendly', 'alert', 'playful', 'gentle', 'energetic']
+
+
+def make_breeds(count):
+    return [
+        {'id': i, 'name': f"Bench Breed {i:05d}", 'temperament': ', '.join(random.Random(i).sample(TRAITS, 3)).title()}
+        for i in range(count)
+    ]
+
+
+def run_upstream(breeds, latency, ready):
+    # In its own process so the stub's threads don't compete with the load generator for the GIL
+    upstream = FakeUpstream(breeds=breeds, dog_latency=latency, giphy_latency=latency).start()
+    ready.put(upstream.base_url)
+    while True:
+        time.sleep(3600)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, workers, upstream_url, snapshot_path):
+    port = free_port()
+    env = {
+        **os.environ,
+        'SERVER_MODE': mode,
+        'DJANGO_DEVELOPMENT': 'False',
+        'BREED_CATALOG_PATH': snapshot_path,
+        'DOGS_API_URL': f"{upstream_url}/v1/breeds",
+        'GIPHY_API_URL': f"{upstream_url}/v1/gifs/search",
+        'GIPHY_API_KEY': 'bench',
+        'GIF_CACHE_TTL': '0',  # every details request goes to Giphy
+        'GIF_CACHE_NEGATIVE_TTL': '0',
+        'GIPHY_API_TIMEOUT': '10',  # measure queueing, not the partial answers
+    }
+    process = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+         '--backlog', '2048', '--timeout', '120', '--log-level', 'warning'],
+        cwd=_django.ROOT, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/breeds/", headers=PROXY_HEADERS, timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({mode}) did not come up")
+
+
+async def send(reader, writer, method, path, body, host):
+    # One keep-alive HTTP/1.1 exchange. httpx would do, but its pool rescans every connection on each
+    # event and with 500 of them the load generator would use more CPU than the servers it measures.
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nX-Forwarded-Proto: https\r\n"
+    if body is not None:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(head.encode() + b"\r\n" + (body or b""))
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("server closed the connection")
+    length, close = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection' and value.strip().lower() == 'close':
+            close = True
+    await reader.readexactly(length)
+    return int(status_line.split()[1]), close
+
+
+async def load(base_url, method, path, clients, warmup, duration, breeds, seed):
+    rng = random.Random(seed)
+    samples, statuses = [], {}
+    host, port = base_url.removeprefix('http://').split(':')
+    started = time.monotonic()
+    measure_from, stop_at = started + warmup, started + warmup + duration
+
+    async def user():
+        connection = None
+        while time.monotonic() < stop_at:
+            if method == 'POST':
+                target, body = path, json.dumps({'breed': f"bench breed {rng.randrange(breeds):05d}"}).encode()
+            else:
+                target, body = f"{path}?{urlencode({'filter': rng.sample(TRAITS, 2)}, doseq=True)}", None
+            sent = time.monotonic()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(host, int(port))
+                outcome, close = await send(*connection, method, target, body, f"{host}:{port}")
+                if close:
+                    connection[1].close()
+                    connection = None
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                outcome = type(e).__name__
+                if connection is not None:
+                    connection[1].close()
+                connection = None
+            done = time.monotonic()
+            if measure_from <= done <= stop_at:  # completed inside the window, whenever it was sent
+                samples.append(done - sent)
+                statuses[outcome] = statuses.get(outcome, 0) + 1
+        if connection is not None:
+            connection[1].close()
+
+    await asyncio.gather(*(user() for _ in range(clients)))
+    return samples, statuses
+
+
+def load_process(args, results):
+    results.put(asyncio.run(load(*args)))
+
+
+def run_load(base_url, method, path, clients, procs, warmup, duration, breeds):
+    results = multiprocessing.Queue()
+    shares = [clients // procs + (1 if i < clients % procs else 0) for i in range(procs)]
+    workers = [
+        multiprocessing.Process(target=load_process, args=((base_url, method, path, share, warmup, duration, breeds, i), results))
+        for i, share in enumerate(shares)
+    ]
+    for worker in workers:
+        worker.start()
+    samples, statuses = [], {}
+    for _ in workers:
+        part, part_statuses = results.get()
+        samples += part
+        for outcome, count in part_statuses.items():
+            statuses[outcome] = statuses.get(outcome, 0) + count
+    for worker in workers:
+        worker.join()
+    return samples, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers per mode")
+    parser.add_argument('--giphy-latency', type=float, default=0.05)
+    parser.add_argument('--breeds', type=int, default=2000)
+    parser.add_argument('--load-procs', type=int, default=1)
+    parser.add_argument('--scenarios', default='details,breeds')
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    breeds = make_breeds(args.breeds)
+    snapshot_path = os.path.join(TMP_DIR, 'breed_catalog.json')
+    save_snapshot(BreedCatalog.from_api(breeds), snapshot_path)
+
+    ready = multiprocessing.Queue()
+    upstream = multiprocessing.Process(target=run_upstream, args=(breeds, args.giphy_latency, ready), daemon=True)
+    upstream.start()
+    upstream_url = ready.get(timeout=10)
+
+    print(f"{args.clients} concurrent clients, {args.workers} gunicorn workers, stub latency {args.giphy_latency * 1000:.0f} ms, "
+          f"{args.duration:.0f} s per run, {os.cpu_count()} CPU(s)")
+    print(f"{'scenario':<9} {'mode':<5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    try:
+        for scenario in args.scenarios.split(','):
+            for mode in ('wsgi', 'asgi'):
+                method, path = SCENARIOS[scenario][mode]
+                server, base_url = start_server(mode, args.workers, upstream_url, snapshot_path)
+                try:
+                    samples, statuses = run_load(base_url, method, path, args.clients, args.load_procs, args.warmup, args.duration, args.breeds)
+                finally:
+                    server.terminate()
+                    server.wait()
+                if not samples:
+                    print(f"{scenario:<9} {mode:<5} no request finished inside the window  {statuses}")
+                    continue
+                ms = sorted(sample * 1000 for sample in samples)
+                p50, p95, p99 = (statistics.quantiles(ms, n=100, method='inclusive')[q - 1] for q in (50, 95, 99))
+                print(f"{scenario:<9} {mode:<5} {len(samples) / args.duration:8.0f} {p50:8.1f} {p95:8.1f} {p99:8.1f} {ms[-1]:8.1f}  {statuses}")
+    finally:
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Authentication cost per admin request: simplejwt's JWTAuthentication (token decode plus a
+User query) vs StatelessJWTAuthentication (dogs/auth.py, claims in the token, verified
+tokens and user versions cached), alone and while another thread keeps writing search
+history batches to the same SQLite file.
+
+Run from the project root:
+    python benchmarks/bench_auth_overhead.py [--requests 5000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework_simplejwt.authentication import JWTAuthentication  # noqa: E402
+
+from dogs.auth import StatelessJWTAuthentication, refresh_token_for  # noqa: E402
+from dogs.history import HistorySink  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+
+
+def measure(authentication, request, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        user, _ = authentication.authenticate(Request(request))
+        assert user.is_staff
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    with CaptureQueriesContext(connection) as queries:
+        authentication.authenticate(Request(request))
+    return statistics.median(samples), samples[int(len(samples) * 0.99)], len(queries)
+
+
+def history_writer(stop, batch_size):
+    # The history sink flushing batches as fast as it can
+    sink = HistorySink()
+    while not stop.is_set():
+        sink._write([DogBreed.from_details('Akita', 'Loyal', 'No image available') for _ in range(batch_size)])
+        time.sleep(0.005)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=500, help="rows per history write of the background writer")
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    admin = User.objects.create_superuser(username='admin', password='admin')
+    access = refresh_token_for(admin).access_token
+    request = RequestFactory().get('/api/search-history/', HTTP_AUTHORIZATION=f'Bearer {access}')
+    authentications = {'JWTAuthentication': JWTAuthentication(), 'StatelessJWTAuthentication': StatelessJWTAuthentication()}
+
+    print("microseconds per authentication (median / p99) and database queries per request")
+    print(f"{'authentication':<28} {'idle':>16} {'history writes':>16} {'queries':>8}")
+    for name, authentication in authentications.items():
+        idle = measure(authentication, request, args.requests)
+        stop = threading.Event()
+        writer = threading.Thread(target=history_writer, args=(stop, args.batch_size))
+        writer.start()
+        try:
+            busy = measure(authentication, request, args.requests)
+        finally:
+            stop.set()
+            writer.join()
+        print(f"{name:<28} {f'{idle[0]:.0f} / {idle[1]:.0f}':>16} {f'{busy[0]:.0f} / {busy[1]:.0f}':>16} {idle[2]:>8}")
+
+
+if __name__ == '__main__':
+    main()
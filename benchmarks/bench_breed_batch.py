@@ -0,0 +1,76 @@
+"""
+Loading a comparison page of N breeds: N calls to POST /api/breeds/details/ vs one call
+to POST /api/breeds/details/batch/, against fake upstreams with Giphy latency.
+
+Gifs are not cached between runs (the gif cache is cleared), so every breed costs one
+Giphy search in both modes. The client round trip itself is not simulated, in a browser
+each of the N single calls also pays one.
+
+Run from the project root:
+    python benchmarks/bench_breed_batch.py [--breeds 20] [--giphy-latency 0.05]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SINK_ENABLED'] = 'False'  # write inline, so the INSERTs are part of what we measure
+
+import _django  # noqa: E402,F401
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+
+from dogs.catalog import BreedCatalog, mirror  # noqa: E402
+from dogs.fake_upstream import FakeUpstream  # noqa: E402
+from dogs.gif_cache import gif_cache  # noqa: E402
+
+
+def one_by_one(client, names):
+    for name in names:
+        assert client.post('/api/breeds/details/', {'breed': name}, content_type='application/json').status_code == 200
+
+
+def batch(client, names):
+    response = client.post('/api/breeds/details/batch/', {'breeds': names}, content_type='application/json')
+    assert all(item['status'] == 'success' for item in response.json()['data'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--breeds', type=int, default=20)
+    parser.add_argument('--giphy-latency', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    breeds = [{'id': i, 'name': f"Breed {i:03d}", 'temperament': 'Loyal, Friendly'} for i in range(args.breeds)]
+    names = [breed['name'] for breed in breeds]
+    client = Client()
+
+    print(f"{args.breeds} breeds, Giphy latency {args.giphy_latency * 1000:.0f} ms, best of {args.repeat}")
+    with FakeUpstream(breeds=breeds, giphy_latency=args.giphy_latency) as upstream, override_settings(**upstream.settings()):
+        mirror.publish(BreedCatalog.from_api(breeds), save=False)
+        for label, load in [('one by one', one_by_one), ('batch', batch)]:
+            best = None
+            for _ in range(args.repeat):
+                gif_cache.clear()
+                cache.clear()
+                mirror.publish(BreedCatalog.from_api(breeds), save=False)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    load(client, names)
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            inserts = len([q for q in queries if q['sql'].startswith('INSERT')])
+            print(f"{label:<12} {best * 1000:8.1f} ms   {inserts} INSERT statements")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
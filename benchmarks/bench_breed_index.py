@@ -0,0 +1,89 @@
+"""
+Latency of GET /api/breeds/ filtering: old linear scan vs BreedIndex.
+
+Run from the project root:
+    python benchmarks/bench_breed_index.py [--breeds 10000] [--requests 200]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dogs.breed_index import BreedIndex  # noqa: E402
+
+
+TRAITS = [
+    'Friendly', 'Loyal', 'Fierce', 'Playful', 'Intelligent', 'Alert', 'Gentle', 'Courageous',
+    'Independent', 'Affectionate', 'Energetic', 'Stubborn', 'Calm', 'Protective', 'Dignified',
+    'Active', 'Obedient', 'Reserved', 'Cheerful', 'Curious', 'Devoted', 'Faithful', 'Trainable',
+]
+FILTER_POOL = ['loyal', 'friend', 'play', 'alert', 'gentle', 'calm', 'active', 'ed', 'in', 'terrier']
+
+
+def synthetic_catalog(size, seed=42):
+    rng = random.Random(seed)
+    suffixes = ['Terrier', 'Hound', 'Retriever', 'Spaniel', 'Shepherd', 'Mastiff', 'Collie']
+    return [
+        {
+            'name': f"Breed {i} {rng.choice(suffixes)}",
+            'description': ', '.join(rng.sample(TRAITS, rng.randint(3, 7))),
+        }
+        for i in range(size)
+    ]
+
+
+def linear_scan(breeds, search_terms):
+    # Copy of the filtering get_dog_breeds did before the index
+    if search_terms:
+        search_terms = [term.lower() for term in search_terms]
+        breeds = [
+            breed for breed in breeds
+            if all(term in breed['name'].lower() or term in breed['description'].lower() for term in search_terms)
+        ]
+    return [breed['name'] for breed in breeds]
+
+
+def measure(fn, queries):
+    samples = []
+    for terms in queries:
+        start = time.perf_counter()
+        fn(terms)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--breeds', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    breeds = synthetic_catalog(args.breeds)
+    start = time.perf_counter()
+    index = BreedIndex(breeds)
+    print(f"catalog: {len(breeds)} breeds, index build {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'terms':>5} {'scan p50 us':>12} {'scan p95 us':>12} {'cold p50 us':>12} {'warm p50 us':>12} {'warm p95 us':>12}")
+
+    rng = random.Random(7)
+    for term_count in range(1, 6):
+        queries = [rng.sample(FILTER_POOL, term_count) for _ in range(args.requests)]
+        for terms in queries:  # results must not change
+            assert index.search(terms) == linear_scan(breeds, terms)
+        scan = measure(lambda terms: linear_scan(breeds, terms), queries)
+
+        def cold_search(terms):  # first time a term is seen by this worker
+            index._term_cache.clear()
+            return index.search(terms)
+
+        cold = measure(cold_search, queries)
+        warm = measure(index.search, queries)
+        print(f"{term_count:>5} {scan[0]:>12.0f} {scan[1]:>12.0f} {cold[0]:>12.0f} {warm[0]:>12.1f} {warm[1]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Breed name resolution: the substring match thedogapi search (and the catalog before)
+does vs the same plus the trigram fallback of dogs/breed_match.py.
+
+Accuracy is measured on misspellings generated from real breed names (one random
+deletion, insertion, substitution or transposition per query, plus a few hand labeled
+ones) and on names that are not in the catalog at all, which must stay unresolved.
+A typo below BREED_MATCH_AUTO_SCORE isn't resolved, the "suggested" column counts the
+ones whose breed is the first "did you mean" suggestion on the 404 instead.
+
+Run from the project root:
+    python benchmarks/bench_breed_match.py [--typos 2000]
+"""
+import argparse
+import random
+import string
+import sys
+import time
+
+import _django  # noqa: F401
+from django.conf import settings
+
+from dogs.catalog import BreedCatalog
+
+
+BREEDS = [
+    'Affenpinscher', 'Afghan Hound', 'Airedale Terrier', 'Akita', 'Alaskan Malamute', 'American Bulldog',
+    'American Eskimo Dog', 'American Foxhound', 'American Staffordshire Terrier', 'Australian Cattle Dog',
+    'Australian Shepherd', 'Basenji', 'Basset Hound', 'Beagle', 'Bearded Collie', 'Bernese Mountain Dog',
+    'Bichon Frise', 'Bloodhound', 'Border Collie', 'Border Terrier', 'Boston Terrier', 'Boxer', 'Brittany',
+    'Bull Terrier', 'Bullmastiff', 'Cairn Terrier', 'Cane Corso', 'Cavalier King Charles Spaniel', 'Chihuahua',
+    'Chinese Shar-Pei', 'Chow Chow', 'Cocker Spaniel', 'Dachshund', 'Dalmatian', 'Doberman Pinscher',
+    'English Setter', 'English Springer Spaniel', 'French Bulldog', 'German Shepherd Dog',
+    'German Shorthaired Pointer', 'Golden Retriever', 'Great Dane', 'Great Pyrenees', 'Greyhound', 'Havanese',
+    'Irish Setter', 'Irish Wolfhound', 'Italian Greyhound', 'Jack Russell Terrier', 'Labrador Retriever',
+    'Maltese', 'Miniature Schnauzer', 'Newfoundland', 'Papillon', 'Pembroke Welsh Corgi', 'Pomeranian', 'Pug',
+    'Rhodesian Ridgeback', 'Rottweiler', 'Saint Bernard', 'Samoyed', 'Scottish Terrier', 'Shetland Sheepdog',
+    'Shiba Inu', 'Shih Tzu', 'Siberian Husky', 'Standard Poodle', 'Vizsla', 'Weimaraner', 'Whippet',
+    'Yorkshire Terrier',
+]
+LABELED = [
+    ('german shepard', 'German Shepherd Dog'), ('rotweiler', 'Rottweiler'), ('daschund', 'Dachshund'),
+    ('chihuahau', 'Chihuahua'), ('pomeranain', 'Pomeranian'), ('dalmation', 'Dalmatian'),
+    ('labradoodle', None), ('weimeraner', 'Weimaraner'), ('shitzu', 'Shih Tzu'), ('husky siberian', 'Siberian Husky'),
+    ('yorkie terier', 'Yorkshire Terrier'), ('bernese mountian dog', 'Bernese Mountain Dog'), ('samoyd', 'Samoyed'),
+]
+NOT_BREEDS = ['cat', 'siamese', 'persian', 'parrot', 'hamster', 'goldfish', 'labradoodle', 'cockapoo', 'xyz', 'dog food']
+
+
+def typo(name, rng):
+    chars = list(name.lower())
+    position = rng.randrange(len(chars))
+    edit = rng.choice(['delete', 'insert', 'substitute', 'transpose'])
+    if edit == 'delete' and len(chars) > 3:
+        del chars[position]
+    elif edit == 'insert':
+        chars.insert(position, rng.choice(string.ascii_lowercase))
+    elif edit == 'substitute':
+        chars[position] = rng.choice(string.ascii_lowercase)
+    elif position < len(chars) - 1:
+        chars[position], chars[position + 1] = chars[position + 1], chars[position]
+    return ''.join(chars)
+
+
+def substring_only(catalog, query):
+    query = query.strip().lower()
+    for breed_id, name in enumerate(catalog.matcher.lower_names):
+        if query and query in name:
+            return catalog.breeds[breed_id]
+    return None
+
+
+def accuracy(resolve, cases):
+    right = sum(1 for query, expected in cases if ((resolve(query) or {}).get('name')) == expected)
+    return right / len(cases)
+
+
+def suggested(catalog, cases):
+    right = sum(1 for query, expected in cases
+                if expected and not catalog.find(query) and [s['name'] for s in catalog.suggest(query)[:1]] == [expected])
+    return right / len(cases)
+
+
+def lookups_per_second(resolve, queries):
+    start = time.perf_counter()
+    for query in queries:
+        resolve(query)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--typos', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    catalog = BreedCatalog([{'name': name, 'description': ''} for name in BREEDS])
+    catalog.matcher  # built once per catalog version, not per request
+    typos = [(typo(name, rng), name) for name in rng.choices(BREEDS, k=args.typos)]
+    typos = [(query, name) for query, name in typos if query != name.lower()]
+    sets = [
+        ('exact names', [(name.lower(), name) for name in BREEDS]),
+        ('generated typos', typos),
+        ('labeled typos', LABELED),
+        ('not breeds', [(query, None) for query in NOT_BREEDS]),
+    ]
+
+    print(f"{len(BREEDS)} breeds, BREED_MATCH_MIN_SCORE {settings.BREED_MATCH_MIN_SCORE}, "
+          f"BREED_MATCH_AUTO_SCORE {settings.BREED_MATCH_AUTO_SCORE}")
+    print(f"{'set':<16} {'cases':>6} {'substring':>10} {'trigram':>8} {'suggested':>10} {'lookups/s':>11}")
+    for label, cases in sets:
+        queries = [query for query, _ in cases] * max(1, 2000 // len(cases))
+        print(f"{label:<16} {len(cases):6} {accuracy(lambda q: substring_only(catalog, q), cases):10.1%} "
+              f"{accuracy(catalog.find, cases):8.1%} {suggested(catalog, cases):10.1%} {lookups_per_second(catalog.find, queries):11.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
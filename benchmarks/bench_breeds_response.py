@@ -0,0 +1,64 @@
+"""
+GET /api/breeds/ through the whole Django stack: cold (filters searched and rendered),
+warm (encoded body reused from the response cache) and 304 (If-None-Match revalidation).
+
+Run from the project root:
+    python benchmarks/bench_breeds_response.py [--breeds 172] [--requests 2000]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import _django  # noqa: F401
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from bench_breed_index import FILTER_POOL, synthetic_catalog
+from dogs.catalog import BreedCatalog, mirror
+from dogs.response_cache import breed_responses
+
+
+def measure(client, queries, before=None, headers=None):
+    samples = []
+    for filters in queries:
+        if before:
+            before()
+        start = time.perf_counter()
+        response = client.get('/api/breeds/', {'filter': filters}, **(headers(filters) if headers else {}))
+        samples.append((time.perf_counter() - start) * 1e6)
+        assert response.status_code in (200, 304), response.status_code
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--breeds', type=int, default=172)  # about the size of thedogapi catalog
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_environment()  # allows the 'testserver' host of the test client
+    mirror.publish(BreedCatalog(synthetic_catalog(args.breeds)), save=False)
+    rng = random.Random(7)
+    queries = [rng.sample(FILTER_POOL, rng.randint(0, 2)) for _ in range(args.requests)]
+    client = Client()
+
+    etags = {}
+    for filters in queries:
+        etags[tuple(filters)] = client.get('/api/breeds/', {'filter': filters})['ETag']
+
+    print(f"{args.breeds} breeds, {args.requests} requests, microseconds per request")
+    print(f"{'path':<8} {'median':>8} {'p95':>8}")
+    for label, kwargs in [
+        ('cold', {'before': breed_responses.clear}),
+        ('warm', {}),
+        ('304', {'headers': lambda filters: {'HTTP_IF_NONE_MATCH': etags[tuple(filters)]}}),
+    ]:
+        median, p95 = measure(client, queries, **kwargs)
+        print(f"{label:<8} {median:8.0f} {p95:8.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Memory and per request decode cost of the breed catalog: the list of dicts we used to
+keep in the cache (and unpickle on every GET /api/breeds/) vs BreedTable.
+
+"per request" is what one request reads from the cache backend: the whole dict list
+before, only the (version, fetched_at) token now. The table itself is only unpickled
+when a worker adopts a new version.
+
+Run from the project root:
+    python benchmarks/bench_catalog_memory.py [--breeds 172 10000]
+"""
+import argparse
+import pickle
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_breed_index import synthetic_catalog  # noqa: E402
+from dogs.breed_table import BreedTable  # noqa: E402
+
+
+def allocated(build):
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def per_call_us(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--breeds', type=int, nargs='+', default=[172, 10000])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'breeds':>7} {'':<12} {'memory KiB':>11} {'pickled KiB':>12} {'unpickle us':>12}")
+    for size in args.breeds:
+        payload = pickle.dumps(synthetic_catalog(size))  # decoding it gives fresh strings, like a cache.get
+        table, table_memory = allocated(lambda: BreedTable.from_dicts(pickle.loads(payload)))
+        dicts, dict_memory = allocated(lambda: pickle.loads(payload))
+        rows = [
+            ('dict list', dict_memory, payload),
+            ('BreedTable', table_memory, pickle.dumps(table)),
+            ('token', None, pickle.dumps(('0123456789abcdef', time.time()))),
+        ]
+        for label, memory, pickled in rows:
+            decode = per_call_us(lambda: pickle.loads(pickled), args.repeat)
+            memory_text = f"{memory / 1024:11.1f}" if memory is not None else f"{'-':>11}"
+            print(f"{size:7} {label:<12} {memory_text} {len(pickled) / 1024:12.1f} {decode:12.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
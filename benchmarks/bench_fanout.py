@@ -0,0 +1,85 @@
+"""
+Latency of the breed details lookup against local stub upstreams with injected delay:
+the old sequential thedogapi search + Giphy calls vs the fan-out in dogs.details.
+
+Run from the project root:
+    python benchmarks/bench_fanout.py [--dog-latency 0.15] [--giphy-latency 0.2] [--requests 20]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import statistics
+import time
+
+import _django  # noqa: F401
+import requests
+from django.core.cache import cache
+from django.test import override_settings
+
+from dogs import details
+from dogs.catalog import fetch_catalog, mirror
+from dogs.fake_upstream import FakeUpstream
+from dogs.gif_cache import gif_cache
+
+
+def sequential(upstream, breed_name):
+    # What fetch_breed_details did before: search, then Giphy, each body parsed more than once
+    response = requests.get(f"{upstream.dogs_api_url}/search?q={breed_name}")
+    if response.status_code == 200 and response.json():
+        giphy_response = requests.get(f"{upstream.giphy_api_url}?api_key=x&q={breed_name}&limit=1")
+        if giphy_response.status_code == 200 and giphy_response.json()['data']:
+            return giphy_response.json()['data'][0]['images']['original']['url']
+
+
+def measure(fn, count):
+    samples = []
+    for _ in range(count):
+        gif_cache.clear()  # every sample is a gif cache miss
+        cache.delete(gif_cache._cache_key('akita'))
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def run(label, fn, count):
+    p50, worst = measure(fn, count)
+    print(f"{label:<44} p50 {p50:7.1f} ms   max {worst:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dog-latency', type=float, default=0.15)
+    parser.add_argument('--giphy-latency', type=float, default=0.2)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+    print(f"stub latency: thedogapi {args.dog_latency * 1000:.0f} ms, giphy {args.giphy_latency * 1000:.0f} ms")
+
+    # Catalog list endpoint down, so the breed lookup has to use the upstream search like before
+    cold = FakeUpstream(dog_latency=args.dog_latency, giphy_latency=args.giphy_latency, fail_paths={'/v1/breeds'})
+    with cold, override_settings(**cold.settings(), BREED_CATALOG_PATH=os.path.join(tempfile.mkdtemp(), 'none.json')):
+        mirror.clear()
+        cache.clear()
+        run("sequential search + giphy (old)", lambda: sequential(cold, 'akita'), args.requests)
+        run("fan-out, upstream search + giphy", lambda: details.resolve_breed_details('akita'), args.requests)
+        run("async fan-out, upstream search + giphy",
+            lambda: asyncio.run(details.aresolve_breed_details('akita')), args.requests)
+
+    warm = FakeUpstream(dog_latency=args.dog_latency, giphy_latency=args.giphy_latency)
+    with warm, override_settings(**warm.settings()):
+        mirror.clear()
+        cache.clear()
+        mirror.publish(fetch_catalog(), save=False)
+        run("fan-out, local catalog + giphy", lambda: details.resolve_breed_details('akita'), args.requests)
+
+    slow = FakeUpstream(dog_latency=args.dog_latency, giphy_latency=1.0)
+    with slow, override_settings(**slow.settings(), GIPHY_API_TIMEOUT=0.3):
+        mirror.clear()
+        cache.clear()
+        mirror.publish(fetch_catalog(), save=False)
+        run("fan-out, giphy 1 s with 0.3 s timeout", lambda: details.resolve_breed_details('akita'), 5)
+
+
+if __name__ == '__main__':
+    main()
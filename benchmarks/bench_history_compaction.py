@@ -0,0 +1,107 @@
+"""
+What moving the breed text out of the history rows buys: the database file size per
+search, a page of the newest searches read straight from SQLite, before and after the
+0008-0010 migrations, plus how long the compaction takes on an existing history.
+
+The history is seeded at 0007 (text copied into every row), then migrated forward.
+
+Run from the project root:
+    python benchmarks/bench_history_compaction.py [--rows 500000] [--page 100]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from dogs.fake_upstream import DEFAULT_BREEDS  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+from dogs.serializers import DogBreedHistorySerializer  # noqa: E402
+
+
+OLD_INSERT = "INSERT INTO dogs_dogbreed (name, description, image_url, time) VALUES (%s, %s, %s, %s)"
+OLD_PAGE = "SELECT name, description, image_url, time FROM dogs_dogbreed ORDER BY time DESC, id DESC LIMIT %s"
+NEW_PAGE = (
+    "SELECT b.name, b.description, b.image_url, h.time FROM dogs_dogbreed h"
+    " JOIN dogs_breed b ON b.id = h.breed_id ORDER BY h.time DESC, h.id DESC LIMIT %s"
+)
+
+
+def seed_old_rows(rows):
+    # Searches of the real breed list, as fetch_breed_details stored them before
+    rng = random.Random(1)
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, rows)):
+                breed = rng.choice(DEFAULT_BREEDS)
+                slug = breed['name'].lower().replace(' ', '-')
+                batch.append((breed['name'], breed['temperament'], f"https://media.giphy.test/{slug}.gif", now - timedelta(seconds=rows - i)))
+            cursor.executemany(OLD_INSERT, batch)
+
+
+def file_mb():
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")  # the migrations leave free pages behind, only VACUUM gives them back
+    return os.path.getsize(os.environ['DATABASE_PATH']) / 2**20
+
+
+def page_ms(sql, page, repeat=200):
+    samples = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql, [page])
+            cursor.fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def serialized_page_ms(page, repeat=200):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            DogBreedHistorySerializer(DogBreed.objects.select_related('breed').order_by('-time', '-id')[:page], many=True).data
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--page', type=int, default=100)
+    args = parser.parse_args()
+
+    call_command('migrate', 'dogs', '0007', verbosity=0)
+    seed_old_rows(args.rows)
+    before_mb, before_page = file_mb(), page_ms(OLD_PAGE, args.page)
+
+    started = time.perf_counter()
+    call_command('migrate', verbosity=0)
+    migrate_s = time.perf_counter() - started
+    after_mb, after_page = file_mb(), page_ms(NEW_PAGE, args.page)
+    serialized, queries = serialized_page_ms(args.page)
+
+    print(f"{args.rows} searches of {len(DEFAULT_BREEDS)} breeds, compaction took {migrate_s:.1f} s")
+    print(f"{'':<22} {'file MB':>8} {'bytes/search':>13} {f'page of {args.page} ms':>16}")
+    print(f"{'text in every row':<22} {before_mb:8.1f} {before_mb * 2**20 / args.rows:13.0f} {before_page:16.3f}")
+    print(f"{'breed foreign key':<22} {after_mb:8.1f} {after_mb * 2**20 / args.rows:13.0f} {after_page:16.3f}")
+    print(f"serialized page with select_related: {serialized:.2f} ms, {queries} query")
+
+
+if __name__ == '__main__':
+    main()
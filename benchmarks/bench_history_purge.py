@@ -0,0 +1,89 @@
+"""
+How long deleting the search history blocks concurrent history inserts: the old
+DogBreed.objects.all().delete(), the truncate fast path and the chunked purge job.
+
+A writer thread keeps inserting single rows (like the history sink does) while the
+delete runs, and we report the delete time plus the writer's worst insert latency.
+
+Run from the project root:
+    python benchmarks/bench_history_purge.py [--rows 200000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+from django.db import OperationalError, connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from dogs.fake_upstream import DEFAULT_BREEDS  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+from dogs.purge import PurgeJob, truncate_history  # noqa: E402
+
+
+def seed(rows):
+    DogBreed.objects.all().delete()
+    now = timezone.now()
+    DogBreed.objects.bulk_create([
+        DogBreed.from_details(DEFAULT_BREEDS[i % len(DEFAULT_BREEDS)]['name'], DEFAULT_BREEDS[i % len(DEFAULT_BREEDS)]['temperament'], time=now)
+        for i in range(rows)
+    ], batch_size=5000)
+
+
+def with_writer(delete):
+    latencies, errors = [], 0
+    stop = threading.Event()
+
+    def writer():
+        nonlocal errors
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                DogBreed.from_details('Pug', 'Playful').save()
+            except OperationalError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.005)
+        connection.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.1)
+    started = time.perf_counter()
+    delete()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    p99 = statistics.quantiles(latencies, n=100, method='inclusive')[98] if len(latencies) > 1 else latencies[0]
+    return elapsed, max(latencies), p99, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    modes = [
+        ('queryset.delete()', lambda: DogBreed.objects.all().delete()),
+        ('truncate fast path', truncate_history),
+        ('chunked purge job', lambda: PurgeJob(older_than=timezone.now()).run()),
+    ]
+    print(f"{args.rows} rows, sqlite at {os.environ['DATABASE_PATH']}")
+    print(f"{'mode':<20} {'delete s':>9} {'max insert ms':>14} {'p99 insert ms':>14} {'locked':>7}")
+    for label, delete in modes:
+        seed(args.rows)
+        elapsed, worst, p99, errors = with_writer(delete)
+        print(f"{label:<20} {elapsed:9.2f} {worst * 1000:14.1f} {p99 * 1000:14.1f} {errors:7}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+What the retention policy buys: a history spread over `--days` days, then everything older
+than `--keep` days moved to the daily archive files. Reports the live table, the keyword
+search and the full export before and after, the archive size and how fast an archived
+range streams back.
+
+Run from the project root:
+    python benchmarks/bench_history_retention.py [--rows 500000] [--days 120] [--keep 30]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+os.environ['HISTORY_ARCHIVE_DIR'] = os.path.join(TMP_DIR, 'archive')
+os.environ['HISTORY_PURGE_PAUSE'] = '0'
+
+import _django  # noqa: E402,F401
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from _history import generate_history  # noqa: E402
+from dogs.archive import archive_history, archived_rows, retention_cutoff  # noqa: E402
+from dogs.export import history_rows  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+from dogs.search import get_search_backend  # noqa: E402
+
+
+def median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def measure(repeat):
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+    searches = DogBreed.objects.order_by('-time', '-id')
+    return (
+        DogBreed.objects.count(),
+        os.path.getsize(os.environ['DATABASE_PATH']) / 2**20,
+        median_ms(lambda: list(get_search_backend().filter(searches, 'friendly loyal')[:100]), repeat),
+        median_ms(lambda: sum(1 for _ in history_rows(searches)), max(repeat // 10, 1)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--keep', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    generate_history(args.rows, days=args.days)
+    before = measure(args.repeat)
+
+    cutoff = retention_cutoff(args.keep)
+    start = time.perf_counter()
+    archived = archive_history(cutoff)
+    archive_s = time.perf_counter() - start
+    after = measure(args.repeat)
+    archive_mb = sum(entry.stat().st_size for entry in os.scandir(settings.HISTORY_ARCHIVE_DIR)) / 2**20
+
+    print(f"{'':<14} {'live rows':>10} {'db MB':>8} {'keyword page ms':>16} {'full export ms':>15}")
+    for label, (rows, mb, keyword_ms, export_ms) in (('all in sqlite', before), (f'keep {args.keep} days', after)):
+        print(f"{label:<14} {rows:>10} {mb:8.1f} {keyword_ms:16.2f} {export_ms:15.0f}")
+    archived_rows_total = sum(archived.values())
+    print(f"archived {archived_rows_total} rows in {len(archived)} daily files, {archive_mb:.1f} MB gzipped, {archive_s:.1f} s")
+    start = time.perf_counter()
+    streamed = sum(1 for _ in archived_rows(until=cutoff))
+    elapsed = time.perf_counter() - start
+    print(f"streamed the archived range back: {streamed} rows, {streamed / elapsed:.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
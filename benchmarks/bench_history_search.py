@@ -0,0 +1,62 @@
+"""
+Keyword search of the search history: old description__icontains scan vs the FTS5 index,
+on a synthetic history table in a throwaway SQLite file.
+
+Run from the project root (1M rows takes a minute or two to generate):
+    python benchmarks/bench_history_search.py [--rows 1000000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+
+from _history import generate_history  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+from dogs.search import IContainsBackend, SQLiteFTSBackend  # noqa: E402
+
+
+QUERIES = ['loyal', 'friend', 'energetic alert', 'stubborn playful', 'husky', 'courageous docile faithful', 'fun loving', 'siamese']
+
+
+def old_icontains(queryset, query):
+    return queryset.filter(breed__description__icontains=query)  # what user_search_history did before
+
+
+def measure(filter_fn, query, repeat):
+    page, counting = [], []
+    for _ in range(repeat):
+        queryset = filter_fn(DogBreed.objects.all(), query)
+        start = time.perf_counter()
+        list(queryset.order_by('-time', '-id')[:100])  # first page, what the endpoint returns
+        page.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        count = queryset.count()  # every match, what an export has to go through
+        counting.append((time.perf_counter() - start) * 1000)
+    return statistics.median(page), statistics.median(counting), count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    generate_history(args.rows)
+
+    fts, like = SQLiteFTSBackend(), IContainsBackend()
+    print("median ms for the first page / for counting every match")
+    print(f"{'query':<28} {'old icontains':>16} {'like per term':>16} {'fts5':>16} {'matches':>9}")
+    for query in QUERIES:
+        results = [measure(filter_fn, query, args.repeat) for filter_fn in (old_icontains, like.filter, fts.filter)]
+        cells = ''.join(f"{f'{page:.1f} / {count:.0f}':>16} " for page, count, _ in results)
+        print(f"{query:<28} {cells}{results[2][2]:>8}")
+
+if __name__ == '__main__':
+    main()
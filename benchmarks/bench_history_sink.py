@@ -0,0 +1,81 @@
+"""
+Throughput of POST /api/breeds/details/ with the search history sink on vs off, with
+several concurrent clients writing to a throwaway SQLite file.
+
+The catalog and the gif are preloaded, so the database write is the only real work.
+
+Run from the project root:
+    python benchmarks/bench_history_sink.py [--clients 16] [--seconds 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from dogs.catalog import BreedCatalog, mirror  # noqa: E402
+from dogs.fake_upstream import DEFAULT_BREEDS  # noqa: E402
+from dogs.gif_cache import gif_cache  # noqa: E402
+from dogs.history import history_sink  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+
+
+def run(clients, seconds):
+    stop = time.monotonic() + seconds
+    counts = [0] * clients
+    errors = [0] * clients
+
+    def client_loop(slot):
+        client = Client()
+        breeds = [breed['name'] for breed in DEFAULT_BREEDS]
+        while time.monotonic() < stop:
+            response = client.post('/api/breeds/details/', {'breed': breeds[counts[slot] % len(breeds)]}, content_type='application/json')
+            if response.status_code == 200:
+                counts[slot] += 1
+            else:
+                errors[slot] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client_loop, args=(slot,)) for slot in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    mirror.publish(BreedCatalog.from_api(DEFAULT_BREEDS), save=False)
+    for breed in DEFAULT_BREEDS:
+        gif_cache.set(breed['name'].lower(), 'https://media.giphy.test/dog.gif')
+
+    print(f"{args.clients} concurrent clients, {args.seconds:.0f} s per mode, sqlite at {os.environ['DATABASE_PATH']}")
+    for enabled in (False, True):
+        with override_settings(HISTORY_SINK_ENABLED=enabled):
+            before = DogBreed.objects.count()
+            rate, errors = run(args.clients, args.seconds)
+            history_sink.flush()
+            written = DogBreed.objects.count() - before
+        print(f"sink {'on ' if enabled else 'off'}: {rate:8.0f} POST/s   errors {errors}   rows written {written}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
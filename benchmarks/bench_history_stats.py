@@ -0,0 +1,100 @@
+"""
+"Top breeds this week" and the searches per day of the last week: counting the serialized
+history rows like an admin client had to vs reading the hour/day rollups (dogs/rollups.py),
+for growing history sizes in a throwaway SQLite file. Also times the backfill command and
+what counting a batch costs the history sink.
+
+Run from the project root (1M rows takes a few minutes to generate and count):
+    python benchmarks/bench_history_stats.py [--rows 10000,100000,1000000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from _history import generate_history  # noqa: E402
+from dogs.history import HistorySink  # noqa: E402
+from dogs.models import DogBreed  # noqa: E402
+from dogs.rollups import rebuild, time_series, top_breeds  # noqa: E402
+from dogs.serializers import DogBreedHistorySerializer  # noqa: E402
+
+
+def client_side(since):
+    # What the admin did before: every row of the week through the history serializer, counted afterwards
+    rows = DogBreedHistorySerializer(DogBreed.objects.select_related('breed').filter(time__gte=since).order_by('-time', '-id'), many=True).data
+    top = Counter(row['name'] for row in rows).most_common(10)
+    per_day = Counter(row['time'][:10] for row in rows)
+    return top, per_day
+
+
+def from_rollups(since, until):
+    return top_breeds('day', since, until, 10), time_series('day', since, until)
+
+
+def median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def sink_overhead(batch_size, repeat):
+    # One flush of the sink with and without counting the batch into the rollups
+    sink = HistorySink()
+    now = timezone.now()
+
+    def batch():
+        return [DogBreed.from_details(f'Breed {i % 40}', 'Loyal', 'No image available', time=now) for i in range(batch_size)]
+
+    def plain():
+        with transaction.atomic():
+            DogBreed.objects.bulk_create(batch(), batch_size=batch_size)
+
+    return median_ms(plain, repeat), median_ms(lambda: sink._write(batch()), repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='10000,100000,1000000', help="comma separated history sizes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=500, help="rows per sink flush")
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    print("median ms, last 7 days by day")
+    print(f"{'history rows':>12} {'client side':>12} {'rollups':>9} {'backfill s':>11}")
+    written = 0
+    for rows in (int(size) for size in args.rows.split(',')):
+        generate_history(rows - written, seed=rows, quiet=True)
+        written = rows
+        start = time.perf_counter()
+        rebuild()
+        backfill = time.perf_counter() - start
+        until = timezone.now()
+        since = until - timedelta(days=7)
+        old = median_ms(lambda: client_side(since), args.repeat)
+        new = median_ms(lambda: from_rollups(since, until), args.repeat)
+        print(f"{rows:>12} {old:12.1f} {new:9.2f} {backfill:11.1f}")
+
+    with override_settings(HISTORY_SINK_BATCH_SIZE=args.batch_size):
+        plain, counted = sink_overhead(args.batch_size, args.repeat * 5)
+    print(f"sink flush of {args.batch_size} rows: {plain:.1f} ms insert only, {counted:.1f} ms with the rollups")
+
+
+if __name__ == '__main__':
+    main()
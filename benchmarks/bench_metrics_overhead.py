@@ -0,0 +1,73 @@
+"""
+What the timing middleware and the metrics hooks add to a request: the same warm
+requests with METRICS_ENABLED on and off, compared with METRICS_OVERHEAD_BUDGET_US.
+
+Run from the project root:
+    python benchmarks/bench_metrics_overhead.py [--requests 3000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from dogs.catalog import BreedCatalog, mirror  # noqa: E402
+from dogs.fake_upstream import DEFAULT_BREEDS  # noqa: E402
+from dogs.gif_cache import gif_cache  # noqa: E402
+from dogs.history import history_sink  # noqa: E402
+
+
+REQUESTS = {
+    'GET /api/breeds/': lambda client: client.get('/api/breeds/', {'filter': 'loyal'}),
+    'POST /api/breeds/details/': lambda client: client.post('/api/breeds/details/', {'breed': 'akita'}, content_type='application/json'),
+}
+
+
+def median_us(client, send, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        send(client)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    mirror.publish(BreedCatalog.from_api(DEFAULT_BREEDS), save=False)
+    for breed in DEFAULT_BREEDS:
+        gif_cache.set(breed['name'].lower(), 'https://media.giphy.test/dog.gif')
+    client = Client()
+
+    print(f"median microseconds per request, best of {args.rounds} rounds, budget {settings.METRICS_OVERHEAD_BUDGET_US} us")
+    print(f"{'request':<28} {'metrics off':>12} {'metrics on':>11} {'overhead':>9}")
+    for label, send in REQUESTS.items():
+        results = {}
+        for enabled in (False, True):
+            with override_settings(METRICS_ENABLED=enabled):
+                send(client)  # warm up
+                results[enabled] = min(median_us(client, send, args.requests) for _ in range(args.rounds))
+        overhead = results[True] - results[False]
+        print(f"{label:<28} {results[False]:12.1f} {results[True]:11.1f} {overhead:9.1f}")
+    history_sink.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+What a docs visit costs: the schema drf_yasg generates for /swagger/?format=openapi (what
+Swagger UI and ReDoc loaded on every page view before) vs the precomputed file WhiteNoise
+serves, collected with the production storage into a throwaway STATIC_ROOT.
+
+Run from the project root:
+    python benchmarks/bench_openapi_schema.py [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.core.management import call_command  # noqa: E402
+from django.templatetags.static import static  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+
+PRODUCTION_STATIC = {
+    'DEBUG': False,
+    'STATIC_ROOT': os.path.join(TMP_DIR, 'staticfiles'),
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+    },
+}
+
+
+def median_ms(client, url, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        b''.join(response.streaming_content) if response.streaming else response.content
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    with override_settings(**PRODUCTION_STATIC):
+        call_command('generate_openapi_schema', verbosity=0)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        client = Client()  # WhiteNoise indexes STATIC_ROOT when the first request loads the middleware
+        spec_url = static('openapi/openapi.json')
+        print(f"median ms over {args.requests} requests")
+        for label, url in (
+            ('generated, ?format=openapi', '/swagger/?format=openapi'),
+            ('precomputed, WhiteNoise', spec_url),
+            ('Swagger UI page', '/swagger/'),
+        ):
+            ms, response = median_ms(client, url, args.requests)
+            print(f"{label:<28} {ms:8.2f}  {response.status_code}  Cache-Control: {response.get('Cache-Control', '-')}")
+        print(f"schema url in the UI: {spec_url}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Concurrent read/write stress test of the two database profiles (DATABASE_PROFILE in
+settings.py). Writer processes save searches like the history sink does, one small
+transaction at a time, while reader processes play the admin: history pages, keyword
+searches and exports of the newest rows. Every operation is one "request", Django's
+close_old_connections() runs around it like the request signals do.
+
+    default      rollback journal, a new connection per request
+    production   WAL, synchronous=NORMAL, mmap, busy timeout, BEGIN IMMEDIATE, persistent
+                 connections, admin reads on the read-only replica alias
+
+Every profile runs in a fresh interpreter on its own copy of the history.
+
+Run from the project root:
+    python benchmarks/bench_sqlite_concurrency.py [--writers 4] [--readers 4] [--seconds 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+PROFILES = ['default', 'production']
+
+
+def writer(seconds, batch, pause, results):
+    from django.db import OperationalError, close_old_connections
+
+    from dogs.history import HistorySink
+    from dogs.models import DogBreed
+
+    sink, latencies, errors = HistorySink(), [], 0
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            sink._write([DogBreed.from_details('Akita', 'Loyal', 'No image available') for _ in range(batch)])
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1  # database is locked
+        close_old_connections()
+        time.sleep(pause)
+    results.put(('write', latencies, errors))
+
+
+def reader(seconds, results):
+    from django.db import OperationalError, close_old_connections
+
+    from dogs.db import replica_reads
+    from dogs.export import history_rows
+    from dogs.models import DogBreed
+    from dogs.search import get_search_backend
+
+    history = DogBreed.objects.select_related('breed').order_by('-time', '-id')
+    reads = [
+        lambda: list(history[:100]),
+        lambda: list(get_search_backend().filter(history, 'friendly')[:100]),
+        lambda: sum(1 for _ in history_rows(history[:5000])),
+    ]
+    latencies, errors = [], 0
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            with replica_reads():  # what @use_replica does for the admin views
+                reads[len(latencies) % len(reads)]()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+        close_old_connections()
+    results.put(('read', latencies, errors))
+
+
+def child(args):
+    import multiprocessing
+
+    import _django  # noqa: F401
+    from django.core.management import call_command
+    from django.db import connections
+
+    from _history import generate_history
+
+    call_command('migrate', verbosity=0)
+    generate_history(args.rows, quiet=True)
+    connections.close_all()  # every forked worker opens its own
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=writer, args=(args.seconds, args.batch, args.pause, results)) for _ in range(args.writers)]
+    processes += [context.Process(target=reader, args=(args.seconds, results)) for _ in range(args.readers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {}
+    for kind in ('write', 'read'):
+        latencies = sorted(latency for k, samples, _ in collected if k == kind for latency in samples)
+        summary[kind] = {
+            'per_s': len(latencies) / args.seconds,
+            'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+            'locked': sum(errors for k, _, errors in collected if k == kind),
+        }
+    print(json.dumps(summary))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--batch', type=int, default=5, help="searches per write transaction")
+    parser.add_argument('--pause', type=float, default=0.01, help="seconds a writer waits between transactions")
+    parser.add_argument('--rows', type=int, default=100000, help="history rows before the test starts")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    print(f"{args.writers} writers ({args.batch} searches per transaction), {args.readers} admin readers, {args.seconds:.0f} s, {args.rows} rows")
+    print(f"{'profile':<11} {'writes/s':>9} {'p50 ms':>7} {'p99 ms':>8} {'locked':>7} {'reads/s':>9} {'p50 ms':>7} {'p99 ms':>8} {'locked':>7}")
+    for profile in PROFILES:
+        env = {**os.environ, 'DATABASE_PROFILE': profile, 'DATABASE_PATH': os.path.join(TMP_DIR, f'{profile}.sqlite3')}
+        output = subprocess.run([sys.executable, __file__, '--child', *sys.argv[1:]], env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        cells = []
+        for kind in ('write', 'read'):
+            stats = result[kind]
+            fmt = lambda value: f"{value:.1f}" if value is not None else '-'  # noqa: E731
+            cells += [f"{stats['per_s']:9.0f}", f"{fmt(stats['p50_ms']):>7}", f"{fmt(stats['p99_ms']):>8}", f"{stats['locked']:>7}"]
+        print(f"{profile:<11} {' '.join(cells)}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Worker startup: how long importing the WSGI module takes and how long a fresh process
+needs until its first successful GET /api/breeds/?filter=... and POST /api/breeds/details/,
+against stub upstreams with a slow /v1/breeds download.
+
+    cold      no snapshots, no warm-up: the first request downloads the breed list
+    lazy      catalog snapshot (preload_breed_catalog) read by the first request, no warm-up
+    warm-up   WARM_UP_ON_START with the catalog and gif snapshots (dogs/warmup.py)
+
+Every configuration runs in --runs fresh interpreters, the times are medians and count
+from the start of the interpreter.
+
+Run from the project root:
+    python benchmarks/bench_startup.py [--runs 5] [--dogs-latency 1.0]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+COLD_CATALOG_PATH = os.path.join(TMP_DIR, 'cold_catalog.json')  # written by the first cold request, removed before every run
+
+
+def child():
+    # A fresh worker: import the app like gunicorn does, then serve the first requests
+    started = float(os.environ['BENCH_STARTED'])
+    before_import = time.perf_counter()
+    import _django  # noqa: F401
+    from dogs_project.wsgi import application  # noqa: F401
+    imported = time.perf_counter()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()  # lets the test client's host in
+    client, firsts = Client(), {}
+    for label, send in (
+        ('breeds', lambda: client.get('/api/breeds/', {'filter': 'loyal'})),
+        ('details', lambda: client.post('/api/breeds/details/', {'breed': 'akita'}, content_type='application/json')),
+    ):
+        while send().status_code != 200:
+            time.sleep(0.01)
+        firsts[label] = time.time() - started
+    yasg = time.perf_counter()
+    import drf_yasg.views  # noqa: F401
+    print(json.dumps({
+        'import': imported - before_import,
+        'swagger': time.perf_counter() - yasg,
+        **firsts,
+    }))
+
+
+def run(env, runs):
+    results = []
+    for _ in range(runs):
+        if os.path.exists(COLD_CATALOG_PATH):
+            os.unlink(COLD_CATALOG_PATH)
+        output = subprocess.run(
+            [sys.executable, __file__, '--child'],
+            env={**env, 'BENCH_STARTED': repr(time.time())}, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(result[key] for result in results) * 1000 for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--dogs-latency', type=float, default=1.0, help="seconds the stub takes for /v1/breeds")
+    parser.add_argument('--giphy-latency', type=float, default=0.3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    import _django  # noqa: F401
+    from django.core.management import call_command
+    from django.test import override_settings
+
+    from dogs.catalog import fetch_catalog, save_snapshot
+    from dogs.fake_upstream import FakeUpstream
+    from dogs.gif_cache import GifCache
+
+    call_command('migrate', verbosity=0)
+    catalog_path = os.path.join(TMP_DIR, 'catalog.json')
+    gif_path = os.path.join(TMP_DIR, 'gifs.json')
+    with FakeUpstream(dog_latency=args.dogs_latency, giphy_latency=args.giphy_latency) as upstream:
+        env = {
+            **os.environ,
+            'DJANGO_DEVELOPMENT': 'True',
+            'DOGS_API_URL': upstream.dogs_api_url,
+            'GIPHY_API_URL': upstream.giphy_api_url,
+            'BREED_CATALOG_PATH': COLD_CATALOG_PATH,
+            'GIF_SNAPSHOT_PATH': os.path.join(TMP_DIR, 'no_gifs.json'),
+            'WARM_UP_ON_START': 'False',
+        }
+        # What preload_breed_catalog and the exiting workers of the previous deploy leave behind
+        with override_settings(**upstream.settings()):
+            save_snapshot(fetch_catalog(), catalog_path)
+        gifs = GifCache()
+        gifs.set('akita', 'https://media.giphy.test/akita.gif')
+        gifs.save_snapshot(gif_path)
+
+        configurations = {
+            'cold': env,
+            'lazy': {**env, 'BREED_CATALOG_PATH': catalog_path},
+            'warm-up': {**env, 'BREED_CATALOG_PATH': catalog_path, 'GIF_SNAPSHOT_PATH': gif_path, 'WARM_UP_ON_START': 'True'},
+        }
+        print(f"median ms over {args.runs} fresh processes, /v1/breeds takes {args.dogs_latency * 1000:.0f} ms, "
+              f"Giphy {args.giphy_latency * 1000:.0f} ms")
+        print(f"{'config':<8} {'wsgi import':>12} {'1st breeds':>11} {'1st details':>12}")
+        for name, config in configurations.items():
+            result = run(config, args.runs)
+            print(f"{name:<8} {result['import']:12.0f} {result['breeds']:11.0f} {result['details']:12.0f}")
+        print(f"drf_yasg.views, imported on the first /swagger/ request now: {result['swagger']:.0f} ms")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
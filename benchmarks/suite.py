@@ -0,0 +1,310 @@
+"""
+Load-test suite for every endpoint, with a stored baseline to catch regressions.
+
+Everything runs in this process against a throwaway SQLite file: the stub upstreams
+(dogs/fake_upstream.py, latency, error rate and payload size configurable), a synthetic
+search history (benchmarks/_history.py) and fixed seeds, so two runs on the same machine
+send exactly the same requests.
+
+    breeds_filters    GET /api/breeds/?filter=... with 1-3 random terms over a synthetic catalog
+    details_cached    POST /api/breeds/details/, gif already cached, history row enqueued
+    details_cold      POST /api/breeds/details/ with the gif cache off, every request waits on Giphy
+    history_page      GET /api/search-history/ first pages, half of them with a keyword
+    history_truncate  DELETE /api/search-history/delete/, the whole table in one statement
+    history_purge     DELETE /api/search-history/delete/?older_than=... until the job is done
+
+Each scenario reports throughput and latency percentiles. With --baseline the results
+are compared with a previous run and the script exits with 1 when throughput drops or
+p50/p95 grow by more than --tolerance. Baselines only mean something on the machine
+(and with the options) they were recorded with, a mismatch is printed as a warning.
+
+Run from the project root:
+    python benchmarks/suite.py [--quick] [--scenarios details_cold,history_page]
+    python benchmarks/suite.py --baseline benchmarks/baseline.json [--update-baseline]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(TMP_DIR, 'bench.sqlite3')
+os.environ['HISTORY_SPOOL_PATH'] = os.path.join(TMP_DIR, 'spool.ndjson')
+
+import _django  # noqa: E402,F401
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+from _history import generate_history  # noqa: E402
+from bench_breed_index import FILTER_POOL, synthetic_catalog  # noqa: E402
+from dogs.catalog import fetch_catalog, mirror  # noqa: E402
+from dogs.fake_upstream import FakeUpstream  # noqa: E402
+from dogs.gif_cache import gif_cache  # noqa: E402
+from dogs.history import history_sink  # noqa: E402
+from dogs.purge import truncate_history  # noqa: E402
+from dogs.upstream import reset_clients  # noqa: E402
+
+
+# What a change is allowed to cost before it counts as a regression, relative to the baseline
+METRICS = {'throughput': 'higher', 'p50_ms': 'lower', 'p95_ms': 'lower'}
+
+
+def post_details(client, rng, context):
+    return client.post('/api/breeds/details/', {'breed': rng.choice(context['names']).lower()}, content_type='application/json')
+
+
+def setup_breeds_filters(context):
+    def send(client, rng):
+        return client.get('/api/breeds/', {'filter': rng.sample(FILTER_POOL, rng.randint(1, 3))})
+    return send
+
+
+def setup_details_cached(context):
+    for name in context['names']:
+        gif_cache.set(name.lower(), 'https://media.giphy.test/dog.gif')
+    return lambda client, rng: post_details(client, rng, context)
+
+
+def setup_details_cold(context):
+    gif_cache.clear()
+    cache.clear()
+    context['settings'].update(GIF_CACHE_TTL=0, GIF_CACHE_NEGATIVE_TTL=0)
+    return lambda client, rng: post_details(client, rng, context)
+
+
+def setup_history_page(context):
+    reset_history(context['history_rows'])
+
+    def send(client, rng):
+        params = {'limit': 100}
+        if rng.random() < 0.5:
+            params['keyword'] = rng.choice(context['keywords'])
+        return client.get('/api/search-history/', params, **context['auth'])
+    return send
+
+
+def setup_history_truncate(context):
+    def before():
+        reset_history(context['delete_rows'])
+
+    def send(client, rng):
+        return client.delete('/api/search-history/delete/', **context['auth'])
+    send.before = before
+    return send
+
+
+def setup_history_purge(context):
+    def before():
+        context['cutoff'] = reset_history(context['delete_rows']) - timedelta(days=15)  # about half the rows
+
+    def send(client, rng):
+        response = client.delete(f"/api/search-history/delete/?older_than={context['cutoff'].isoformat().replace('+', '%2B')}", **context['auth'])
+        if response.status_code != 202:
+            return response
+        progress_url = f"/api/search-history/delete/{response.json()['data']['id']}/"
+        while True:  # the request is done when the rows are gone, like for a client polling the progress
+            progress = client.get(progress_url, **context['auth'])
+            if progress.status_code != 200 or progress.json()['data']['status'] == 'done':
+                return progress
+            if progress.json()['data']['status'] == 'failed':
+                raise RuntimeError(f"purge job failed: {progress.json()['data']}")
+            time.sleep(0.005)
+    send.before = before
+    return send
+
+
+# requests and client threads per scenario, --quick divides the requests by 5
+SCENARIOS = {
+    'breeds_filters': {'setup': setup_breeds_filters, 'requests': 3000, 'clients': 1, 'expect': {200}},
+    'details_cached': {'setup': setup_details_cached, 'requests': 2000, 'clients': 1, 'expect': {200}},
+    'details_cold': {'setup': setup_details_cold, 'requests': 500, 'clients': 8, 'expect': {200}},
+    'history_page': {'setup': setup_history_page, 'requests': 500, 'clients': 1, 'expect': {200}},
+    'history_truncate': {'setup': setup_history_truncate, 'requests': 30, 'clients': 1, 'expect': {204}},
+    'history_purge': {'setup': setup_history_purge, 'requests': 15, 'clients': 1, 'expect': {200}},
+}
+
+
+def reset_history(rows):
+    history_sink.flush()
+    truncate_history()
+    return generate_history(rows, quiet=True)
+
+
+def run_scenario(send, requests, clients, expect, seed):
+    samples, unexpected = [], {}
+    lock = threading.Lock()
+    before = getattr(send, 'before', None)
+
+    def worker(index, count):
+        client = Client()
+        rng = random.Random(seed * 1000 + index)
+        mine, statuses = [], {}
+        for _ in range(count):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            response = send(client, rng)
+            mine.append(time.perf_counter() - start)
+            if response.status_code not in expect:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        connection.close()
+        with lock:
+            samples.extend(mine)
+            for code, count in statuses.items():
+                unexpected[code] = unexpected.get(code, 0) + count
+
+    shares = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+    threads = [threading.Thread(target=worker, args=(i, share)) for i, share in enumerate(shares)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if before is not None:  # the untimed setup ran on the same clock, count only the requests
+        elapsed = sum(samples) / clients
+
+    ms = sorted(sample * 1000 for sample in samples)
+    p50, p95, p99 = (statistics.quantiles(ms, n=100, method='inclusive')[q - 1] for q in (50, 95, 99))
+    return {
+        'requests': len(samples),
+        'throughput': round(len(samples) / elapsed, 1),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'max_ms': round(ms[-1], 2),
+        'unexpected': {str(code): count for code, count in sorted(unexpected.items())},
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Regressions of `results` against `baseline['scenarios']`, one line each."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        for metric, better in METRICS.items():
+            old, new = previous[metric], result[metric]
+            if better == 'higher' and new < old * (1 - tolerance):
+                regressions.append(f"{name}: {metric} {old} -> {new} ({(new / old - 1) * 100:+.0f}%)")
+            # Sub-millisecond latencies move by more than any sane tolerance from one run to the next
+            elif better == 'lower' and new > old * (1 + tolerance) and new - old > min_delta_ms:
+                regressions.append(f"{name}: {metric} {old} -> {new} ({(new / old - 1) * 100:+.0f}%)")
+    return regressions
+
+
+def environment(args):
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'history_rows': args.history_rows,
+        'upstream': {'latency': args.latency, 'error_rate': args.error_rate, 'payload_bytes': args.payload_bytes},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--quick', action='store_true', help="a fifth of the requests, for a smoke run")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--breeds', type=int, default=2000, help="breeds served by the stub thedogapi")
+    parser.add_argument('--history-rows', type=int, default=200_000)
+    parser.add_argument('--delete-rows', type=int, default=5000, help="rows recreated before every delete request")
+    parser.add_argument('--latency', type=float, default=0.02, help="stub upstream latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--payload-bytes', type=int, default=0, help="filler added to every upstream answer")
+    parser.add_argument('--baseline', help="JSON file with the results of a previous run")
+    parser.add_argument('--update-baseline', action='store_true', help="write this run's results to --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed relative change before a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="latency changes smaller than this never count")
+    args = parser.parse_args()
+    names = args.scenarios.split(',')
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    admin = User.objects.create_superuser('bench', 'bench@example.com', 'bench')
+    rng = random.Random(args.seed)
+    breeds = [
+        {'id': i, 'name': breed['name'], 'temperament': breed['description']}
+        for i, breed in enumerate(synthetic_catalog(args.breeds, seed=args.seed))
+    ]
+    upstream = FakeUpstream(breeds=breeds, latency=args.latency, error_rate=args.error_rate,
+                            payload_bytes=args.payload_bytes, seed=args.seed)
+    context = {
+        'breeds': breeds,
+        'names': rng.sample([breed['name'] for breed in breeds], min(200, len(breeds))),
+        'keywords': ['loyal', 'friend', 'alert playful', 'terrier', 'calm', 'energetic'],
+        'history_rows': args.history_rows // (5 if args.quick else 1),
+        'delete_rows': args.delete_rows,
+        'auth': {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(admin).access_token}"},
+    }
+
+    results = {}
+    print(f"stub latency {args.latency * 1000:.0f} ms, error rate {args.error_rate:.0%}, payload +{args.payload_bytes} B, "
+          f"{os.cpu_count()} CPU(s)")
+    print(f"{'scenario':<17} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  unexpected")
+    with upstream, override_settings(**upstream.settings(), GIPHY_API_KEY='bench', BREED_CATALOG_PATH=os.path.join(TMP_DIR, 'catalog.json')):
+        reset_clients()
+        mirror.clear()
+        mirror.publish(fetch_catalog(), save=False)
+        for name in names:
+            scenario = SCENARIOS[name]
+            context['settings'] = {}
+            send = scenario['setup'](context)
+            requests = max(scenario['requests'] // (5 if args.quick else 1), scenario['clients'])
+            with override_settings(**context['settings']):
+                results[name] = run_scenario(send, requests, scenario['clients'], scenario['expect'], args.seed)
+            history_sink.flush()
+            result = results[name]
+            print(f"{name:<17} {result['requests']:>8} {result['throughput']:8.1f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                  f"{result['p99_ms']:8.2f} {result['max_ms']:8.2f}  {result['unexpected'] or '-'}")
+
+    failed = [name for name, result in results.items() if result['unexpected']]
+    for name in failed:
+        print(f"FAILED {name}: unexpected statuses {results[name]['unexpected']}")
+    run = {'environment': environment(args), 'scenarios': results}
+    if not args.baseline:
+        return 1 if failed else 0
+    if args.update_baseline:
+        if failed:
+            print("not writing a baseline with failed scenarios")
+            return 1
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+            f.write('\n')
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['environment'] != run['environment']:
+        print(f"warning: baseline recorded with {baseline['environment']}, this run is {run['environment']}")
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions or failed:
+        return 1
+    print(f"no regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,4 +2,4 @@ from django.contrib import admin
 from .models import DogBreed
 
 # Registrar el modelo DogBreed
-admin.site.register(DogBreed)
\ No newline at end of file
+admin.site.register(DogBreed, list_select_related=['breed'])
\ No newline at end of file
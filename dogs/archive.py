@@ -0,0 +1,150 @@
+import gzip
+import heapq
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .export import TIME_FORMAT
+from .models import DogBreed
+from .purge import delete_in_batches
+from .rollups import bucket_start
+from .search import TERM_RE, parse_terms
+
+
+# One gzipped NDJSON file per UTC day, rows newest first like the history endpoint
+ARCHIVE_FIELDS = ('id', 'breed__name', 'breed__description', 'breed__image_url', 'time')
+ARCHIVE_NAME_RE = re.compile(r'^history-(\d{4}-\d{2}-\d{2})\.ndjson\.gz$')
+
+
+def retention_cutoff(days=None, now=None):
+    """Start of the oldest UTC day kept in the database, None when retention is off (0 days)."""
+    days = settings.HISTORY_RETENTION_DAYS if days is None else days
+    if not days:
+        return None
+    return bucket_start((now or timezone.now()) - timedelta(days=days), 'day')
+
+
+def archive_path(day):
+    return os.path.join(settings.HISTORY_ARCHIVE_DIR, f"history-{day:%Y-%m-%d}.ndjson.gz")
+
+
+def archived_days():
+    """Days (UTC midnight) that have an archive file, oldest first."""
+    try:
+        names = os.listdir(settings.HISTORY_ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        datetime.strptime(match[1], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+        for match in map(ARCHIVE_NAME_RE.match, names) if match
+    )
+
+
+def read_archive(day):
+    """Rows of one archived day as they were written, newest first."""
+    try:
+        with gzip.open(archive_path(day), 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def archive_row(search_id, name, description, image_url, searched_at):
+    # Fixed width UTC times, so rows sort as strings when merging with an existing file
+    return {
+        'id': search_id,
+        'name': name,
+        'description': description,
+        'image_url': image_url,
+        'time': searched_at.astimezone(dt_timezone.utc).isoformat(timespec='microseconds'),
+    }
+
+
+def archive_day(day):
+    """
+    Moves the searches of one UTC day from the database to its archive file, returns how
+    many rows were added to it. The file is written next to the old one and renamed over
+    it, so it's always complete before any row is deleted. Rows already in it (a run
+    stopped before the delete, spooled rows replayed late) are not written twice.
+    """
+    searches = DogBreed.objects.filter(time__gte=day, time__lt=day + timedelta(days=1))
+    path = archive_path(day)
+    known = {row['id'] for row in read_archive(day)}
+    added, last_id = 0, None
+
+    def new_rows():
+        nonlocal added, last_id
+        for values in searches.order_by('-time', '-id').values_list(*ARCHIVE_FIELDS).iterator(chunk_size=2000):
+            last_id = values[0] if last_id is None else max(last_id, values[0])
+            if values[0] not in known:
+                added += 1
+                yield archive_row(*values)
+
+    os.makedirs(settings.HISTORY_ARCHIVE_DIR, exist_ok=True)
+    with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as archive:
+        for row in heapq.merge(read_archive(day), new_rows(), key=lambda row: (row['time'], row['id']), reverse=True):
+            archive.write(json.dumps(row) + '\n')
+    if last_id is None:
+        os.unlink(f"{path}.tmp")
+        return 0
+    os.replace(f"{path}.tmp", path)
+    # Rows of that day saved while we were writing have a higher id, the next run takes them
+    delete_in_batches(searches.filter(id__lte=last_id))
+    return added
+
+
+def archive_history(cutoff=None):
+    """
+    Archives every whole UTC day before `cutoff` (default: HISTORY_RETENTION_DAYS ago),
+    oldest first, returns {day: rows archived}. The hour and day rollups are kept, so the
+    stats still cover the archived days.
+    """
+    cutoff = cutoff or retention_cutoff()
+    if cutoff is None:
+        return {}
+    cutoff = bucket_start(cutoff, 'day')
+    archived = {}
+    while True:
+        oldest = DogBreed.objects.filter(time__lt=cutoff).aggregate(oldest=Min('time'))['oldest']
+        if oldest is None:
+            return archived
+        day = bucket_start(oldest, 'day')
+        archived[day] = archived.get(day, 0) + archive_day(day)
+
+
+def matches(row, terms):
+    # Same rule as the FTS5 prefix queries: every keyword starts a word of the name or description
+    words = TERM_RE.findall(f"{row['name']} {row['description'] or ''}".lower())
+    return all(any(word.startswith(term) for word in words) for term in terms)
+
+
+def archived_rows(since=None, until=None, keyword=None):
+    """
+    Archived searches made between `since` and `until`, newest first, in the export format.
+    Only the files of the days in range are opened, one at a time.
+    """
+    terms = parse_terms(keyword) if keyword else []
+    for day in reversed(archived_days()):
+        if until is not None and day >= until:
+            continue
+        if since is not None and day + timedelta(days=1) <= since:
+            break
+        for row in read_archive(day):
+            searched_at = parse_datetime(row['time'])
+            if (until is not None and searched_at >= until) or (since is not None and searched_at < since):
+                continue
+            if terms and not matches(row, terms):
+                continue
+            yield {
+                'name': row['name'],
+                'description': row['description'],
+                'image_url': row['image_url'],
+                'time': timezone.localtime(searched_at).strftime(TIME_FORMAT),
+            }
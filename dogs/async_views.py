@@ -0,0 +1,106 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .catalog import CatalogUnavailable, aget_catalog
+from .details import aresolve_breed_details, asuggest_breeds
+from .history import history_sink
+from .metrics import cache_result
+from .models import DogBreed
+from .response_cache import breed_responses, etag_matches, make_etag, normalize_filters
+from .serializers import DogBreedSerializer
+from .upstream import RateLimited
+from .views import rate_limited_response
+
+
+# DRF's @api_view can't wrap coroutines, so the async variants are plain Django views with the same responses.
+# Under ASGI (SERVER_MODE=asgi, see gunicorn.conf.py) they run on the event loop and the upstream calls don't hold a worker thread.
+
+JSON = 'application/json'
+
+
+@require_GET
+async def get_dog_breeds_async(request):
+    search_terms = request.GET.getlist('filter')
+
+    try:
+        catalog = await aget_catalog()
+    except CatalogUnavailable as e:
+        if e.retry_after:
+            return rate_limited_response(e, JsonResponse)
+        return JsonResponse({"error": "Failed to fetch breeds from DogsAPI"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # JSON only, so the ETag and the cached bytes are the ones GET /api/breeds/ uses for application/json
+    terms = normalize_filters(search_terms)
+    headers = {
+        'ETag': make_etag(catalog.version, JSON, terms),
+        'Cache-Control': f"public, max-age={settings.BREEDS_CACHE_MAX_AGE}",
+        'Vary': 'Accept',
+    }
+    if etag_matches(request, headers['ETag']):
+        return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    entry = breed_responses.get(catalog.version, (JSON, terms))
+    cache_result('breeds_response', hit=entry is not None)
+    if entry is None:
+        data = {
+            "status": "success",
+            "data": catalog.index.search(terms),
+        }
+        entry = (data, JSONRenderer().render(data, JSON))
+        breed_responses.set(catalog.version, (JSON, terms), entry)
+
+    return HttpResponse(entry[1], content_type=JSON, status=status.HTTP_200_OK, headers=headers)
+
+
+@csrf_exempt
+@require_POST
+async def fetch_breed_details_async(request):
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        payload = {}
+    breed_name = payload.get('breed', '') if isinstance(payload, dict) else ''
+
+    if not isinstance(breed_name, str):
+        return JsonResponse({
+            "error": "Invalid breed",
+            "details": "The breed name must be a string."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if breed_name:
+        try:
+            details = await aresolve_breed_details(breed_name)
+        except RateLimited as e:
+            return rate_limited_response(e, JsonResponse)
+
+        if details:
+            match = details.pop('match', None)
+            if match is None:
+                # Save user search to database in case admin wants that info
+                dog_breed = await history_sink.aadd(**details) # usually only enqueues the row
+            else:
+                dog_breed = DogBreed.from_details(**details) # a guess from a misspelling, not recorded
+
+            serializer = DogBreedSerializer(dog_breed)
+            return JsonResponse({
+                "status": "success",
+                "data": {**serializer.data, **(match or {})}
+            }, status=status.HTTP_200_OK)
+
+        return JsonResponse({
+            "error": "Breed not found",
+            "details": f"Could not find breed '{breed_name}' in external API",
+            "suggestions": await asuggest_breeds(breed_name),
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse({
+        "error": "No breed specified",
+        "details": "Please provide a breed name in the request body."
+    }, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import TokenVersion
+
+
+TOKEN_VERSION_CLAIM = 'token_version'
+CLAIM_FIELDS = {'is_staff', 'is_superuser', 'is_active', 'password'}  # changing one of these revokes the user's tokens
+
+
+def load_user_state(user_id):
+    """(is_active, token version) of a user from the database, None when there is no such user."""
+    row = get_user_model().objects.filter(pk=user_id).values_list('is_active', 'token_version__version').first()
+    if row is None:
+        return None
+    return row[0], row[1] or 0
+
+
+class AuthCache:
+    """
+    What StatelessJWTAuthentication would otherwise redo on every request, per process and
+    bounded: verified tokens (until they expire, JWT_TOKEN_CACHE_SIZE of them) and the
+    state of their users (for JWT_USER_STATE_TTL seconds).
+    """
+
+    def __init__(self):
+        self._tokens = OrderedDict()  # raw token -> validated token
+        self._users = OrderedDict()  # str(user id) -> ((is_active, version) or None, expires_at)
+        self._lock = threading.Lock()
+
+    def token(self, raw_token):
+        with self._lock:
+            token = self._tokens.get(raw_token)
+            if token is None:
+                return None
+            if token['exp'] <= time.time():
+                del self._tokens[raw_token]
+                return None
+            self._tokens.move_to_end(raw_token)
+            return token
+
+    def add_token(self, raw_token, token):
+        with self._lock:
+            self._tokens[raw_token] = token
+            while len(self._tokens) > settings.JWT_TOKEN_CACHE_SIZE:
+                self._tokens.popitem(last=False)
+
+    def user_state(self, user_id):
+        user_id = str(user_id)  # the token's user_id claim is a string
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._users.move_to_end(user_id)
+                return entry[0]
+        state = load_user_state(user_id)
+        with self._lock:
+            self._users[user_id] = (state, time.monotonic() + settings.JWT_USER_STATE_TTL)
+            self._users.move_to_end(user_id)
+            while len(self._users) > settings.JWT_TOKEN_CACHE_SIZE:
+                self._users.popitem(last=False)
+        return state
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+
+auth_cache = AuthCache()
+
+
+def refresh_token_for(user):
+    """RefreshToken.for_user() plus the claims the stateless authentication needs, copied to its access tokens."""
+    token = RefreshToken.for_user(user)
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    state = load_user_state(user.pk)
+    token[TOKEN_VERSION_CLAIM] = state[1] if state else 0
+    return token
+
+
+def revoke_tokens(user_id):
+    """Every token issued to the user so far stops working, right away in this worker, within JWT_USER_STATE_TTL in the others."""
+    if not TokenVersion.objects.filter(user_id=user_id).update(version=F('version') + 1):
+        _, created = TokenVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+        if not created:
+            TokenVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+    auth_cache.forget(user_id)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWTAuthentication without loading the User on every request: the staff flags come from
+    the token's claims (request.user is a TokenUser) and the token is only checked against
+    the user's token version, both cached by AuthCache. Tokens issued before the claims
+    existed are still checked against the database like JWTAuthentication does.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = auth_cache.token(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            auth_cache.add_token(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return JWTAuthentication.get_user(self, validated_token)
+        state = auth_cache.user_state(validated_token.get(api_settings.USER_ID_CLAIM))
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        is_active, version = state
+        if not is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if validated_token[TOKEN_VERSION_CLAIM] != version:
+            raise InvalidToken(_("Token has been revoked"))
+        return super().get_user(validated_token)
+
+
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return refresh_token_for(user)
+
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    # Refreshing is rare, the version is read from the database rather than the cache
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if TOKEN_VERSION_CLAIM in refresh:
+            state = load_user_state(refresh.get(api_settings.USER_ID_CLAIM))
+            if state is None or refresh[TOKEN_VERSION_CLAIM] != state[1]:
+                raise InvalidToken(_("Token has been revoked"))
+        return super().validate(attrs)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def revoke_on_claim_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A demoted, deactivated or re-passworded user loses the tokens that still say otherwise
+    if raw or instance.pk is None or (update_fields is not None and not CLAIM_FIELDS & set(update_fields)):
+        return
+    saved = sender.objects.filter(pk=instance.pk).values(*CLAIM_FIELDS).first()
+    if saved is not None and any(saved[field] != getattr(instance, field) for field in CLAIM_FIELDS):
+        revoke_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_deleted_user(sender, instance, **kwargs):
+    auth_cache.forget(instance.pk)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import threading
+from functools import reduce
+
+
+GRAM_SIZE = 3
+MAX_CACHED_TERMS = 4096  # per index, so a flood of random filters can't grow it forever
+SEPARATOR = '\x00'  # glue between name and description, can't show up in a real term
+
+
+def catalog_version(breeds):
+    # Short content hash of the catalog, changes whenever a name or description changes
+    payload = json.dumps(list(breeds), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+class BreedIndex:
+    """
+    Precomputed filter index over the breed catalog.
+
+    Keeps the same semantics as the old linear scan (a term matches a breed if it is a
+    substring of its lowercased name or description) but answers it from posting sets:
+    terms shorter than GRAM_SIZE are looked up directly, longer terms intersect the
+    postings of their grams and only verify the few candidates left.
+    """
+
+    def __init__(self, breeds, version=None):
+        self.breeds = breeds
+        self.version = version or catalog_version(breeds)
+        self.names = [breed['name'] for breed in breeds]
+        # Lowercase once here instead of on every request
+        self.texts = [
+            f"{breed['name'].lower()}{SEPARATOR}{(breed['description'] or '').lower()}"
+            for breed in breeds
+        ]
+        self.all_ids = frozenset(range(len(breeds)))
+        self.short = {}  # substrings shorter than GRAM_SIZE -> breed ids
+        self.grams = {}  # every GRAM_SIZE substring -> breed ids
+        for breed_id, text in enumerate(self.texts):
+            for size in range(1, GRAM_SIZE + 1):
+                postings = self.grams if size == GRAM_SIZE else self.short
+                for start in range(len(text) - size + 1):
+                    gram = text[start:start + size]
+                    if SEPARATOR in gram:
+                        continue
+                    postings.setdefault(gram, set()).add(breed_id)
+        self._term_cache = {}
+        self._lock = threading.Lock()
+
+    def match(self, term):
+        """Ids of the breeds whose name or description contains `term` (already lowercased)."""
+        cached = self._term_cache.get(term)
+        if cached is not None:
+            return cached
+
+        if not term:
+            result = self.all_ids
+        elif SEPARATOR in term:
+            result = frozenset()
+        elif len(term) < GRAM_SIZE:
+            result = frozenset(self.short.get(term, ()))
+        else:
+            postings = []
+            for start in range(len(term) - GRAM_SIZE + 1):
+                gram_ids = self.grams.get(term[start:start + GRAM_SIZE])
+                if not gram_ids:
+                    postings = None
+                    break
+                postings.append(gram_ids)
+            if postings is None:
+                result = frozenset()
+            else:
+                postings.sort(key=len)
+                candidates = reduce(set.intersection, postings[1:], set(postings[0]))
+                # Grams can match out of order ("abcxbcd" has every gram of "abcd"), so verify
+                result = frozenset(i for i in candidates if term in self.texts[i])
+
+        with self._lock:
+            if len(self._term_cache) >= MAX_CACHED_TERMS:
+                self._term_cache.clear()
+            self._term_cache[term] = result
+        return result
+
+    def search(self, terms):
+        """Names of the breeds matching every term, in catalog order."""
+        if not terms:
+            return list(self.names)
+        matches = sorted((self.match(term.lower()) for term in set(terms)), key=len)
+        result = reduce(frozenset.intersection, matches[1:], matches[0])
+        return [self.names[breed_id] for breed_id in sorted(result)]
+
@@ -0,0 +1,94 @@
+import re
+from collections import Counter, namedtuple
+
+
+GRAM_SIZE = 3
+WORD_FLOOR = 0.25  # word pairs scoring less only share a gram or two, they count as no match
+WORD_RE = re.compile(r'[^\W_]+')
+
+# score: average over the query words of their best Dice coefficient against a word of the name,
+# worst: the lowest of those, a query word that matches nothing in the name keeps it at 0
+Match = namedtuple('Match', ['name_id', 'score', 'worst'])
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def word_grams(word):
+    # Padded, so the first letters weigh a bit more than the rest
+    padded = f"{' ' * (GRAM_SIZE - 1)}{word} "
+    return {padded[start:start + GRAM_SIZE] for start in range(len(padded) - GRAM_SIZE + 1)}
+
+
+class NameMatcher:
+    """
+    Trigram index over the words of the breed names, for the typos thedogapi search can't
+    resolve ("akitta", "german shepard").
+
+    Every query word is compared to the distinct name words sharing a trigram with it,
+    then names are ranked by how well each query word found a counterpart, so word order
+    doesn't matter and "golden retriever" doesn't turn into "Labrador Retriever".
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.lower_names = [name.lower() for name in names]
+        self.words = []
+        self.word_names = []  # word id -> ids of the names using it
+        self.name_words = []  # name id -> its word ids
+        self.gram_counts = []
+        self.postings = {}  # gram -> word ids
+        word_ids = {}
+        for name_id, name in enumerate(names):
+            ids = []
+            for word in normalize(name).split():
+                word_id = word_ids.get(word)
+                if word_id is None:
+                    word_id = word_ids[word] = len(self.words)
+                    self.words.append(word)
+                    self.word_names.append([])
+                    grams = word_grams(word)
+                    self.gram_counts.append(len(grams))
+                    for gram in grams:
+                        self.postings.setdefault(gram, []).append(word_id)
+                if not self.word_names[word_id] or self.word_names[word_id][-1] != name_id:
+                    self.word_names[word_id].append(name_id)
+                ids.append(word_id)
+            self.name_words.append(tuple(ids))
+
+    def rank(self, query, limit=5):
+        """Up to `limit` Matches, best first."""
+        per_word = [self._word_scores(word) for word in normalize(query).split()]
+        if not per_word:
+            return []
+        candidates = {name_id for scores in per_word for word_id in scores for name_id in self.word_names[word_id]}
+        matches = []
+        for name_id in candidates:
+            name_words = self.name_words[name_id]
+            best = [max([scores.get(word_id, 0.0) for word_id in name_words]) for scores in per_word]
+            matches.append((sum(best) / len(best), min(best), name_id))
+        matches.sort(key=lambda match: (-match[0], match[2]))
+        return [Match(name_id, round(score, 3), round(worst, 3)) for score, worst, name_id in matches[:limit]]
+
+    def best(self, query, min_score, min_average=0.0):
+        """
+        Best Match whose every query word matched the name with at least `min_score`, else
+        None. The best Match also needs an average score of `min_average`.
+        """
+        for match in self.rank(query):
+            if match.worst >= min_score:
+                return match if match.score >= min_average else None
+        return None
+
+    def _word_scores(self, word):
+        grams = word_grams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scores = {}
+        for word_id, count in shared.items():
+            score = 2 * count / (len(grams) + self.gram_counts[word_id])
+            if score >= WORD_FLOOR:
+                scores[word_id] = score
+        return scores
@@ -0,0 +1,78 @@
+import sys
+from array import array
+
+
+TRAIT_SEPARATOR = ', '  # thedogapi temperaments look like "Loyal, Friendly, Alert"
+
+
+class BreedTable:
+    """
+    Compact, read only breed list of a catalog version.
+
+    Names are one list of interned strings, temperaments are stored as ids into a shared
+    vocabulary of interned traits (there are ~170 breeds but only ~120 distinct traits),
+    kept in one flat array with per breed offsets. Descriptions that aren't a plain trait
+    list (None, '', odd spacing) are kept as they are, so every breed round trips exactly.
+
+    It still behaves like the list of {'name', 'description'} dicts it replaces (len,
+    indexing, iteration), those dicts are built on access.
+    """
+
+    __slots__ = ('names', 'vocabulary', 'trait_ids', 'offsets', 'raw_descriptions')
+
+    def __init__(self, names, vocabulary, trait_ids, offsets, raw_descriptions):
+        self.names = names
+        self.vocabulary = vocabulary
+        self.trait_ids = trait_ids
+        self.offsets = offsets
+        self.raw_descriptions = raw_descriptions
+
+    @classmethod
+    def from_dicts(cls, breeds):
+        names = []
+        vocabulary_ids = {}
+        trait_ids = []
+        offsets = [0]
+        raw_descriptions = {}
+        for breed_id, breed in enumerate(breeds):
+            names.append(sys.intern(breed['name']))
+            description = breed['description']
+            traits = description.split(TRAIT_SEPARATOR) if description else []
+            if traits and TRAIT_SEPARATOR.join(traits) == description:
+                trait_ids.extend(vocabulary_ids.setdefault(trait, len(vocabulary_ids)) for trait in traits)
+            else:
+                raw_descriptions[breed_id] = description
+            offsets.append(len(trait_ids))
+        vocabulary = [sys.intern(trait) for trait in vocabulary_ids]
+        typecode = 'H' if len(vocabulary) <= 0xFFFF else 'I'
+        return cls(names, vocabulary, array(typecode, trait_ids), array('I', offsets), raw_descriptions)
+
+    def description(self, breed_id):
+        if breed_id in self.raw_descriptions:
+            return self.raw_descriptions[breed_id]
+        ids = self.trait_ids[self.offsets[breed_id]:self.offsets[breed_id + 1]]
+        return TRAIT_SEPARATOR.join([self.vocabulary[trait_id] for trait_id in ids])
+
+    def to_dicts(self):
+        return list(self)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, breed_id):
+        if breed_id < 0:
+            breed_id += len(self.names)
+        return {'name': self.names[breed_id], 'description': self.description(breed_id)}
+
+    def __iter__(self):
+        for breed_id in range(len(self.names)):
+            yield self[breed_id]
+
+    def __getstate__(self):
+        return (self.names, self.vocabulary, self.trait_ids, self.offsets, self.raw_descriptions)
+
+    def __setstate__(self, state):
+        names, vocabulary, self.trait_ids, self.offsets, self.raw_descriptions = state
+        # Unpickled strings aren't interned, a catalog adopted from the cache gets the same sharing as a fetched one
+        self.names = [sys.intern(name) for name in names]
+        self.vocabulary = [sys.intern(trait) for trait in vocabulary]
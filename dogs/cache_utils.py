@@ -0,0 +1,202 @@
+import asyncio
+import fcntl
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def acquire_lock(name, timeout):
+    """
+    Cross worker lock on top of the Django cache (cache.add only sets missing keys).
+    Returns a token to release it with, or None when somebody else holds it.
+    """
+    token = uuid.uuid4().hex
+    if isinstance(caches['default'], FileBasedCache):
+        return _acquire_file_lock(name, token, timeout)
+    if cache.add(f"lock:{name}", token, timeout=timeout):
+        return token
+    return None
+
+
+def release_lock(name, token):
+    if token is not None and isinstance(caches['default'], FileBasedCache):
+        _release_file_lock(name, token)
+        return
+    key = f"lock:{name}"
+    if token is not None and cache.get(key) == token:  # don't drop a lock that expired and was taken by someone else
+        cache.delete(key)
+
+
+def _lock_path(name):
+    # FileBasedCache.add() checks then writes, two workers can both get in, O_EXCL can't
+    return os.path.join(caches['default']._dir, f"{hashlib.md5(name.encode()).hexdigest()}.lock")
+
+
+def _acquire_file_lock(name, token, timeout):
+    path = _lock_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _take_over_stale_lock(path, timeout):
+                return None
+            continue
+        with os.fdopen(fd, 'w') as lock_file:
+            lock_file.write(token)
+        return token
+    return None
+
+
+def _take_over_stale_lock(path, timeout):
+    """
+    Removes an expired lock file so the caller can create its own. Checking and unlinking
+    run under the guard, otherwise a worker that saw the old lock could unlink the new one
+    another worker just created.
+    """
+    with _lock_guard(path):
+        try:
+            if os.path.getmtime(path) + timeout > time.time():
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def _release_file_lock(name, token):
+    path = _lock_path(name)
+    with _lock_guard(path):
+        try:
+            with open(path) as lock_file:
+                if lock_file.read() != token:
+                    return
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+# Guard files per cache directory, shared by the lock names hashing to them. A fixed set
+# instead of one per name, those would be left behind for every name ever locked
+LOCK_GUARDS = 16
+
+
+@contextmanager
+def _lock_guard(path):
+    # held for a stat and an unlink only, and the kernel drops an flock if its holder dies
+    directory, name = os.path.split(path)
+    guard_path = os.path.join(directory, f"locks-{int(name[:32], 16) % LOCK_GUARDS}.guard")
+    with open(guard_path, 'a') as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(guard, fcntl.LOCK_UN)
+
+
+def incr_is_atomic():
+    # locmem, redis and memcached increment in one step, the file and database caches read then write
+    return not isinstance(caches['default'], (FileBasedCache, DatabaseCache))
+
+
+def should_refresh_early(fetched_at, ttl, window):
+    """
+    Probabilistic early expiration ("XFetch"): the closer a value gets to `ttl`, the more
+    likely a reader decides to refresh it, so one of them refreshes before it expires
+    instead of all of them at the same moment after. `window` is the average head start.
+    """
+    age = time.time() - fetched_at
+    return age - window * math.log(1.0 - random.random()) >= ttl
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one call, the others wait for its result (or
+    its exception). Per process, sync and async callers share the calls in flight.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        return self._finish(key, future, fn, *args)
+
+    async def ado(self, key, fn, *args):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn(*args)
+        except BaseException as e:
+            self._settle(key, future, exception=e)
+            raise
+        self._settle(key, future, result=result)
+        return result
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, fn, *args):
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._settle(key, future, exception=e)
+            raise
+        self._settle(key, future, result=result)
+        return result
+
+    def _settle(self, key, future, result=None, exception=None):
+        with self._lock:
+            del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+def _answers_inline():
+    # LocMemCache is a dict behind a lock, a lookup never blocks the event loop
+    return isinstance(caches['default'], LocMemCache)
+
+
+async def acache_call(fn, *args, **kwargs):
+    """
+    Runs `fn`, which talks to the cache, for an async view. Django's cache.aget() runs every
+    backend in the one thread sync_to_async keeps for thread sensitive code, which would
+    serialize the async requests of a worker, so the local cache is used inline and the
+    others on a thread of their own.
+    """
+    if _answers_inline():
+        return fn(*args, **kwargs)
+    return await sync_to_async(fn, thread_sensitive=False)(*args, **kwargs)
+
+
+async def acache_get(key, default=None):
+    """cache.get() for async views."""
+    return await acache_call(cache.get, key, default)
+
+
+async def acache_set(key, value, timeout):
+    return await acache_call(cache.set, key, value, timeout=timeout)
@@ -0,0 +1,383 @@
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .breed_index import BreedIndex, catalog_version
+from .breed_match import NameMatcher
+from .breed_table import BreedTable
+from .cache_utils import SingleFlight, acache_get, acquire_lock, release_lock, should_refresh_early
+from .metrics import timed
+from .upstream import AsyncUpstreamError, RateLimited, get_async_client, get_client
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'dog_breeds_version'  # (version, fetched_at), small so every request can afford reading it
+TABLE_CACHE_KEY = 'dog_breeds:{version}'  # the BreedTable of a version, only read when a worker adopts that version
+REFRESH_LOCK = 'dog_breeds_refresh'
+
+
+class CatalogUnavailable(Exception):
+    """No catalog could be loaded. `retry_after` (seconds) is set when thedogapi is rate limiting us."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BreedCatalog:
+    """
+    One immutable copy of the thedogapi breed list, reduced to what our endpoints use.
+    `breeds` is a BreedTable, a list of {'name', 'description'} dicts is converted.
+    """
+
+    def __init__(self, breeds, fetched_at=None, version=None):
+        if not isinstance(breeds, BreedTable):
+            version = version or catalog_version(breeds)
+            breeds = BreedTable.from_dicts(breeds)
+        self.breeds = breeds
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.version = version or catalog_version(breeds)
+        self._index = None
+        self._matcher = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_api(cls, payload):
+        breeds = [
+            {'name': breed.get('name', 'Unknown breed'), 'description': breed.get('temperament', '')}
+            for breed in payload
+        ]
+        return cls(breeds)
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = BreedIndex(self.breeds, self.version)
+        return self._index
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            with self._lock:
+                if self._matcher is None:
+                    self._matcher = NameMatcher(self.breeds.names)
+        return self._matcher
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > settings.BREED_CATALOG_TTL
+
+    def needs_refresh(self):
+        return should_refresh_early(self.fetched_at, settings.BREED_CATALOG_TTL, settings.BREED_CATALOG_EARLY_REFRESH)
+
+    def find(self, query):
+        """The breed `query` resolves to, or None (see lookup)."""
+        return self.lookup(query)[0]
+
+    def lookup(self, query):
+        """
+        (breed, score). The breed is the first one whose name contains `query`, the same first
+        hit thedogapi search gives us, score is None then. Without one, the closest name by
+        trigrams and its score, if that averages BREED_MATCH_AUTO_SCORE and every word of
+        `query` matches one of its words with at least BREED_MATCH_MIN_SCORE. Weaker matches
+        are only offered by suggest(), "goldfish" isn't answered as Golden Retriever.
+        """
+        query = query.strip().lower()
+        if not query:
+            return None, None
+        for breed_id, name in enumerate(self.matcher.lower_names):
+            if query in name:
+                return self.breeds[breed_id], None
+        match = self.matcher.best(query, settings.BREED_MATCH_MIN_SCORE, settings.BREED_MATCH_AUTO_SCORE)
+        return (self.breeds[match.name_id], match.score) if match else (None, None)
+
+    def suggest(self, query, limit=3):
+        """'Did you mean' names for a search that found nothing, best first."""
+        return [
+            {'name': self.breeds.names[match.name_id], 'score': match.score}
+            for match in self.matcher.rank(query, limit)
+            if match.score >= settings.BREED_SUGGESTION_MIN_SCORE
+        ]
+
+
+def fetch_catalog(background=False):
+    try:
+        response = get_client('thedogapi').get(settings.DOGS_API_URL, background=background)
+    except RateLimited as e:
+        raise CatalogUnavailable(str(e), retry_after=e.retry_after) from e
+    except requests.RequestException as e:
+        raise CatalogUnavailable(str(e)) from e
+    if response.status_code != 200:
+        raise CatalogUnavailable(f"thedogapi answered {response.status_code}")
+    try:
+        return BreedCatalog.from_api(response.json())
+    except (ValueError, KeyError, TypeError) as e:  # a 200 that isn't the breed list, e.g. a proxy's HTML page
+        raise CatalogUnavailable(f"thedogapi answered an unreadable breed list: {e!r}") from e
+
+
+def load_snapshot(path=None):
+    path = path or settings.BREED_CATALOG_PATH
+    try:
+        with open(path, encoding='utf-8') as snapshot:
+            data = json.load(snapshot)
+        return BreedCatalog(data['breeds'], data['fetched_at'], data['version'])
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError) as e:
+        logger.warning("Ignoring unreadable breed catalog snapshot %s: %s", path, e)
+        return None
+
+
+def save_snapshot(catalog, path=None):
+    path = str(path or settings.BREED_CATALOG_PATH)
+    data = {'version': catalog.version, 'fetched_at': catalog.fetched_at, 'breeds': catalog.breeds.to_dicts()}
+    # Write to a temp file and rename so a worker never reads half a snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as snapshot:
+            json.dump(data, snapshot)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CatalogMirror:
+    """
+    Process wide breed catalog, answered from memory.
+
+    Lookup order is memory -> shared cache -> snapshot file -> thedogapi. Once something
+    is loaded, a stale catalog keeps being served while a background thread fetches a
+    new one (stale-while-revalidate), so requests never wait on the upstream.
+
+    Refreshes start a bit before the TTL (should_refresh_early) and take a lock in the
+    shared cache, so with a shared CACHE_BACKEND the whole deployment fetches the list
+    once per TTL and the other workers adopt the result through the version key.
+    """
+
+    def __init__(self):
+        self._catalog = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._last_attempt = -1.0
+        self._cold_failed_at = None
+        self._cold_rate_limited_until = None
+
+    def get(self):
+        catalog = self._adopt_shared(self._catalog)
+        if catalog is None:
+            catalog = self._load_cold()
+        if catalog.needs_refresh():
+            self.refresh_in_background()
+        return catalog
+
+    def load(self):
+        """
+        get() without the background refresh, for the startup warm-up. That may run in the
+        gunicorn master before it forks, and a refresh thread would not survive the fork.
+        """
+        catalog = self._adopt_shared(self._catalog)
+        if catalog is None:
+            catalog = self._load_cold()
+        return catalog
+
+    async def aget(self):
+        """
+        get() for the async views. Checking the version key is all a request usually does,
+        adopting another version or loading the first one reads files and may wait on
+        thedogapi, so that part runs on a thread.
+        """
+        catalog = self._catalog
+        if catalog is None:
+            return await sync_to_async(self.get, thread_sensitive=False)()
+        with timed('cache'):
+            shared = await acache_get(VERSION_CACHE_KEY)
+        if shared is not None and shared[0] != catalog.version:
+            return await sync_to_async(self.get, thread_sensitive=False)()
+        if shared is not None:
+            catalog.fetched_at = max(catalog.fetched_at, shared[1])
+        if catalog.needs_refresh():
+            self.refresh_in_background()
+        return catalog
+
+    def publish(self, catalog, save=True):
+        """Make `catalog` the current one for this process, the other workers and the next deploy."""
+        previous, self._catalog = self._catalog, catalog
+        # The table goes first, a worker that sees the new version token can always load it
+        cache.set(TABLE_CACHE_KEY.format(version=catalog.version), catalog.breeds, timeout=None)
+        cache.set(VERSION_CACHE_KEY, (catalog.version, catalog.fetched_at), timeout=None)
+        if previous is not None and previous.version != catalog.version:
+            cache.delete(TABLE_CACHE_KEY.format(version=previous.version))
+        if save:
+            save_snapshot(catalog)
+
+    def refresh(self, background=False):
+        catalog = fetch_catalog(background)
+        self.publish(catalog)
+        return catalog
+
+    def refresh_in_background(self):
+        with self._refresh_lock:
+            # At most one attempt per second, while another worker holds the lock we just keep serving
+            if self._refreshing or time.monotonic() - self._last_attempt < 1:
+                return
+            self._refreshing = True
+            self._last_attempt = time.monotonic()
+        threading.Thread(target=self._background_refresh, name='breed-catalog-refresh', daemon=True).start()
+
+    def clear(self):
+        self._catalog = None
+        self._last_attempt = -1.0
+        self._cold_failed_at = None
+        self._cold_rate_limited_until = None
+
+    def _background_refresh(self):
+        token = acquire_lock(REFRESH_LOCK, settings.BREED_CATALOG_LOCK_TIMEOUT)
+        if token is None:  # another worker is refreshing, we'll adopt its catalog from the cache
+            self._refreshing = False
+            return
+        try:
+            shared = cache.get(VERSION_CACHE_KEY)
+            if shared is not None and not should_refresh_early(shared[1], settings.BREED_CATALOG_TTL, settings.BREED_CATALOG_EARLY_REFRESH):
+                self._adopt_shared(self._catalog)  # refreshed by someone else while we were deciding
+            else:
+                self.refresh(background=True)  # leaves the reserve of thedogapi's budget to user requests
+        except Exception:  # keep serving the stale copy, next stale read tries again
+            logger.exception("Background refresh of the breed catalog failed")
+        finally:
+            release_lock(REFRESH_LOCK, token)
+            self._refreshing = False
+
+    def _adopt_shared(self, catalog):
+        # Another worker may have refreshed, the version key tells us without loading the list
+        with timed('cache'):
+            shared = cache.get(VERSION_CACHE_KEY)
+        if shared is None:
+            return catalog
+        if catalog is not None and shared[0] == catalog.version:
+            catalog.fetched_at = max(catalog.fetched_at, shared[1])  # same content, refreshed elsewhere
+            return catalog
+        with timed('cache'):
+            breeds = cache.get(TABLE_CACHE_KEY.format(version=shared[0]))
+        if breeds is None:  # replaced again meanwhile, the next request picks up the newer one
+            return catalog
+        catalog = BreedCatalog(breeds, fetched_at=shared[1], version=shared[0])
+        self._catalog = catalog
+        return catalog
+
+    def _load_cold(self):
+        with self._lock:
+            if self._catalog is not None:
+                return self._catalog
+            # After a failed cold fetch, requests don't wait on thedogapi again, a background refresh retries it
+            if self._cold_failed_at is not None:
+                if time.time() - self._cold_failed_at > settings.BREED_CATALOG_RETRY:
+                    self._cold_failed_at = time.time()
+                    self.refresh_in_background()
+                raise CatalogUnavailable("breed catalog not loaded yet", retry_after=self._cold_retry_after())
+
+            catalog = load_snapshot()
+            if catalog is not None:
+                self.publish(catalog, save=False)
+                return catalog
+
+            # Nothing preloaded (preload_breed_catalog was not run), only the first request of the deployment fetches
+            token = acquire_lock(REFRESH_LOCK, settings.BREED_CATALOG_LOCK_TIMEOUT)
+            if token is None:
+                return self._wait_for_shared()
+            logger.warning("No breed catalog snapshot at %s, fetching it inline", settings.BREED_CATALOG_PATH)
+            try:
+                catalog = fetch_catalog()
+                self.publish(catalog)
+            except CatalogUnavailable as e:
+                self._cold_failed_at = time.time()
+                self._cold_rate_limited_until = time.time() + e.retry_after if e.retry_after else None
+                raise
+            finally:
+                release_lock(REFRESH_LOCK, token)
+            return catalog
+
+    def _cold_retry_after(self):
+        # While the failed cold fetch was rate limited, requests keep answering 503 with what's left of it
+        if self._cold_rate_limited_until is None or self._cold_rate_limited_until <= time.time():
+            return None
+        return math.ceil(self._cold_rate_limited_until - time.time())
+
+    def _wait_for_shared(self):
+        # Another worker is fetching the cold catalog, wait for it to show up in the cache instead of fetching too
+        deadline = time.monotonic() + settings.DOGS_API_TIMEOUT
+        while time.monotonic() < deadline:
+            catalog = self._adopt_shared(None)
+            if catalog is not None:
+                return catalog
+            time.sleep(0.05)
+        raise CatalogUnavailable("timed out waiting for another worker to load the breed catalog")
+
+
+mirror = CatalogMirror()
+
+
+def get_catalog():
+    return mirror.get()
+
+
+async def aget_catalog():
+    return await mirror.aget()
+
+
+searches = SingleFlight()
+
+
+def search_upstream(breed_name):
+    """
+    thedogapi search, only used while no catalog could be loaded at all (cold worker and list
+    endpoint down). Concurrent searches for the same name share one call. Raises RateLimited
+    when thedogapi (or our budget for it) says no, anything else counts as not found.
+    """
+    return searches.do(' '.join(breed_name.lower().split()), _search_upstream, breed_name)
+
+
+def _search_upstream(breed_name):
+    try:
+        response = get_client('thedogapi').get(f"{settings.DOGS_API_URL}/search", params={'q': breed_name})
+    except RateLimited:
+        raise
+    except requests.RequestException:
+        return None
+    if response.status_code == 200:
+        results = response.json() # parse the body only once
+        if results:
+            return {'name': results[0].get('name', 'No name available'), 'description': results[0].get('temperament')}
+    return None
+
+
+async def asearch_upstream(breed_name):
+    """search_upstream for the async views."""
+    return await searches.ado(' '.join(breed_name.lower().split()), _asearch_upstream, breed_name)
+
+
+async def _asearch_upstream(breed_name):
+    try:
+        response = await get_async_client('thedogapi').get(f"{settings.DOGS_API_URL}/search", params={'q': breed_name})
+    except RateLimited:
+        raise
+    except AsyncUpstreamError:
+        return None
+    if response.status_code == 200:
+        results = response.json()
+        if results:
+            return {'name': results[0].get('name', 'No name available'), 'description': results[0].get('temperament')}
+    return None
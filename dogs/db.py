@@ -0,0 +1,71 @@
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DB = 'replica'  # read-only connection to the same SQLite file, only in the production profile
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Reads made inside go to the read-only connection (when there is one)."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _on_replica(chunks):
+    # A streamed response is produced after the view returned, every chunk is read inside again
+    chunks = iter(chunks)
+    while True:
+        with replica_reads():
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def use_replica(view):
+    """
+    For the admin views that only read. Their queries (and those of a streamed export)
+    use a connection that never holds the write lock, so a long history export can't make
+    the searches being saved wait, and they can't make it wait either.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            response = view(*args, **kwargs)
+        if getattr(response, 'streaming', False):
+            response.streaming_content = _on_replica(response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends the reads made under replica_reads() to REPLICA_DB, everything else to default.
+    Inside a transaction on default the reads stay there, to see its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or REPLICA_DB not in connections.settings:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA_DB
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # same file
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB
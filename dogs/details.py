@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+from .catalog import CatalogUnavailable, aget_catalog, asearch_upstream, get_catalog, search_upstream
+from .gif_cache import NO_IMAGE, gif_cache
+from .metrics import count, in_request_context
+from .upstream import RateLimited
+
+
+# Shared by every request of the worker, only used to overlap the Giphy search with the breed lookup
+executor = ThreadPoolExecutor(max_workers=settings.UPSTREAM_FANOUT_WORKERS, thread_name_prefix='upstream-fanout')
+# One slot per thread of `executor`, a lookup is only submitted when it starts right away
+fanout_slots = threading.BoundedSemaphore(settings.UPSTREAM_FANOUT_WORKERS)
+# Resolves the breeds of batch requests. Separate from `executor` because every resolve waits on a gif lookup submitted there
+batch_executor = ThreadPoolExecutor(max_workers=settings.BREEDS_BATCH_WORKERS, thread_name_prefix='breed-batch')
+
+logger = logging.getLogger(__name__)
+
+
+def build_details(dog_data, image_url, match=None):
+    details = {
+        'name': dog_data['name'],
+        'description': dog_data['description'] or 'No temperament information available',
+        'image_url': image_url,
+    }
+    if match is not None:
+        details['match'] = match
+    return details
+
+
+def fuzzy_match(breed_name, score):
+    # What the response says about a breed resolved from a misspelling, None for a name match
+    return {'matched_from': breed_name, 'score': score} if score is not None else None
+
+
+def submit_gif_lookup(*args):
+    """
+    gif_cache.get(*args) on the fan-out pool, or None when all its threads are busy. A
+    queued lookup would spend the caller's GIPHY_API_TIMEOUT waiting for a thread, so
+    the caller answers without the gif right away instead.
+    """
+    if not fanout_slots.acquire(blocking=False):
+        count('dogs_gif_lookups_skipped_total')
+        return None
+    try:
+        future = executor.submit(in_request_context(gif_cache.get), *args)
+    except BaseException:
+        fanout_slots.release()
+        raise
+    future.add_done_callback(lambda _: fanout_slots.release())
+    return future
+
+
+def gif_result(gif_future):
+    """The gif of a submit_gif_lookup(), NO_IMAGE when it was skipped or is over GIPHY_API_TIMEOUT."""
+    if gif_future is None:
+        return NO_IMAGE
+    try:
+        return gif_future.result(timeout=settings.GIPHY_API_TIMEOUT)
+    except FutureTimeoutError:
+        return NO_IMAGE
+
+
+def cancel(gif_future):
+    if gif_future is not None:
+        gif_future.cancel()
+
+
+def loaded_catalog():
+    try:
+        return get_catalog()
+    except CatalogUnavailable:
+        return None
+
+
+def resolve_breed_details(breed_name):
+    """
+    Breed data plus gif for `breed_name`, or None when the breed doesn't exist.
+
+    With a loaded catalog the breed is resolved locally, so the gif is looked up under
+    its canonical name and a cached gif costs no upstream call at all. Without one, the
+    Giphy search starts right away on the pool while thedogapi search runs, so the
+    request costs max(breed lookup, Giphy) instead of the sum. If Giphy is slower than
+    GIPHY_API_TIMEOUT, or every thread of the pool is busy, we answer with the breed data
+    and "No image available". RateLimited
+    from the thedogapi search is raised, the view answers 503 rather than "not found".
+    A breed resolved from a misspelling comes with 'match' (see fuzzy_match).
+    """
+    catalog = loaded_catalog()
+    match = None
+    if catalog is not None:
+        dog_data, score = catalog.lookup(breed_name)
+        if not dog_data:
+            return None
+        match = fuzzy_match(breed_name, score)
+        cached = gif_cache.peek(breed_name, dog_data['name'])
+        if cached is not None:
+            return build_details(dog_data, cached, match)
+        gif_future = submit_gif_lookup(breed_name, dog_data['name'])
+    else:
+        gif_future = submit_gif_lookup(breed_name)
+        try:
+            dog_data = search_upstream(breed_name)
+        except RateLimited:
+            cancel(gif_future)
+            raise
+        if not dog_data:
+            cancel(gif_future)
+            return None
+    return build_details(dog_data, gif_result(gif_future), match)
+
+
+def suggest_breeds(breed_name):
+    """'Did you mean' names for a breed that wasn't found, empty without a loaded catalog."""
+    catalog = loaded_catalog()
+    return catalog.suggest(breed_name) if catalog is not None else []
+
+
+def unique_breeds(breed_names):
+    """Breed names without blanks and repeats ("akita", " Akita"), first spelling and order kept."""
+    seen = set()
+    unique = []
+    for breed_name in breed_names:
+        key = ' '.join(breed_name.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(breed_name.strip())
+    return unique
+
+
+def resolve_many(breed_names):
+    """
+    (breed_name, details, failed) for every name, resolved BREEDS_BATCH_WORKERS at a time
+    per worker. `details` is None when the breed doesn't exist or the lookup failed, one
+    breed failing doesn't fail the others.
+    """
+    def resolve(breed_name):
+        try:
+            return breed_name, resolve_breed_details(breed_name), False
+        except RateLimited:  # expected while thedogapi says no, not worth a traceback per breed
+            return breed_name, None, True
+        except Exception:
+            logger.exception("Could not resolve breed %r", breed_name)
+            return breed_name, None, True
+
+    futures = [batch_executor.submit(in_request_context(resolve), breed_name) for breed_name in breed_names]
+    return [future.result() for future in futures]
+
+
+async def aloaded_catalog():
+    try:
+        return await aget_catalog()
+    except CatalogUnavailable:
+        return None
+
+
+async def aresolve_breed_details(breed_name):
+    """
+    Same as resolve_breed_details, for the async views running under ASGI. The upstream
+    calls go through the httpx clients, so a request waiting on Giphy only holds a socket.
+    """
+    catalog = await aloaded_catalog()
+    match = None
+    if catalog is not None:
+        dog_data, score = catalog.lookup(breed_name)
+        if not dog_data:
+            return None
+        match = fuzzy_match(breed_name, score)
+        gif_task = asyncio.ensure_future(gif_cache.aget(breed_name, dog_data['name']))
+    else:
+        # A task straight from the coroutine, cancelling it closes the coroutine even if it never ran
+        gif_task = asyncio.ensure_future(gif_cache.aget(breed_name))
+        try:
+            dog_data = await asearch_upstream(breed_name)
+        except RateLimited:
+            gif_task.cancel()
+            raise
+        if not dog_data:
+            gif_task.cancel()
+            return None
+    try:
+        image_url = await asyncio.wait_for(gif_task, timeout=settings.GIPHY_API_TIMEOUT)
+    except asyncio.TimeoutError:
+        image_url = NO_IMAGE
+    return build_details(dog_data, image_url, match)
+
+
+async def asuggest_breeds(breed_name):
+    catalog = await aloaded_catalog()
+    return catalog.suggest(breed_name) if catalog is not None else []
@@ -0,0 +1,33 @@
+import json
+
+from django.utils import timezone
+
+
+EXPORT_FIELDS = ('breed__name', 'breed__description', 'breed__image_url', 'time')  # one join on the small breed table
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # same as DogBreedHistorySerializer
+
+
+def history_rows(queryset, chunk_size=2000):
+    """History rows as plain dicts, streamed from the database chunk by chunk."""
+    for name, description, image_url, searched_at in queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size):
+        yield {
+            'name': name,
+            'description': description,
+            'image_url': image_url,
+            'time': timezone.localtime(searched_at).strftime(TIME_FORMAT),
+        }
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def stream_json(rows):
+    # Same shape as the paginated response, written out piece by piece
+    yield '{"status": "success", "data": ['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ', '
+    yield ']}'
@@ -0,0 +1,152 @@
+"""
+Local stand-in for thedogapi and Giphy, used by the tests and the benchmarks so they
+never depend on the real services (or on our Giphy quota).
+
+    with FakeUpstream(latency=0.05) as upstream, override_settings(**upstream.settings()):
+        ...
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+DEFAULT_BREEDS = [
+    {'id': 1, 'name': 'Affenpinscher', 'temperament': 'Stubborn, Curious, Playful, Adventurous, Active, Fun-loving'},
+    {'id': 2, 'name': 'Afghan Hound', 'temperament': 'Aloof, Clownish, Dignified, Independent, Happy'},
+    {'id': 6, 'name': 'Akita', 'temperament': 'Docile, Alert, Responsive, Dignified, Composed, Friendly, Receptive, Faithful, Courageous'},
+    {'id': 9, 'name': 'Alaskan Husky', 'temperament': 'Friendly, Energetic, Loyal, Gentle, Confident'},
+    {'id': 50, 'name': 'Border Collie', 'temperament': 'Tenacious, Keen, Energetic, Responsive, Alert, Intelligent'},
+    {'id': 115, 'name': 'German Shepherd Dog', 'temperament': 'Alert, Loyal, Obedient, Curious, Confident, Courageous'},
+    {'id': 149, 'name': 'Labrador Retriever', 'temperament': 'Kind, Outgoing, Agile, Gentle, Intelligent, Trusting, Even Tempered'},
+    {'id': 201, 'name': 'Pug', 'temperament': 'Docile, Clever, Charming, Stubborn, Sociable, Playful, Quiet, Attentive'},
+]
+
+
+def pad(payload, size):
+    # Spread over the objects of a list, thedogapi sends ~1 KB per breed that we never read
+    if isinstance(payload, list):
+        share = size // max(len(payload), 1)
+        return [{**item, 'padding': 'x' * share} for item in payload]
+    return {**payload, 'padding': 'x' * size}
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients that gave up (timeouts in the tests) are expected here
+
+
+class FakeUpstream:
+    """
+    Threaded HTTP server answering /v1/breeds, /v1/breeds/search and /v1/gifs/search.
+
+    `latency` (or the per service `dog_latency` / `giphy_latency`) is slept before each
+    answer, `error_rate` is the share of requests answered with `error_status` (paths in
+    `fail_paths` always are, 429s with a Retry-After of `retry_after` seconds) and
+    `gifs=False` makes Giphy return no results. `payload_bytes` pads every successful
+    answer with about that many bytes of filler (an extra field per object, like the
+    fields thedogapi sends that we don't use).
+    `calls` counts requests per path.
+    """
+
+    def __init__(self, breeds=None, latency=0.0, dog_latency=None, giphy_latency=None,
+                 error_rate=0.0, error_status=500, fail_paths=(), gifs=True, payload_bytes=0, retry_after=1, seed=0):
+        self.breeds = DEFAULT_BREEDS if breeds is None else breeds
+        self.dog_latency = latency if dog_latency is None else dog_latency
+        self.giphy_latency = latency if giphy_latency is None else giphy_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_paths = set(fail_paths)
+        self.gifs = gifs
+        self.payload_bytes = payload_bytes
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def dogs_api_url(self):
+        return f"{self.base_url}/v1/breeds"
+
+    @property
+    def giphy_api_url(self):
+        return f"{self.base_url}/v1/gifs/search"
+
+    def settings(self):
+        return {'DOGS_API_URL': self.dogs_api_url, 'GIPHY_API_URL': self.giphy_api_url}
+
+    def start(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real services
+            disable_nagle_algorithm = True  # headers and body are separate writes, don't let them wait on delayed ACKs
+
+            def do_GET(self):
+                status, payload = upstream.handle(self.path)
+                if status == 200 and upstream.payload_bytes:
+                    payload = pad(payload, upstream.payload_bytes)
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', str(upstream.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _QuietServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, raw_path):
+        url = urlparse(raw_path)
+        query = parse_qs(url.query)
+        with self._lock:
+            self.calls[url.path] += 1
+            failed = url.path in self.fail_paths or self._random.random() < self.error_rate
+
+        is_giphy = url.path.startswith('/v1/gifs')
+        delay = self.giphy_latency if is_giphy else self.dog_latency
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, {'message': 'injected failure'}
+
+        if url.path == '/v1/breeds':
+            return 200, self.breeds
+        if url.path == '/v1/breeds/search':
+            term = query.get('q', [''])[0].strip().lower()
+            return 200, [breed for breed in self.breeds if term and term in breed['name'].lower()]
+        if url.path == '/v1/gifs/search':
+            term = query.get('q', [''])[0].strip()
+            if not (self.gifs and term):
+                return 200, {'data': []}
+            slug = term.lower().replace(' ', '-')
+            return 200, {'data': [{'images': {'original': {'url': f"https://media.giphy.test/{slug}.gif"}}}]}
+        return 404, {'message': 'not found'}
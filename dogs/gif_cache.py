@@ -0,0 +1,325 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+import requests
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache_utils import acache_call, acache_get, acache_set, acquire_lock, release_lock
+from .metrics import cache_result, timed
+from .upstream import AsyncUpstreamError, get_async_client, get_client
+
+
+logger = logging.getLogger(__name__)
+
+GIPHY_API_KEY = os.getenv('GIPHY_API_KEY') # loaded from .env by settings
+NO_IMAGE = "No image available"
+NO_RESULTS = ''  # what a negative entry looks like in the shared cache
+
+
+class GifUnavailable(Exception):
+    """Giphy failed (timeout, 5xx, bad body), unlike an empty result this is never cached."""
+
+
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+
+def fetch_gif(query):
+    """URL of the first Giphy result for `query`, None when Giphy has nothing for it."""
+    params = {'api_key': GIPHY_API_KEY, 'q': query, 'limit': 1}
+    try:
+        response = get_client('giphy').get(settings.GIPHY_API_URL, params=params)
+        if response.status_code != 200:
+            raise GifUnavailable(f"giphy answered {response.status_code}")
+        gifs = response.json()['data'] # parse the body only once
+        return gifs[0]['images']['original']['url'] if gifs else None
+    except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+        raise GifUnavailable(str(e)) from e
+
+
+async def afetch_gif(query):
+    """fetch_gif for the async views."""
+    params = {'api_key': GIPHY_API_KEY, 'q': query, 'limit': 1}
+    try:
+        response = await get_async_client('giphy').get(settings.GIPHY_API_URL, params=params)
+        if response.status_code != 200:
+            raise GifUnavailable(f"giphy answered {response.status_code}")
+        gifs = response.json()['data']
+        return gifs[0]['images']['original']['url'] if gifs else None
+    except (*AsyncUpstreamError, ValueError, KeyError, IndexError) as e:
+        raise GifUnavailable(str(e)) from e
+
+
+class GifCache:
+    """
+    Two tier cache of Giphy results.
+
+    The first tier is a bounded LRU in this process, the second one is the Django cache,
+    so with a shared backend the other workers reuse our lookups. "No results" is cached
+    too (for GIF_CACHE_NEGATIVE_TTL), Giphy errors are not. Concurrent misses for the
+    same key wait for the one lookup already in flight instead of calling Giphy again,
+    within the worker through a Future and across workers through a lock in the cache.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (url or NO_RESULTS, expires_at)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._tasks = set()  # Giphy lookups of the async views, referenced until they finish
+        self.counters = Counter()
+
+    def get(self, query, canonical_name=None):
+        """
+        Gif URL (or NO_IMAGE) for a breed search. When the catalog already told us the real
+        breed name, that is what we key on and send to Giphy, so "akita" and "AKITA " share it.
+        """
+        search = canonical_name or query
+        key = normalize(search)
+
+        value = self._local_get(key)
+        if value is None:
+            with timed('cache'):
+                value = cache.get(self._cache_key(key))
+            if value is not None:
+                self._count('shared_hits')
+                self._local_set(key, value)
+        else:
+            self._count('hits')
+        cache_result('gif', hit=value is not None)
+        if value is not None:
+            return value or NO_IMAGE
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.counters['misses'] += 1
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        url = NO_IMAGE
+        try:
+            url = self._fetch_once(key, search) or NO_IMAGE
+        except GifUnavailable:
+            self._count('errors')
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(url)  # waiters get NO_IMAGE if the lookup failed
+        return url
+
+    async def aget(self, query, canonical_name=None):
+        """
+        get() for the async views. Lookups in flight are shared with the sync views (a waiter
+        awaits the same Future), and the Giphy call keeps going when the request waiting on
+        it times out, so its result is still cached like with get() on the fan-out pool.
+        """
+        search = canonical_name or query
+        key = normalize(search)
+
+        value = self._local_get(key)
+        if value is None:
+            with timed('cache'):
+                value = await acache_get(self._cache_key(key))
+            if value is not None:
+                self._count('shared_hits')
+                self._local_set(key, value)
+        else:
+            self._count('hits')
+        cache_result('gif', hit=value is not None)
+        if value is not None:
+            return value or NO_IMAGE
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.counters['misses'] += 1
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        task = asyncio.ensure_future(self._afetch(key, search, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(task)
+
+    async def _afetch(self, key, search, future):
+        url = NO_IMAGE
+        try:
+            url = await self._afetch_once(key, search) or NO_IMAGE
+        except GifUnavailable:
+            self._count('errors')
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(url)
+        return url
+
+    def peek(self, query, canonical_name=None):
+        """Cached value without calling Giphy, None on a miss."""
+        key = normalize(canonical_name or query)
+        value = self._local_get(key)
+        if value is None:
+            with timed('cache'):
+                value = cache.get(self._cache_key(key))
+            if value is not None:
+                self._local_set(key, value)
+        if value is None:
+            return None  # get() follows and counts the miss
+        self._count('hits')
+        cache_result('gif', hit=True)
+        return value or NO_IMAGE
+
+    def set(self, key, url):
+        value = url or NO_RESULTS
+        timeout = settings.GIF_CACHE_TTL if url else settings.GIF_CACHE_NEGATIVE_TTL
+        self._local_set(key, value, timeout)
+        with timed('cache'):
+            cache.set(self._cache_key(key), value, timeout=timeout)
+
+    async def aset(self, key, url):
+        value = url or NO_RESULTS
+        timeout = settings.GIF_CACHE_TTL if url else settings.GIF_CACHE_NEGATIVE_TTL
+        self._local_set(key, value, timeout)
+        with timed('cache'):
+            await acache_set(self._cache_key(key), value, timeout=timeout)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def save_snapshot(self, path=None):
+        """
+        Add the unexpired entries of this worker to the snapshot at GIF_SNAPSHOT_PATH, returns
+        how many it holds. Every worker saves on exit, merging keeps what the others saved.
+        """
+        path = str(path or settings.GIF_SNAPSHOT_PATH)
+        now, wall = time.monotonic(), time.time()
+        merged = {key: (value, expires_at) for key, value, expires_at in self._read_snapshot(path) if expires_at > wall}
+        with self._lock:
+            # Expiry as wall clock time, the next process has another monotonic clock
+            for key, (value, expires_at) in self._entries.items():
+                if expires_at > now:
+                    merged.pop(key, None)  # ours are the most recently used, they go last
+                    merged[key] = (value, wall + expires_at - now)
+        entries = [[key, value, expires_at] for key, (value, expires_at) in merged.items()][-settings.GIF_CACHE_SIZE:]
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as snapshot:
+                json.dump({'entries': entries}, snapshot)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return len(entries)
+
+    def load_snapshot(self, path=None):
+        """Fill the LRU from the snapshot written by save_snapshot(), returns how many entries were still valid."""
+        now, loaded = time.time(), 0
+        for key, value, expires_at in self._read_snapshot(path or settings.GIF_SNAPSHOT_PATH)[-settings.GIF_CACHE_SIZE:]:
+            if expires_at > now:
+                self._local_set(key, value, expires_at - now)
+                loaded += 1
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'size': len(self._entries)}
+
+    def _fetch_once(self, key, search):
+        # The worker holding the lookup lock calls Giphy, the others wait for its answer in the
+        # shared cache, and only call Giphy themselves if it doesn't show up in time. The lock
+        # lasts as long as the holder's lookup can, retries and backoff included
+        shared_key = self._cache_key(key)
+        lookup_time = get_client('giphy').max_duration()
+        token = acquire_lock(shared_key, lookup_time)
+        if token is None:
+            deadline = time.monotonic() + lookup_time
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = cache.get(shared_key)
+                if value is not None:
+                    self._local_set(key, value)
+                    return value
+        try:
+            found = fetch_gif(search)
+            self.set(key, found)
+            return found
+        finally:
+            release_lock(shared_key, token)
+
+    async def _afetch_once(self, key, search):
+        shared_key = self._cache_key(key)
+        lookup_time = get_client('giphy').max_duration()  # same timeout and retries as the httpx client
+        token = await acache_call(acquire_lock, shared_key, lookup_time)
+        if token is None:
+            deadline = time.monotonic() + lookup_time
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                value = await acache_get(shared_key)
+                if value is not None:
+                    self._local_set(key, value)
+                    return value
+        try:
+            found = await afetch_gif(search)
+            await self.aset(key, found)
+            return found
+        finally:
+            await acache_call(release_lock, shared_key, token)
+
+    def _cache_key(self, key):
+        # Breed names have spaces, which memcached keys can't
+        return f"gif:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _local_set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = settings.GIF_CACHE_TTL if value else settings.GIF_CACHE_NEGATIVE_TTL
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.GIF_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def _read_snapshot(self, path):
+        try:
+            with open(path, encoding='utf-8') as snapshot:
+                return json.load(snapshot)['entries']
+        except FileNotFoundError:
+            return []
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable gif snapshot %s: %s", path, e)
+            return []
+
+
+gif_cache = GifCache()
@@ -0,0 +1,225 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import timed
+from .models import DogBreed
+from .rollups import record_searches
+
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySink:
+    """
+    Buffers search history rows and writes them with one bulk_create per batch.
+
+    fetch_breed_details only enqueues the row, a background thread flushes the queue every
+    HISTORY_SINK_FLUSH_INTERVAL seconds or as soon as HISTORY_SINK_BATCH_SIZE rows are
+    waiting, so responses never wait on the SQLite write lock. Rows that can't be written
+    at shutdown go to an NDJSON spool file, which is replayed the next time a sink starts.
+    So do rows still failing after HISTORY_SINK_MAX_RETRIES flushes, and rows added while
+    HISTORY_SINK_MAX_QUEUE are already waiting. A row the database rejects (IntegrityError,
+    DataError, ...) is found by splitting its batch, logged and dropped, the rest is written.
+    Every write also adds its rows to the per breed rollups, in the same transaction, and
+    looks up the breed rows they point to with one query per batch (see BreedManager).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=settings.HISTORY_SINK_MAX_QUEUE)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._failures = 0  # flushes in a row that couldn't reach the database
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.flushed = 0
+
+    def add(self, **fields):
+        """Record one search, returns the (possibly not yet saved) DogBreed row."""
+        dog_breed = DogBreed.from_details(time=timezone.now(), **fields)
+        # Inside a transaction (ATOMIC_REQUESTS, tests) the row has to be part of it, so write it right away
+        if not settings.HISTORY_SINK_ENABLED or connection.in_atomic_block:
+            self._write([dog_breed])
+            return dog_breed
+
+        self._ensure_started()
+        self._enqueue([dog_breed])
+        return dog_breed
+
+    async def aadd(self, **fields):
+        """
+        add() for the async views. Queueing never touches the database, so it happens right
+        on the event loop, only the write without the sink goes to a thread.
+        Async views are never wrapped in ATOMIC_REQUESTS, there is no transaction to join.
+        """
+        if not settings.HISTORY_SINK_ENABLED:
+            dog_breed = DogBreed.from_details(time=timezone.now(), **fields)
+            await sync_to_async(self._write)([dog_breed])  # with its rollups, in one transaction
+            return dog_breed
+        return self.add(**fields)
+
+    def add_many(self, rows):
+        """Record several searches at once (batch details), written together with one bulk_create."""
+        now = timezone.now()
+        dog_breeds = [DogBreed.from_details(time=now, **fields) for fields in rows]
+        if not dog_breeds:
+            return dog_breeds
+        if not settings.HISTORY_SINK_ENABLED or connection.in_atomic_block:
+            return self._write(dog_breeds)
+
+        self._ensure_started()
+        self._enqueue(dog_breeds)
+        return dog_breeds
+
+    def flush(self):
+        """Write everything queued so far, returns how many rows were written."""
+        with self._flush_lock:
+            batch = self._drain()
+            if not batch:
+                return 0
+            with timed('history_flush'):
+                written, unwritten = self._write_rows(batch)
+            self.flushed += written
+            if not unwritten:
+                self._failures = 0
+            elif self._failures + 1 >= settings.HISTORY_SINK_MAX_RETRIES:
+                logger.error("Could not write %s search history rows in %s flushes", len(unwritten), self._failures + 1)
+                self._failures = 0
+                self._spool(unwritten)
+            else:
+                self._failures += 1
+                self._enqueue(unwritten)  # for the next flush
+            return written
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """Last flush before the process exits, whatever can't be written is spooled to disk."""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final search history flush failed")
+        rows = self._drain()
+        if rows:
+            self._spool(rows)
+        connection.close()
+
+    def replay_spool(self):
+        path = settings.HISTORY_SPOOL_PATH
+        replay_path = f"{path}.replaying"
+        if not os.path.exists(replay_path):  # otherwise a previous replay was interrupted, finish that one first
+            try:
+                os.replace(path, replay_path)  # new rows spooled meanwhile go to a fresh file
+            except FileNotFoundError:
+                return 0
+        with open(replay_path, encoding='utf-8') as spool:
+            rows = [json.loads(line) for line in spool if line.strip()]
+        written, unwritten = self._write_rows([
+            DogBreed.from_details(row['name'], row['description'], row['image_url'], time=parse_datetime(row['time']))
+            for row in rows
+        ])
+        if unwritten:
+            self._spool(unwritten)  # back to the spool, for the next start
+        os.unlink(replay_path)
+        logger.info("Replayed %s spooled search history rows", written)
+        return written
+
+    def _write_rows(self, dog_breeds):
+        """
+        Writes `dog_breeds`, halving a batch the database rejects until the bad rows are alone,
+        those are dropped. Returns how many rows were written and the rows left when the
+        database couldn't be reached (most likely "database is locked"), to try again later.
+        """
+        written, parts = 0, [dog_breeds]
+        while parts:
+            rows = parts.pop()
+            try:
+                self._write(rows)
+            except Exception as e:
+                if isinstance(e, DatabaseError) and not isinstance(e, (IntegrityError, DataError)):
+                    logger.warning("Could not write %s search history rows, retrying later", len(rows), exc_info=True)
+                    return written, rows + [row for part in reversed(parts) for row in part]
+                if len(rows) == 1:
+                    logger.exception("Dropping a search history row for %s, it can't be written", rows[0].breed.name)
+                else:
+                    half = len(rows) // 2
+                    parts += [rows[half:], rows[:half]]
+                continue
+            written += len(rows)
+        return written, []
+
+    def _write(self, dog_breeds):
+        with transaction.atomic():
+            DogBreed.objects.bulk_create(dog_breeds, batch_size=settings.HISTORY_SINK_BATCH_SIZE)
+            record_searches(dog_breeds)
+        return dog_breeds
+
+    def _enqueue(self, rows):
+        overflow = []
+        for dog_breed in rows:
+            try:
+                self._queue.put_nowait(dog_breed)
+            except queue.Full:
+                overflow.append(dog_breed)
+        if overflow:
+            # The database is falling behind, keep the worker's memory bounded
+            self._spool(overflow)
+        if self._queue.qsize() >= settings.HISTORY_SINK_BATCH_SIZE:
+            self._wakeup.set()
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _spool(self, rows):
+        with self._spool_lock, open(settings.HISTORY_SPOOL_PATH, 'a', encoding='utf-8') as spool:
+            for dog_breed in rows:
+                spool.write(json.dumps({
+                    'name': dog_breed.breed.name,
+                    'description': dog_breed.breed.description,
+                    'image_url': dog_breed.breed.image_url,
+                    'time': dog_breed.time.isoformat(),
+                }) + '\n')
+        logger.warning("Spooled %s search history rows to %s", len(rows), settings.HISTORY_SPOOL_PATH)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                # Started on first use, after gunicorn forked the worker
+                self._thread = threading.Thread(target=self._run, name='history-sink', daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _run(self):
+        try:
+            self.replay_spool()
+        except Exception:
+            logger.exception("Could not replay the search history spool")
+        while True:
+            self._wakeup.wait(settings.HISTORY_SINK_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Search history flush failed")
+
+
+history_sink = HistorySink()
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dogs.archive import archive_history, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the searches older than HISTORY_RETENTION_DAYS to gzipped NDJSON files in HISTORY_ARCHIVE_DIR, "
+        "one per UTC day, deleting them from the database in small batches. Meant to run daily (cron, scheduler), "
+        "safe to run while the app is serving and to run again after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="days kept in the database, default HISTORY_RETENTION_DAYS")
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['days'])
+        if cutoff is None:
+            self.stdout.write("Retention is off (0 days), nothing archived.")
+            return
+        archived = archive_history(cutoff)
+        for day, rows in archived.items():
+            self.stdout.write(f"{day:%Y-%m-%d}: {rows} searches")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {sum(archived.values())} searches made before {cutoff:%Y-%m-%d} to {settings.HISTORY_ARCHIVE_DIR}."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from dogs.models import BreedSearchRollup
+from dogs.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recount the per breed hour and day search rollups from the search history, reading it in batches. Safe to run while the app is serving."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="history rows read per query")
+
+    def handle(self, *args, **options):
+        read = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Search rollups rebuilt from {read} history rows: {BreedSearchRollup.objects.count()} hour and day buckets."
+        ))
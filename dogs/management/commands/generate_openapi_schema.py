@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dogs.openapi import stale_schema_files, write_schema
+
+
+class Command(BaseCommand):
+    help = "Write the OpenAPI schema served to Swagger UI and ReDoc to dogs/static/openapi/, run it before collectstatic."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="only fail when the files don't match the code")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            stale = stale_schema_files()
+            if stale:
+                raise CommandError(f"OpenAPI schema out of date, run generate_openapi_schema: {', '.join(stale)}")
+            self.stdout.write(self.style.SUCCESS("OpenAPI schema up to date."))
+            return
+        changed = write_schema()
+        self.stdout.write(self.style.SUCCESS(
+            f"OpenAPI schema written: {', '.join(changed)}" if changed else "OpenAPI schema already up to date."
+        ))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dogs.catalog import CatalogUnavailable, load_snapshot, mirror
+
+
+class Command(BaseCommand):
+    help = "Download the thedogapi breed list into the local catalog snapshot, run it at deploy time before the workers start."
+
+    def handle(self, *args, **options):
+        try:
+            catalog = mirror.refresh()
+        except CatalogUnavailable as e:
+            # A deploy shouldn't fail because thedogapi is down if we still have the last snapshot
+            catalog = load_snapshot()
+            if catalog is None:
+                # Nor should it fail without one, the workers fetch the catalog on their first lookup
+                self.stderr.write(self.style.WARNING(
+                    f"Could not download the breed catalog and there is no snapshot ({e}), workers will fetch it on demand"
+                ))
+                return
+            self.stderr.write(self.style.WARNING(f"thedogapi unavailable ({e}), keeping the existing snapshot"))
+            mirror.publish(catalog, save=False)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Breed catalog ready: {len(catalog.breeds)} breeds, version {catalog.version} at {settings.BREED_CATALOG_PATH}"
+        ))
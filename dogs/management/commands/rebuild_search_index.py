@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from dogs.search import FTS_TABLE
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SQLite full-text index of the search history from the breed table."
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The full-text index only exists on SQLite, other databases use the icontains backend.")
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        self.stdout.write(self.style.SUCCESS("Search history full-text index rebuilt."))
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from dogs.auth import revoke_tokens
+
+
+class Command(BaseCommand):
+    help = "Revoke every JWT issued to a user so far (bumps the token version they carry)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"No user named '{options['username']}'")
+        revoke_tokens(user.pk)
+        self.stdout.write(self.style.SUCCESS(
+            f"Tokens of '{user.username}' revoked, other workers stop accepting them within their user state TTL."
+        ))
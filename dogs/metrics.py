@@ -0,0 +1,203 @@
+"""
+In-process request metrics: per phase latency histograms, cache hit counters and upstream
+outcomes, exposed as Prometheus text on /metrics and per request as Server-Timing.
+
+Every gunicorn worker keeps its own numbers (like /api/upstream-stats/), so Prometheus
+has to scrape each worker or sum the series it gets.
+
+Overhead budget: recording a phase costs a couple of microseconds (two perf_counter
+calls, one bisect and a lock), a whole request with the middleware and every hook must
+stay under METRICS_OVERHEAD_BUDGET_US, see benchmarks/bench_metrics_overhead.py.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# Seconds, from cache lookups (tens of microseconds) to slow upstream calls
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Phase durations of the request being handled, None outside of TimingMiddleware
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts like a Prometheus histogram, quantiles are estimated from them."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket, same as PromQL histogram_quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower  # +Inf bucket, the best we can say is "above the last bound"
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> int
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {}
+            for key, histogram in self.histograms.items():
+                copy = Histogram(histogram.buckets)
+                copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+                histograms[key] = copy
+            return histograms, dict(self.counters)
+
+
+registry = Registry()
+
+
+class RequestTimings:
+    """Milliseconds per phase of one request, also written by the fan-out threads it starts."""
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def header(self, total):
+        with self._lock:
+            phases = list(self.phases.items())
+        parts = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in phases]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(parts)
+
+
+def record(phase, seconds):
+    if not settings.METRICS_ENABLED:
+        return
+    registry.observe('dogs_phase_duration_seconds', seconds, phase=phase)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def count(name, **labels):
+    if settings.METRICS_ENABLED:
+        registry.inc(name, **labels)
+
+
+def cache_result(cache_name, hit):
+    count('dogs_cache_requests_total', cache=cache_name, result='hit' if hit else 'miss')
+
+
+def in_request_context(fn):
+    """Wraps `fn` so it runs in the caller's context, the pool threads then add to the same request timings."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in items) + '}'
+
+
+HELP = {
+    'dogs_request_duration_seconds': "Time spent in Django per request, from the first middleware to the response",
+    'dogs_phase_duration_seconds': "Time spent per phase (upstream_*, cache, db, render, history_flush)",
+    'dogs_cache_requests_total': "Cache lookups by cache and result",
+    'dogs_upstream_requests_total': "Upstream HTTP attempts by upstream and outcome",
+    'dogs_gif_lookups_skipped_total': "Breed details answered without a gif because every fan-out thread was busy",
+}
+
+
+def render_prometheus():
+    """Text exposition format 0.0.4."""
+    histograms, counters = registry.snapshot()
+    lines = []
+
+    by_name = {}
+    for (name, labels), histogram in sorted(histograms.items()):
+        by_name.setdefault(name, []).append((labels, histogram))
+    for name, series in by_name.items():
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        quantile_name = f"{name.removesuffix('_seconds')}_quantile_seconds"
+        lines += [f"# HELP {quantile_name} p50/p95/p99 estimated from {name}", f"# TYPE {quantile_name} gauge"]
+        for labels, histogram in series:
+            for q in QUANTILES:
+                lines.append(f"{quantile_name}{_labels(labels, quantile=q)} {histogram.quantile(q):.6f}")
+
+    by_name = {}
+    for (name, labels), value in sorted(counters.items()):
+        by_name.setdefault(name, []).append((labels, value))
+    for name, series in by_name.items():
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels(labels)} {value}" for labels, value in series]
+
+    # Hit ratio per cache, what we usually look at first
+    caches = {}
+    for labels, value in by_name.get('dogs_cache_requests_total', []):
+        labels = dict(labels)
+        hits, total = caches.get(labels['cache'], (0, 0))
+        caches[labels['cache']] = (hits + (value if labels['result'] == 'hit' else 0), total + value)
+    if caches:
+        lines += ["# HELP dogs_cache_hit_ratio Hits over lookups since the worker started", "# TYPE dogs_cache_hit_ratio gauge"]
+        lines += [f'dogs_cache_hit_ratio{{cache="{name}"}} {hits / total:.4f}' for name, (hits, total) in sorted(caches.items())]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,78 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import RequestTimings, record, registry, request_timings, timed
+
+
+class TimingMiddleware:
+    """
+    Times every request and its phases (see dogs/metrics.py): queries on the request's
+    connection count as "db", the DRF/template render as "render", the hooks in the
+    upstream client and the caches add their own. The phases are sent back in a
+    Server-Timing header and the totals go to the dogs_request_duration_seconds histogram.
+
+    Streaming responses (history exports) are timed until the first byte, not the last.
+    Under ASGI the queries run on Django's sync thread, on another connection than the one
+    wrapped here, so requests served that way have no "db" phase.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        registry.observe(
+            'dogs_request_duration_seconds', total,
+            route=match.url_name if match is not None else 'unmatched', method=request.method, status=response.status_code,
+        )
+        response['Server-Timing'] = timings.header(total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returned, right after this hook
+        started = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: record('render', time.perf_counter() - started))
+        return response
+
+
+def time_query(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
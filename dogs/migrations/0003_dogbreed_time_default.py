@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0002_dogbreed_time_alter_dogbreed_description_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dogbreed',
+            name='time',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
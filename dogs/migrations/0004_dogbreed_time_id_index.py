@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0003_dogbreed_time_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dogbreed',
+            index=models.Index(fields=['time', 'id'], name='dogbreed_time_id_idx'),
+        ),
+    ]
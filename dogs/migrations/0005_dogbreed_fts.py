@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# External content FTS5 table over the history, kept in sync by triggers so that
+# bulk_create (history sink) and fast-path deletes, which send no signals, are covered too.
+FTS_SQL = [
+    """CREATE VIRTUAL TABLE dogs_dogbreed_fts USING fts5(
+        name, description, content='dogs_dogbreed', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER dogs_dogbreed_fts_insert AFTER INSERT ON dogs_dogbreed BEGIN
+        INSERT INTO dogs_dogbreed_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER dogs_dogbreed_fts_delete AFTER DELETE ON dogs_dogbreed BEGIN
+        INSERT INTO dogs_dogbreed_fts(dogs_dogbreed_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER dogs_dogbreed_fts_update AFTER UPDATE ON dogs_dogbreed BEGIN
+        INSERT INTO dogs_dogbreed_fts(dogs_dogbreed_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO dogs_dogbreed_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO dogs_dogbreed_fts(dogs_dogbreed_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS dogs_dogbreed_fts_insert",
+    "DROP TRIGGER IF EXISTS dogs_dogbreed_fts_delete",
+    "DROP TRIGGER IF EXISTS dogs_dogbreed_fts_update",
+    "DROP TABLE IF EXISTS dogs_dogbreed_fts",
+]
+
+
+def run_on_sqlite(statements):
+    def operation(apps, schema_editor):
+        # Other databases fall back to the icontains backend in dogs/search.py
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0004_dogbreed_time_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(FTS_SQL), run_on_sqlite(DROP_FTS_SQL)),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0005_dogbreed_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BreedSearchRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('name', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'name'), name='breedsearchrollup_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:20
+
+import importlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The history's full-text index moves to the breed table in 0010, dropped first so the
+# compaction in 0009 doesn't reindex every row it touches
+fts = importlib.import_module('dogs.migrations.0005_dogbreed_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0007_tokenversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(fts.run_on_sqlite(fts.DROP_FTS_SQL), fts.run_on_sqlite(fts.FTS_SQL)),
+        migrations.CreateModel(
+            name='Breed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(editable=False, max_length=40, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('image_url', models.URLField(blank=True, null=True)),
+            ],
+        ),
+        # Nullable until 0010 drops it, so going back re-adds it empty and 0009 fills it before this is undone
+        migrations.AlterField(
+            model_name='dogbreed',
+            name='name',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='dogbreed',
+            name='breed',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='searches', to='dogs.breed'),
+        ),
+    ]
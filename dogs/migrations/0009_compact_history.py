@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+from django.db import migrations, transaction
+
+
+BATCH_SIZE = 5000  # history rows per transaction
+
+
+def breed_key(name, description, image_url):
+    # Same as dogs.models.breed_key, copied so the migration doesn't change if that does
+    return hashlib.sha1(json.dumps([name, description, image_url]).encode('utf-8')).hexdigest()
+
+
+def compact_history(apps, schema_editor):
+    """
+    Points every history row to its breed, BATCH_SIZE rows per transaction in pk order, so
+    memory doesn't grow with the table and the sink can write between batches. Rows already
+    done are skipped, an interrupted run picks up where it stopped.
+    """
+    DogBreed = apps.get_model('dogs', 'DogBreed')
+    Breed = apps.get_model('dogs', 'Breed')
+    connection = schema_editor.connection
+    breed_ids = dict(Breed.objects.values_list('key', 'id'))
+    last = 0
+    while True:
+        with transaction.atomic(using=connection.alias):
+            rows = list(
+                DogBreed.objects.filter(id__gt=last, breed__isnull=True).order_by('id')
+                .values_list('id', 'name', 'description', 'image_url')[:BATCH_SIZE]
+            )
+            if not rows:
+                return
+            keys = [breed_key(name, description, image_url) for _, name, description, image_url in rows]
+            new = {}
+            for key, (_, name, description, image_url) in zip(keys, rows):
+                if key not in breed_ids and key not in new:
+                    new[key] = Breed(key=key, name=name, description=description, image_url=image_url)
+            if new:
+                Breed.objects.bulk_create(new.values(), ignore_conflicts=True)
+                breed_ids.update(Breed.objects.filter(key__in=new).values_list('key', 'id'))
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"UPDATE {DogBreed._meta.db_table} SET breed_id = %s WHERE id = %s",
+                    [(breed_ids[key], row[0]) for key, row in zip(keys, rows)],
+                )
+            last = rows[-1][0]
+
+
+def expand_history(apps, schema_editor):
+    # Reverse: copy the breed fields back into the history rows
+    DogBreed = apps.get_model('dogs', 'DogBreed')
+    Breed = apps.get_model('dogs', 'Breed')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for breed in Breed.objects.iterator():
+            cursor.execute(
+                f"UPDATE {DogBreed._meta.db_table} SET name = %s, description = %s, image_url = %s WHERE breed_id = %s",
+                [breed.name, breed.description, breed.image_url, breed.id],
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False  # one transaction per batch
+
+    dependencies = [
+        ('dogs', '0008_breed'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_history, expand_history),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:20
+
+import importlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+run_on_sqlite = importlib.import_module('dogs.migrations.0005_dogbreed_fts').run_on_sqlite
+
+# Keyword search of the history now matches the few breed rows and filters the history by breed_id
+FTS_SQL = [
+    """CREATE VIRTUAL TABLE dogs_breed_fts USING fts5(
+        name, description, content='dogs_breed', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER dogs_breed_fts_insert AFTER INSERT ON dogs_breed BEGIN
+        INSERT INTO dogs_breed_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER dogs_breed_fts_delete AFTER DELETE ON dogs_breed BEGIN
+        INSERT INTO dogs_breed_fts(dogs_breed_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER dogs_breed_fts_update AFTER UPDATE ON dogs_breed BEGIN
+        INSERT INTO dogs_breed_fts(dogs_breed_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO dogs_breed_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO dogs_breed_fts(dogs_breed_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS dogs_breed_fts_insert",
+    "DROP TRIGGER IF EXISTS dogs_breed_fts_delete",
+    "DROP TRIGGER IF EXISTS dogs_breed_fts_update",
+    "DROP TABLE IF EXISTS dogs_breed_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0009_compact_history'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dogbreed',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='dogbreed',
+            name='image_url',
+        ),
+        migrations.RemoveField(
+            model_name='dogbreed',
+            name='name',
+        ),
+        migrations.AlterField(
+            model_name='dogbreed',
+            name='breed',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='searches', to='dogs.breed'),
+        ),
+        migrations.RunPython(run_on_sqlite(FTS_SQL), run_on_sqlite(DROP_FTS_SQL)),
+    ]
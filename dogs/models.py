@@ -1,11 +1,114 @@
+import hashlib
+import json
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
-class DogBreed(models.Model):
+def breed_key(name, description, image_url):
+    # Fixed size, unlike a unique constraint over the text, and None stays different from ''
+    return hashlib.sha1(json.dumps([name, description, image_url]).encode('utf-8')).hexdigest()
+
+
+class BreedManager(models.Manager):
+    def resolve(self, breeds):
+        """
+        Gives every Breed the pk of the stored one with the same fields, creating
+        the missing ones. One query for a batch of known breeds, three when some are new.
+        """
+        for breed in breeds:
+            breed.key = breed_key(breed.name, breed.description, breed.image_url)
+        found = dict(self.filter(key__in={breed.key for breed in breeds}).values_list('key', 'id'))
+        missing = {breed.key: breed for breed in breeds if breed.key not in found}
+        if missing:
+            # Another worker may be creating the same ones, whoever comes second keeps the first row
+            self.bulk_create([
+                Breed(key=key, name=breed.name, description=breed.description, image_url=breed.image_url)
+                for key, breed in missing.items()
+            ], ignore_conflicts=True)
+            found.update(self.filter(key__in=missing).values_list('key', 'id'))
+        for breed in breeds:
+            breed.pk = found[breed.key]
+        return breeds
+
+
+class Breed(models.Model):
+    """
+    A breed as searches returned it: name, temperament and gif. History rows point here
+    instead of repeating the text, so the same few hundred rows serve every search.
+    """
+    key = models.CharField(max_length=40, unique=True, editable=False)  # breed_key() of the fields below
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     image_url = models.URLField(blank=True, null=True)
-    time = models.DateTimeField(auto_now_add=True) 
+
+    objects = BreedManager()
+
+    def __str__(self):
+        return self.name
+
+
+class HistoryQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Every time, a pk from a rolled back attempt (history sink retries) may not exist anymore
+        objs = list(objs)
+        Breed.objects.resolve([dog_breed.breed for dog_breed in objs])
+        for dog_breed in objs:
+            dog_breed.breed = dog_breed.breed  # sets breed_id, assigning breed_id itself would drop the cached Breed
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class DogBreed(models.Model):
+    """One search of the history, the breed it returned is shared with the other searches."""
+    breed = models.ForeignKey(Breed, on_delete=models.PROTECT, related_name='searches')
+    time = models.DateTimeField(default=timezone.now, editable=False) # set when the search happens, the row may be written later
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['time', 'id'], name='dogbreed_time_id_idx'), # keyset pagination of the history
+        ]
+
+    objects = HistoryQuerySet.as_manager()
+
+    @classmethod
+    def from_details(cls, name, description=None, image_url=None, **fields):
+        """An unsaved search, its Breed is looked up (or created) when the row is saved or bulk created."""
+        return cls(breed=Breed(name=name, description=description, image_url=image_url), **fields)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            Breed.objects.resolve([self.breed])
+            self.breed = self.breed
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.breed.name
+
+
+class BreedSearchRollup(models.Model):
+    """Searches per breed per hour or day, kept up to date by the history sink (dogs/rollups.py)."""
+    PERIODS = [('hour', 'Hour'), ('day', 'Day')]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    bucket = models.DateTimeField() # start of the hour or day, UTC
+    name = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Upsert target, and the index behind the top-N and time series range scans
+            models.UniqueConstraint(fields=['period', 'bucket', 'name'], name='breedsearchrollup_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} {self.period} {self.bucket:%Y-%m-%d %H:00}: {self.count}"
+
+
+class TokenVersion(models.Model):
+    """Version carried by a user's JWTs, bumping it revokes every token issued before (dogs/auth.py)."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='token_version')
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.user_id}: {self.version}"
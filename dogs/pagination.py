@@ -0,0 +1,42 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    raw = f"{row.time.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        time_part, pk_part = raw.rsplit('|', 1)
+        searched_at, pk = parse_datetime(time_part), int(pk_part)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if searched_at is None:
+        raise InvalidCursor(cursor)
+    return searched_at, pk
+
+
+def keyset_page(queryset, cursor=None, limit=100):
+    """
+    One page of `queryset`, newest first, and the cursor of the next page (None on the last one).
+
+    Seeks on the (time, id) index instead of using OFFSET, so every page costs the same no
+    matter how deep into the history it is, and rows inserted meanwhile don't shift pages.
+    """
+    queryset = queryset.order_by('-time', '-id')
+    if cursor:
+        searched_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(time__lt=searched_at) | Q(time=searched_at, id__lt=pk))
+    rows = list(queryset[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
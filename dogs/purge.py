@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.db.models.signals import post_delete, pre_delete
+from django.utils import timezone
+
+from . import rollups
+from .models import DogBreed
+
+
+logger = logging.getLogger(__name__)
+
+
+def can_truncate():
+    """True when deleting history rows needs no per row work (no delete signals, nothing cascades)."""
+    if pre_delete.has_listeners(DogBreed) or post_delete.has_listeners(DogBreed):
+        return False
+    return not DogBreed._meta.related_objects
+
+
+def truncate_history():
+    """
+    Empty the history with one statement, without loading a single pk. The history table
+    has no trigger (the full-text index is on the breed table), so SQLite truncates it.
+    The search rollups go with it, the breeds stay for the next searches.
+    """
+    with transaction.atomic():
+        rollups.clear()
+        DogBreed.objects.all()._raw_delete(DogBreed.objects.db)
+
+
+def delete_in_batches(searches, on_batch=None):
+    """
+    Deletes `searches` by pk ranges of HISTORY_PURGE_BATCH_SIZE, each one in its own
+    short transaction with a HISTORY_PURGE_PAUSE in between, so the history sink can keep
+    inserting meanwhile. `on_batch(deleted)` is called after every batch that deleted rows.
+    """
+    bounds = searches.aggregate(low=Min('id'), high=Max('id'))
+    low, high = bounds['low'], bounds['high']
+    total = 0
+    while low is not None and low <= high:
+        batch_end = low + settings.HISTORY_PURGE_BATCH_SIZE
+        deleted, _ = searches.filter(id__gte=low, id__lt=batch_end).delete()
+        low = batch_end
+        total += deleted
+        if deleted and on_batch:
+            on_batch(deleted)
+        if low <= high and settings.HISTORY_PURGE_PAUSE:
+            time.sleep(settings.HISTORY_PURGE_PAUSE)  # give waiting writers the lock
+    return total
+
+
+class PurgeJob:
+    """
+    Deletes the history (or the part older than `older_than`) in the background with
+    delete_in_batches(). Progress is kept in the Django cache so any worker can report it.
+    Rows added after the job started are left alone. Deleting the part older than
+    `older_than` keeps the search rollups, like archiving does, so the stats still count
+    those searches. Deleting everything recounts them from the rows added meanwhile.
+    """
+
+    def __init__(self, older_than=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.older_than = older_than
+        self.state = {
+            'id': self.id,
+            'status': 'queued',
+            'older_than': older_than.isoformat() if older_than else None,
+            'total': None,
+            'deleted': 0,
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+        }
+
+    def queryset(self):
+        searches = DogBreed.objects.all()
+        if self.older_than is not None:
+            searches = searches.filter(time__lt=self.older_than)
+        return searches
+
+    def run(self):
+        self._save(status='running', started_at=timezone.now().isoformat())
+        try:
+            searches = self.queryset()
+            self._save(total=searches.count())
+            delete_in_batches(searches, lambda deleted: self._save(deleted=self.state['deleted'] + deleted))
+            if self.older_than is None:
+                rollups.rebuild()  # from the few rows that came in meanwhile
+        except Exception as e:
+            logger.exception("Search history purge %s failed", self.id)
+            self._save(status='failed', error=str(e), finished_at=timezone.now().isoformat())
+        else:
+            self._save(status='done', finished_at=timezone.now().isoformat())
+        return self.state
+
+    def start(self):
+        self._save()
+        if connection.in_atomic_block:
+            # Inside a transaction (ATOMIC_REQUESTS, tests) a thread wouldn't see our rows, run it right here
+            self.run()
+            return self.state
+        thread = threading.Thread(target=self._run_in_thread, name=f'history-purge-{self.id[:8]}', daemon=True)
+        thread.start()
+        return self.state
+
+    def _run_in_thread(self):
+        try:
+            self.run()
+        finally:
+            connection.close()
+
+    def _save(self, **changes):
+        self.state.update(changes)
+        cache.set(job_key(self.id), dict(self.state), timeout=settings.HISTORY_PURGE_JOB_TTL)
+
+
+def job_key(job_id):
+    return f"history-purge:{job_id}"
+
+
+def get_job(job_id):
+    return cache.get(job_key(job_id))
@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.http import parse_etags
+
+from rest_framework.response import Response
+
+
+def normalize_filters(terms):
+    # BreedIndex.search intersects the terms, so their order and duplicates don't change the answer
+    return tuple(sorted({term.lower() for term in terms}))
+
+
+def make_etag(version, media_type, terms):
+    """Strong ETag, the same catalog version, representation and filters always render the same bytes."""
+    digest = hashlib.sha1('\x00'.join([version, media_type, *terms]).encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    # If-None-Match uses the weak comparison, W/"x" matches "x"
+    return '*' in etags or etag in {tag.removeprefix('W/') for tag in etags}
+
+
+class PrerenderedResponse(Response):
+    """DRF Response whose body was rendered earlier, `data` is kept for the tests and the browsable API."""
+
+    def __init__(self, body, data, content_type, **kwargs):
+        super().__init__(data, **kwargs)
+        self.body = body
+        self.body_content_type = content_type
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = self.body_content_type
+        return self.body
+
+
+class RenderedResponseCache:
+    """
+    Encoded response bodies keyed on (catalog version, media type, normalized filters).
+
+    Entries of an older catalog version can never be served again, so the whole cache is
+    dropped as soon as a request comes in with a new version. Bounded LRU otherwise.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, version, key, entry):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = entry
+            while len(self._entries) > settings.BREEDS_RESPONSE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+breed_responses = RenderedResponseCache()
@@ -0,0 +1,106 @@
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+
+from .models import BreedSearchRollup, DogBreed
+
+
+PERIODS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+
+def bucket_start(moment, period):
+    """Start of the UTC hour or day `moment` falls in."""
+    start = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return start.replace(hour=0) if period == 'day' else start
+
+
+def count_searches(searches, periods=PERIODS):
+    """(name, time) pairs to {(period, bucket, name): searches}."""
+    counts = Counter()
+    for name, searched_at in searches:
+        for period in periods:
+            counts[period, bucket_start(searched_at, period), name] += 1
+    return counts
+
+
+def add_counts(counts):
+    """
+    Adds to the rollup rows, one upsert per bucket and breed rather than per search. Needs
+    INSERT ... ON CONFLICT (SQLite 3.24+, PostgreSQL), Django's bulk_create can only
+    overwrite a conflicting row, not add to it.
+    """
+    if not counts:
+        return
+    table = BreedSearchRollup._meta.db_table
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (period, bucket, name, count) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (period, bucket, name) DO UPDATE SET count = {table}.count + excluded.count",
+            [(period, adapt(bucket), name, count) for (period, bucket, name), count in counts.items()],
+        )
+
+
+def record_searches(dog_breeds):
+    """Counts freshly written history rows, call it in the transaction that inserted them."""
+    add_counts(count_searches((dog_breed.breed.name, dog_breed.time) for dog_breed in dog_breeds))
+
+
+def rebuild(batch_size=5000):
+    """
+    Recounts the rollups from the whole history, reading it in pk batches so memory only
+    depends on the number of buckets. Rows written after the rollups were emptied have a
+    higher pk than the last one read here and are counted by the sink instead, so the
+    history can keep growing meanwhile. Returns how many rows were read.
+    """
+    with transaction.atomic():
+        BreedSearchRollup.objects.all().delete()
+        high = DogBreed.objects.aggregate(high=Max('id'))['high']
+    last, read = 0, 0
+    while high is not None and last < high:
+        rows = list(
+            DogBreed.objects.filter(id__gt=last, id__lte=high).order_by('id').values_list('id', 'breed__name', 'time')[:batch_size]
+        )
+        if not rows:
+            break
+        with transaction.atomic():
+            add_counts(count_searches((name, searched_at) for _, name, searched_at in rows))
+        last, read = rows[-1][0], read + len(rows)
+    return read
+
+
+def clear():
+    BreedSearchRollup.objects.all().delete()
+
+
+def top_breeds(period, since, until, limit):
+    """The `limit` most searched breeds in the buckets between `since` and `until`."""
+    return list(
+        BreedSearchRollup.objects
+        .filter(period=period, bucket__gte=bucket_start(since, period), bucket__lt=until)
+        .values('name')
+        .annotate(count=Sum('count'))
+        .order_by('-count', 'name')[:limit]
+    )
+
+
+def time_series(period, since, until, name=None):
+    """Searches per bucket between `since` and `until` (of one breed or all), empty buckets included."""
+    rollups = BreedSearchRollup.objects.filter(period=period, bucket__gte=bucket_start(since, period), bucket__lt=until)
+    if name:
+        rollups = rollups.filter(name__iexact=name)
+    counts = dict(rollups.values_list('bucket').annotate(count=Sum('count')).order_by())
+    series, bucket = [], bucket_start(since, period)
+    while bucket < until:
+        series.append({'time': bucket, 'count': counts.get(bucket, 0)})
+        bucket += PERIODS[period]
+    return series
+
+
+def bucket_count(period, since, until):
+    return max(0, -(-(until - bucket_start(since, period)) // PERIODS[period]))
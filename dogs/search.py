@@ -0,0 +1,61 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Breed
+
+
+TERM_RE = re.compile(r'\w+')
+
+FTS_TABLE = 'dogs_breed_fts'
+
+
+def parse_terms(query):
+    """Keywords of a search, every one of them has to match (at the start of a word)."""
+    return [term.lower() for term in TERM_RE.findall(query)]
+
+
+class IContainsBackend:
+    """Portable fallback, a LIKE scan over the names and descriptions of the breed table."""
+
+    def filter(self, queryset, query):
+        breeds = Breed.objects.all()
+        for term in parse_terms(query):
+            breeds = breeds.filter(Q(name__icontains=term) | Q(description__icontains=term))
+        return queryset.filter(breed__in=breeds.values('id'))
+
+
+class SQLiteFTSBackend:
+    """
+    SQLite FTS5 index over the name and description of the breeds (created in migration
+    0010), the history rows are then picked by breed_id.
+
+    Every keyword is a prefix query, so "friend" still finds "Friendly" like the old
+    icontains filter did, and several keywords must all match.
+    """
+
+    table = FTS_TABLE
+
+    def filter(self, queryset, query):
+        terms = parse_terms(query)
+        if not terms:
+            return queryset
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(breed_id__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match]))
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        if settings.HISTORY_SEARCH_BACKEND == 'auto':
+            _backend = SQLiteFTSBackend() if connection.vendor == 'sqlite' else IContainsBackend()
+        else:
+            _backend = import_string(settings.HISTORY_SEARCH_BACKEND)()
+    return _backend
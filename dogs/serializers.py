@@ -3,6 +3,11 @@ from .models import DogBreed
 from rest_framework import serializers
 
 class DogBreedSerializer(serializers.ModelSerializer):
+    # Stored once per breed, use select_related('breed') for lists
+    name = serializers.CharField(source='breed.name')
+    description = serializers.CharField(source='breed.description', allow_null=True)
+    image_url = serializers.URLField(source='breed.image_url', allow_null=True)
+
     class Meta:
         model = DogBreed
         fields = ['name', 'description', 'image_url']
@@ -1,6 +1,56 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
+import gc
+import gzip
+import io
+import json
+import os
+import pickle
+import requests
+import tempfile
+import threading
+import time
+import warnings
+from asgiref.sync import async_to_sync
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.http import StreamingHttpResponse
+from unittest import mock
+from pathlib import Path
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.conf import settings
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase, override_settings
+
+from dogs_project.settings import sqlite_database
+
+from .archive import archive_history, archived_days, read_archive
+from .auth import auth_cache
+from .breed_index import BreedIndex, catalog_version
+from .breed_table import BreedTable
+from .cache_utils import LOCK_GUARDS, _lock_path, acquire_lock, release_lock
+from .db import REPLICA_DB, ReplicaRouter, _replica_reads, replica_reads, use_replica
+from .catalog import BreedCatalog, CatalogMirror, CatalogUnavailable, fetch_catalog, load_snapshot, mirror, search_upstream
+from .details import fanout_slots
+from .fake_upstream import FakeUpstream
+from .gif_cache import gif_cache
+from .history import HistorySink, history_sink
+from .metrics import Histogram, registry, render_prometheus, timed
+from .models import Breed, BreedSearchRollup, DogBreed, TokenVersion
+from .openapi import stale_schema_files
+from .response_cache import breed_responses
+from .rollups import bucket_start, count_searches
+from .search import IContainsBackend, SQLiteFTSBackend
+from .upstream import CircuitOpen, RateLimited, UpstreamBudget, UpstreamClient, get_async_client, get_client, reset_clients
+from .warmup import warm_up
 
 class FetchBreedDetailsTest(APITestCase):
 
@@ -23,6 +73,12 @@ class FetchBreedDetailsTest(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_non_string_breed(self): # 400 instead of a 500 from the catalog lookup
+        url = reverse('fetch_breed_details')
+        for breed in (123, ["akita"], {"name": "akita"}):
+            response = self.client.post(url, {"breed": breed}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 class GetDogBreedsTest(APITestCase):
 
     def test_fetch_all_breeds(self): # Success if response 200 and list is not empty
@@ -50,4 +106,1091 @@ class UserSearchHistoryTest(APITestCase):
         self.client.credentials()  
         url = reverse('user_search_history')
         response = self.client.get(url)
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class StatelessJWTTest(APITestCase):
+
+    def setUp(self):
+        auth_cache.clear() # sqlite hands out the same user ids again in every test
+        self.admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.tokens = self.client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'admin'}, format='json').data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def tearDown(self):
+        auth_cache.clear()
+
+    def history(self):
+        return self.client.get(reverse('user_search_history')).status_code
+
+    def test_admin_requests_skip_the_user_query(self): # staff flag from the token, version from the cache
+        self.assertEqual(self.history(), status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.history(), status.HTTP_200_OK)
+        self.assertEqual([q['sql'] for q in queries if 'auth_user' in q['sql'] or 'tokenversion' in q['sql']], [])
+
+    def test_version_bump_revokes_access_and_refresh(self):
+        self.assertEqual(self.history(), status.HTTP_200_OK)
+        call_command('revoke_tokens', 'admin', stdout=io.StringIO())
+        self.assertEqual(self.history(), status.HTTP_401_UNAUTHORIZED)
+        refresh = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(refresh.status_code, status.HTTP_401_UNAUTHORIZED)
+        tokens = self.client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'admin'}, format='json').data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.history(), status.HTTP_200_OK) # a fresh login carries the new version
+
+    def test_demoted_admin_loses_old_tokens(self): # saving a changed staff flag bumps the version
+        self.admin_user.is_staff = False
+        self.admin_user.save()
+        self.assertEqual(self.history(), status.HTTP_401_UNAUTHORIZED)
+        self.admin_user.save(update_fields=['last_login']) # unrelated saves revoke nothing
+        self.assertEqual(TokenVersion.objects.get(user=self.admin_user).version, 1)
+
+class DocsTest(SimpleTestCase):
+
+    def test_swagger_and_redoc(self): # built on the first docs request instead of at startup
+        self.assertEqual(self.client.get('/swagger/?format=openapi').json()['info']['title'], 'Dog API')
+        self.assertEqual(self.client.get('/redoc/').status_code, status.HTTP_200_OK)
+
+    def test_ui_loads_the_static_schema(self): # no schema generation behind the page
+        self.assertContains(self.client.get('/swagger/'), '/static/openapi/openapi.json')
+        self.assertContains(self.client.get('/redoc/'), '/static/openapi/openapi.json')
+
+    def test_committed_schema_is_current(self): # fails when a view or a @swagger_auto_schema changed without regenerating
+        self.assertEqual(stale_schema_files(), [], "run python manage.py generate_openapi_schema and commit the result")
+
+
+CATALOG = [
+    {'name': 'Akita', 'description': 'Docile, Alert, Responsive, Dignified, Composed, Friendly, Receptive, Faithful, Courageous'},
+    {'name': 'Alaskan Husky', 'description': 'Friendly, Energetic, Loyal, Gentle, Confident'},
+    {'name': 'Border Collie', 'description': 'Tenacious, Keen, Energetic, Responsive, Alert, Intelligent'},
+    {'name': 'Pug', 'description': ''},
+]
+
+class BreedIndexTest(SimpleTestCase):
+
+    def linear_scan(self, terms): # the filtering get_dog_breeds used to do
+        terms = [term.lower() for term in terms]
+        return [b['name'] for b in CATALOG if all(t in b['name'].lower() or t in b['description'].lower() for t in terms)]
+
+    def test_index_matches_linear_scan(self): # same results as substring search, including short and odd terms
+        index = BreedIndex(CATALOG)
+        for terms in [[], ['loyal'], ['FRIENDLY', 'alert'], ['a'], ['ky'], ['er'], ['ng, lo'], ['husky alert'], ['pug'], ['zzz'], [''], ['y\x00d']]:
+            self.assertEqual(index.search(terms), self.linear_scan(terms), terms)
+
+    def test_version_changes_with_catalog(self): # index rebuild is driven by the version
+        changed = CATALOG[:3] + [{'name': 'Pug', 'description': 'Playful'}]
+        self.assertEqual(catalog_version(CATALOG), catalog_version(list(CATALOG)))
+        self.assertNotEqual(catalog_version(CATALOG), catalog_version(changed))
+
+class BreedTableTest(SimpleTestCase):
+
+    def test_round_trips_every_description(self): # trait lists are encoded, odd descriptions are kept as they are
+        breeds = CATALOG + [{'name': 'Mutt', 'description': None}, {'name': 'Odd', 'description': 'Loyal,Calm, '}]
+        table = BreedTable.from_dicts(breeds)
+        self.assertEqual(table.to_dicts(), breeds)
+        self.assertEqual(table[-1], breeds[-1])
+        self.assertEqual(pickle.loads(pickle.dumps(table)).to_dicts(), breeds)
+        self.assertEqual(BreedIndex(table).search(['friendly']), ['Akita', 'Alaskan Husky'])
+
+    def test_traits_are_shared(self): # one vocabulary entry per distinct trait
+        table = BreedTable.from_dicts(CATALOG)
+        self.assertEqual(len(table.vocabulary), len({t for b in CATALOG if b['description'] for t in b['description'].split(', ')}))
+        self.assertEqual(BreedCatalog(table).version, BreedCatalog(CATALOG).version) # same version as the dict list
+
+# Labeled misspellings against the FakeUpstream catalog, None means nothing should be resolved
+TYPOS = [
+    ('akitta', 'Akita'), ('AKIT', 'Akita'), ('german shepard', 'German Shepherd Dog'), ('shepard', None),
+    ('shepherd german', 'German Shepherd Dog'), ('labrdor', 'Labrador Retriever'), ('labrador retreiver', 'Labrador Retriever'),
+    ('alaskan huskey', 'Alaskan Husky'), ('huskie', None), ('border colie', 'Border Collie'), ('boarder collie', 'Border Collie'),
+    ('affenpincher', 'Affenpinscher'), ('afgan hound', 'Afghan Hound'), ('afghan', 'Afghan Hound'), ('pugg', None),
+    ('siamese', None), ('cat', None), ('xyz', None), ('golden retriever', None), ('persian', None),
+    ('goldfish', None), ('labradoodle', None), ('cockapoo', None),
+]
+# Too far from the breed to be resolved without asking, the first suggestion instead
+NEAR_MISSES = [('shepard', 'German Shepherd Dog'), ('huskie', 'Alaskan Husky'), ('pugg', 'Pug'), ('labradoodle', 'Labrador Retriever')]
+
+class BreedMatchTest(SimpleTestCase):
+
+    def setUp(self):
+        self.catalog = BreedCatalog.from_api(FakeUpstream().breeds)
+
+    def test_labeled_typos(self): # every labeled query resolves to its breed, or to nothing
+        for query, expected in TYPOS:
+            found = self.catalog.find(query)
+            self.assertEqual(found['name'] if found else None, expected, query)
+
+    def test_near_misses_are_suggested(self): # not resolved, but offered first
+        for query, expected in NEAR_MISSES:
+            self.assertEqual(self.catalog.suggest(query)[0]['name'], expected, query)
+
+    def test_lookup_scores_fuzzy_matches(self): # a score only for a breed found from a misspelling
+        self.assertEqual(self.catalog.lookup('akita'), (self.catalog.find('akita'), None))
+        breed, score = self.catalog.lookup('akitta')
+        self.assertEqual(breed['name'], 'Akita')
+        self.assertGreaterEqual(score, settings.BREED_MATCH_AUTO_SCORE)
+        self.assertEqual(self.catalog.lookup('labradoodle'), (None, None))
+
+    def test_suggestions_are_ranked(self): # "did you mean" for a miss, best first
+        suggestions = self.catalog.suggest('shep dog')
+        self.assertEqual(suggestions[0]['name'], 'German Shepherd Dog')
+        self.assertEqual(suggestions, sorted(suggestions, key=lambda s: -s['score']))
+        self.assertEqual(self.catalog.suggest('xyz'), [])
+
+class OfflineCatalogMixin: # every test gets an empty cache and its own snapshot file
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.tmp_dir.name, 'breed_catalog.json')
+        self.settings_override = override_settings(BREED_CATALOG_PATH=self.snapshot_path)
+        self.settings_override.enable()
+        cache.clear()
+        mirror.clear()
+        gif_cache.clear()
+        breed_responses.clear()
+
+    def tearDown(self):
+        cache.clear()
+        mirror.clear()
+        gif_cache.clear()
+        breed_responses.clear()
+        self.settings_override.disable()
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+class GetDogBreedsFilterTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        mirror.publish(BreedCatalog(CATALOG))
+
+    def test_filters_are_intersected(self): # every filter has to match
+        response = self.client.get(reverse('get_dog_breeds'), {'filter': ['energetic', 'alert']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], ['Border Collie'])
+
+    def test_new_catalog_version_rebuilds_index(self): # a catalog refreshed by another worker is picked up on the next request
+        self.client.get(reverse('get_dog_breeds'), {'filter': 'playful'})
+        changed = CATALOG[:3] + [{'name': 'Pug', 'description': 'Playful'}]
+        CatalogMirror().publish(BreedCatalog(changed), save=False) # the other worker's mirror
+        response = self.client.get(reverse('get_dog_breeds'), {'filter': 'playful'})
+        self.assertEqual(response.data['data'], ['Pug'])
+
+    def test_rendered_response_is_reused(self): # same filters in another order and case, nothing is searched or rendered again
+        first = self.client.get(reverse('get_dog_breeds'), {'filter': ['energetic', 'alert']})
+        with mock.patch.object(BreedIndex, 'search') as search:
+            second = self.client.get(reverse('get_dog_breeds'), {'filter': ['Alert', 'energetic', 'alert']})
+        search.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(json.loads(second.content)['data'], ['Border Collie'])
+
+    def test_conditional_get(self): # 304 with an empty body while the catalog version is the same
+        response = self.client.get(reverse('get_dog_breeds'), {'filter': 'friendly'})
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        not_modified = self.client.get(reverse('get_dog_breeds'), {'filter': 'friendly'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        mirror.publish(BreedCatalog(CATALOG + [{'name': 'Pug', 'description': 'Friendly'}]))
+        changed = self.client.get(reverse('get_dog_breeds'), {'filter': 'friendly'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn('Pug', changed.data['data'])
+
+    def test_async_view_shares_etag_and_bytes(self): # the ASGI variant answers with the exact JSON response of the DRF view
+        response = self.client.get(reverse('get_dog_breeds'), {'filter': ['loyal']}, HTTP_ACCEPT='application/json')
+        async_response = self.client.get(reverse('get_dog_breeds_async'), {'filter': ['LOYAL']})
+        self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(async_response.content, response.content)
+        self.assertEqual(async_response['ETag'], response['ETag'])
+        revalidated = self.client.get(reverse('get_dog_breeds_async'), {'filter': ['loyal']}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+
+class BreedCatalogMirrorTest(OfflineCatalogMixin, APITestCase):
+
+    def test_details_answered_without_upstream_search(self): # first match comes from the local catalog
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            call_command('preload_breed_catalog', stdout=io.StringIO())
+            mirror.clear()
+            cache.clear()
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'husky'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['name'], 'Alaskan Husky')
+        self.assertEqual(upstream.calls['/v1/breeds'], 1) # only the preload
+        self.assertEqual(upstream.calls['/v1/breeds/search'], 0)
+
+    def test_preload_without_upstream_or_snapshot(self): # the deploy still starts, workers fetch the catalog later
+        stderr = io.StringIO()
+        with FakeUpstream(fail_paths={'/v1/breeds'}) as upstream, override_settings(**upstream.settings()):
+            call_command('preload_breed_catalog', stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('no snapshot', stderr.getvalue())
+        self.assertIsNone(load_snapshot())
+
+    def test_unknown_breed_is_404(self):
+        mirror.publish(BreedCatalog(CATALOG))
+        response = self.client.post(reverse('fetch_breed_details'), {'breed': 'Siamese'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_catalog_served_while_refreshing(self): # stale-while-revalidate
+        mirror.publish(BreedCatalog(CATALOG, fetched_at=time.time() - 10 ** 6))
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            response = self.client.get(reverse('get_dog_breeds'))
+            self.assertIn('Akita', response.data['data'])
+            for _ in range(100):
+                if not mirror._refreshing:
+                    break
+                time.sleep(0.02)
+        self.assertEqual(response.data['data'], [breed['name'] for breed in CATALOG]) # the stale copy answered
+        self.assertEqual(len(load_snapshot().breeds), len(upstream.breeds)) # the refreshed one was persisted
+        self.assertFalse(mirror.get().is_stale())
+
+    def test_warm_up_from_snapshots(self): # catalog, index and gifs are loaded before the first request, which calls no upstream
+        gif_path = os.path.join(self.tmp_dir.name, 'gifs.json')
+        with FakeUpstream() as upstream, override_settings(**upstream.settings(), GIF_SNAPSHOT_PATH=gif_path):
+            call_command('preload_breed_catalog', stdout=io.StringIO())
+            gif_cache.set('akita', 'https://media.giphy.test/akita.gif')
+            gif_cache.save_snapshot()
+            mirror.clear()
+            cache.clear()
+            gif_cache.clear()
+            warm_up()
+            self.assertIsNotNone(mirror._catalog._index)
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'akita'}, format='json')
+        self.assertEqual(response.data['data']['image_url'], 'https://media.giphy.test/akita.gif')
+        self.assertEqual(upstream.calls['/v1/breeds'], 1) # only the preload
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 0)
+
+    def test_rate_limit_is_503_not_404(self): # thedogapi answers 429, the breed isn't reported as missing and nobody retries before Retry-After
+        with FakeUpstream(error_rate=1.0, error_status=429, retry_after=7) as upstream, override_settings(**upstream.settings()):
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'akita'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertLessEqual(int(response['Retry-After']), 7)
+            breeds = self.client.get(reverse('get_dog_breeds'))
+            self.assertEqual(breeds.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            async_response = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'akita'}, format='json')
+            self.assertEqual(async_response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(async_response.json()['details'], response.data['details']) # one helper, the reason is passed through
+        self.assertTrue(response.data['details'].startswith('thedogapi is rate limiting us, '))
+        self.assertEqual(upstream.calls['/v1/breeds'], 1)
+        self.assertEqual(upstream.calls['/v1/breeds/search'], 0)
+
+    def test_warm_up_without_catalog(self): # thedogapi down and no snapshot, the worker still starts and the first request tries again
+        with FakeUpstream(fail_paths={'/v1/breeds'}) as upstream, override_settings(**upstream.settings(), UPSTREAM_RETRIES=0):
+            warm_up()
+            self.assertIsNone(mirror._catalog)
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            response = self.client.get(reverse('get_dog_breeds'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_html_breed_list_is_unavailable(self): # a proxy's HTML page with a 200 doesn't crash the warm-up or the request
+        page = requests.Response()
+        page.status_code, page._content = 200, b'<html><body>Please log in</body></html>'
+        with mock.patch('dogs.catalog.get_client') as get_client:
+            get_client.return_value.get.return_value = page
+            with self.assertRaises(CatalogUnavailable):
+                fetch_catalog()
+            warm_up()
+            self.assertIsNone(mirror._catalog)
+            response = self.client.get(reverse('get_dog_breeds'))
+        self.assertEqual(response.data, {"error": "Failed to fetch breeds from DogsAPI"})
+
+class BreedDetailsFanOutTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        mirror.publish(BreedCatalog.from_api(FakeUpstream().breeds))
+
+    def test_slow_giphy_returns_partial_result(self): # breed data without gif when Giphy is over its timeout
+        with FakeUpstream(giphy_latency=0.5) as upstream, override_settings(**upstream.settings(), GIPHY_API_TIMEOUT=0.1):
+            started = time.perf_counter()
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'akita'}, format='json')
+            elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['name'], 'Akita')
+        self.assertEqual(response.data['data']['image_url'], 'No image available')
+        self.assertLess(elapsed, 0.4)
+
+    def test_busy_pool_answers_without_gif(self): # no waiting in the pool's queue on our Giphy timeout
+        busy = threading.BoundedSemaphore(1)
+        busy.acquire()
+        with FakeUpstream(giphy_latency=0.3) as upstream, override_settings(**upstream.settings(), GIPHY_API_TIMEOUT=1):
+            with mock.patch('dogs.details.fanout_slots', busy):
+                started = time.perf_counter()
+                response = self.client.post(reverse('fetch_breed_details'), {'breed': 'akita'}, format='json')
+                elapsed = time.perf_counter() - started
+            self.client.post(reverse('fetch_breed_details'), {'breed': 'pug'}, format='json')
+        self.assertEqual(response.data['data']['image_url'], 'No image available')
+        self.assertLess(elapsed, 0.2)
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 1) # only the pug, once a thread was free
+        for _ in range(100): # given back by a done callback, right after the result
+            if fanout_slots._value == settings.UPSTREAM_FANOUT_WORKERS:
+                break
+            time.sleep(0.02)
+        self.assertEqual(fanout_slots._value, settings.UPSTREAM_FANOUT_WORKERS)
+
+    def test_typo_is_resolved_locally(self): # no thedogapi call for a misspelled breed, 404 offers suggestions
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'german shepard'}, format='json')
+            missing = self.client.post(reverse('fetch_breed_details'), {'breed': 'akitu inu'}, format='json')
+        self.assertEqual(response.data['data']['name'], 'German Shepherd Dog')
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(missing.data['suggestions'][0]['name'], 'Akita')
+        self.assertEqual(upstream.calls['/v1/breeds/search'], 0)
+
+    def test_fuzzy_match_is_flagged_not_recorded(self): # the guess says what it was matched from, history only has real names
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            typo = self.client.post(reverse('fetch_breed_details'), {'breed': 'german shepard'}, format='json')
+            near = self.client.post(reverse('fetch_breed_details'), {'breed': 'labradoodle'}, format='json')
+            exact = self.client.post(reverse('fetch_breed_details'), {'breed': 'akita'}, format='json')
+            batch = self.client.post(reverse('fetch_breed_details_batch'), {'breeds': ['akitta', 'pug']}, format='json')
+            async_typo = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'akitta'}, content_type='application/json')
+        self.assertEqual(typo.data['data']['matched_from'], 'german shepard')
+        self.assertGreaterEqual(typo.data['data']['score'], settings.BREED_MATCH_AUTO_SCORE)
+        self.assertEqual(near.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(near.data['suggestions'][0]['name'], 'Labrador Retriever')
+        self.assertNotIn('matched_from', exact.data['data'])
+        self.assertEqual(batch.data['data'][0]['data']['matched_from'], 'akitta')
+        self.assertNotIn('matched_from', batch.data['data'][1]['data'])
+        self.assertEqual(async_typo.json()['data']['matched_from'], 'akitta')
+        self.assertEqual(sorted(DogBreed.objects.values_list('breed__name', flat=True)), ['Akita', 'Pug'])
+
+    def test_async_view_matches_sync_view(self): # same response shape from the ASGI variant, row and rollups written on a thread without the sink
+        with FakeUpstream() as upstream, override_settings(**upstream.settings(), HISTORY_SINK_ENABLED=False):
+            response = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'pug'}, content_type='application/json')
+            typo = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'akitu inu'}, content_type='application/json')
+            missing = self.client.post(reverse('fetch_breed_details_async'), {}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['data']['image_url'], 'https://media.giphy.test/pug.gif')
+        self.assertTrue(DogBreed.objects.filter(breed__name='Pug').exists())
+        self.assertEqual(BreedSearchRollup.objects.get(period='day', name='Pug').count, 1) # counted like the sync view's rows
+        self.assertEqual(typo.json()['suggestions'][0]['name'], 'Akita')
+        self.assertEqual(missing.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 1) # through the httpx client
+
+    def test_async_view_without_catalog(self): # cold worker, the breed comes from thedogapi search on the async client
+        mirror.clear()
+        cache.clear()
+        os.unlink(self.snapshot_path)
+        with FakeUpstream(fail_paths=['/v1/breeds']) as upstream, override_settings(**upstream.settings(), HISTORY_SINK_ENABLED=False, UPSTREAM_RETRIES=0):
+            response = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'labrador'}, content_type='application/json')
+        self.assertEqual(response.json()['data']['name'], 'Labrador Retriever')
+        self.assertEqual(upstream.calls['/v1/breeds/search'], 1)
+
+    def test_async_view_refused_search_without_catalog(self): # the Giphy lookup started next to the search is closed, not left unawaited
+        mirror.clear()
+        cache.clear()
+        os.unlink(self.snapshot_path)
+        async def refused(breed_name): # our own budget says no before anything is awaited
+            raise RateLimited("thedogapi budget spent", 3)
+        with FakeUpstream(fail_paths=['/v1/breeds']) as upstream, override_settings(**upstream.settings(), UPSTREAM_RETRIES=0):
+            with mock.patch('dogs.details.asearch_upstream', refused), warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                response = self.client.post(reverse('fetch_breed_details_async'), {'breed': 'akita'}, content_type='application/json')
+                gc.collect()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, RuntimeWarning)], [])
+
+    def test_async_view_non_string_breed(self): # 400 instead of a 500 from the catalog lookup
+        for breed in (123, ["akita"]):
+            response = self.client.post(reverse('fetch_breed_details_async'), {'breed': breed}, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class AsyncStackTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        mirror.publish(BreedCatalog(CATALOG))
+
+    async def test_async_view_behind_the_middleware(self): # ASGI request through the stock middleware and the timing one
+        client = AsyncClient()
+        response = await client.get(reverse('get_dog_breeds_async'), {'filter': 'loyal'}, headers={'accept': 'application/json'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['data'], ['Alaskan Husky'])
+        self.assertEqual(response['X-Frame-Options'], 'DENY') # every middleware still ran
+        self.assertIn('total;dur=', response['Server-Timing'])
+        drf = await client.get(reverse('get_dog_breeds'), {'filter': 'loyal'})
+        self.assertEqual(drf.content, response.content) # DRF views keep working under ASGI
+
+class BreedDetailsBatchTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        mirror.publish(BreedCatalog.from_api(FakeUpstream().breeds))
+
+    def test_batch_resolves_each_breed_once(self): # repeats are dropped, every breed gets its own status
+        with FakeUpstream(giphy_latency=0.1) as upstream, override_settings(**upstream.settings()):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = self.client.post(reverse('fetch_breed_details_batch'), {'breeds': ['akita', 'Pug', ' AKITA', 'siamese', 'Border Collie']}, format='json')
+                elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['breed'] for item in response.data['data']], ['akita', 'Pug', 'siamese', 'Border Collie'])
+        self.assertEqual([item['status'] for item in response.data['data']], ['success', 'success', 'error', 'success'])
+        self.assertEqual(response.data['data'][2]['error'], 'Breed not found')
+        self.assertEqual(response.data['data'][0]['data']['image_url'], 'https://media.giphy.test/akita.gif')
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 3)
+        self.assertLess(elapsed, 0.25) # the three gif lookups overlap
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "dogs_dogbreed"')]), 1)
+        self.assertEqual(DogBreed.objects.count(), 3)
+
+    def test_one_failure_does_not_fail_the_batch(self):
+        def resolve(breed_name):
+            if breed_name == 'akita':
+                raise ValueError('bad upstream body')
+            return {'name': 'Pug', 'description': 'Playful', 'image_url': 'No image available'}
+
+        with mock.patch('dogs.details.resolve_breed_details', side_effect=resolve):
+            response = self.client.post(reverse('fetch_breed_details_batch'), {'breeds': ['akita', 'pug']}, format='json')
+        self.assertEqual([item['status'] for item in response.data['data']], ['error', 'success'])
+        self.assertEqual(list(DogBreed.objects.values_list('breed__name', flat=True)), ['Pug'])
+
+    def test_invalid_batches(self):
+        url = reverse('fetch_breed_details_batch')
+        self.assertEqual(self.client.post(url, {'breeds': 'akita'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {'breeds': [' ']}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BREEDS_BATCH_MAX=2):
+            self.assertEqual(self.client.post(url, {'breeds': ['akita', 'pug', 'labrador']}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+class UpstreamClientTest(SimpleTestCase):
+
+    def setUp(self):
+        reset_clients()
+        cache.clear() # request budgets and 429 cool-downs live in the cache
+
+    def tearDown(self):
+        reset_clients()
+        cache.clear()
+
+    def test_connections_are_reused(self): # keep-alive, one connection for sequential calls
+        with FakeUpstream() as upstream:
+            client = get_client('thedogapi')
+            for _ in range(3):
+                self.assertEqual(client.get(upstream.dogs_api_url).status_code, 200)
+        stats = client.stats()
+        self.assertEqual(stats['new_connections'], 1)
+        self.assertEqual(stats['pool_hits'], 2)
+
+    def test_padded_payload(self): # the stub's filler fields make the answer bigger, not different for us
+        with FakeUpstream(payload_bytes=50_000) as upstream:
+            response = get_client('thedogapi').get(upstream.dogs_api_url)
+        self.assertGreater(len(response.content), 50_000)
+        self.assertEqual(BreedCatalog.from_api(response.json()).version, BreedCatalog.from_api(upstream.breeds).version)
+
+    @override_settings(UPSTREAM_RETRIES=1, UPSTREAM_BACKOFF=0, UPSTREAM_BREAKER_THRESHOLD=2)
+    def test_retries_then_breaker_opens(self): # 503s are retried, then the breaker stops calling upstream
+        with FakeUpstream(error_rate=1.0, error_status=503) as upstream:
+            client = get_client('giphy')
+            self.assertEqual(client.get(upstream.giphy_api_url).status_code, 503)
+            self.assertEqual(client.get(upstream.giphy_api_url).status_code, 503)
+            with self.assertRaises(CircuitOpen):
+                client.get(upstream.giphy_api_url)
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 4)
+        stats = client.stats()
+        self.assertEqual((stats['retries'], stats['breaker_trips'], stats['breaker_rejections']), (2, 1, 1))
+
+    @override_settings(UPSTREAM_BUDGETS={'giphy': (1e-6, 4)}, UPSTREAM_BUDGET_RESERVE=0.25)
+    def test_budget_keeps_a_reserve_for_users(self): # background calls stop a token early, every worker spends the same bucket
+        with FakeUpstream() as upstream:
+            client = get_client('giphy')
+            for _ in range(3):
+                client.get(upstream.giphy_api_url, background=True)
+            with self.assertRaises(RateLimited):
+                client.get(upstream.giphy_api_url, background=True)
+            self.assertEqual(client.get(upstream.giphy_api_url).status_code, 200) # a user request gets the reserve
+            with self.assertRaises(RateLimited):
+                UpstreamClient('giphy', 'GIPHY_API_TIMEOUT').get(upstream.giphy_api_url) # another worker's client
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 4)
+
+    @override_settings(UPSTREAM_BUDGETS={'giphy': (1e-6, 10)}, UPSTREAM_BUDGET_RESERVE=0)
+    def test_budget_on_file_cache_is_not_overspent(self): # incr is a read then a write there, the budget takes a lock
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}}):
+            budget = UpstreamBudget('giphy')
+            def take(_):
+                try:
+                    budget.take()
+                    return True
+                except RateLimited:
+                    return False
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                taken = list(pool.map(take, range(40)))
+        self.assertEqual(taken.count(True), 10)
+
+    @override_settings(UPSTREAM_BUDGETS={'thedogapi': (5, 20)}, UPSTREAM_BUDGET_RESERVE=0)
+    def test_budget_catches_up_once_after_idle(self): # two takers read the stale count before either catches up
+        budget = UpstreamBudget('thedogapi')
+        with mock.patch('time.time', return_value=1_000_000):
+            budget.take()
+        barrier = threading.Barrier(2, timeout=2)
+        incr = LocMemCache.incr
+        def interleaved_incr(self, key, delta=1, version=None): # both first increments happen before either catch-up
+            value = incr(self, key, delta, version)
+            if not barrier.broken and threading.current_thread() is not threading.main_thread():
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            return value
+        with mock.patch('time.time', return_value=1_003_600), mock.patch.object(LocMemCache, 'incr', interleaved_incr):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(lambda _: budget.take(), range(2))) # RateLimited would be raised here
+            barrier.abort()
+            for _ in range(10):
+                budget.take() # the deployment isn't locked out afterwards
+
+    def test_concurrent_searches_are_coalesced(self): # identical thedogapi searches in flight share one call
+        with FakeUpstream(dog_latency=0.2) as upstream, override_settings(**upstream.settings()):
+            with ThreadPoolExecutor(max_workers=10) as pool:
+                results = list(pool.map(search_upstream, ['akita', 'AKITA', ' akita'] * 3 + ['akita']))
+        self.assertEqual(upstream.calls['/v1/breeds/search'], 1)
+        self.assertEqual({result['name'] for result in results}, {'Akita'})
+
+    @override_settings(UPSTREAM_RETRIES=1, UPSTREAM_BACKOFF=0, UPSTREAM_BREAKER_THRESHOLD=2)
+    def test_async_client_shares_the_breaker(self): # failures of the async views open the breaker of the sync ones too
+        async def fail_twice(url):
+            client = get_async_client('giphy')
+            return [(await client.get(url)).status_code for _ in range(2)]
+
+        with FakeUpstream(error_rate=1.0, error_status=503) as upstream:
+            self.assertEqual(async_to_sync(fail_twice)(upstream.giphy_api_url), [503, 503])
+            with self.assertRaises(CircuitOpen):
+                get_client('giphy').get(upstream.giphy_api_url)
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 4)
+
+class GifCacheTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        mirror.publish(BreedCatalog.from_api(FakeUpstream().breeds))
+
+    def test_concurrent_requests_make_one_giphy_call(self): # 50 concurrent lookups of the same breed are coalesced
+        with FakeUpstream(giphy_latency=0.2) as upstream, override_settings(**upstream.settings()):
+            with ThreadPoolExecutor(max_workers=50) as pool:
+                urls = list(pool.map(lambda query: gif_cache.get(query, 'Akita'), ['akita', 'AKITA ', 'Akita'] * 17))
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 1)
+        self.assertEqual(set(urls), {'https://media.giphy.test/akita.gif'})
+
+    def test_no_results_are_cached(self): # negative caching, the second request doesn't ask Giphy again
+        with FakeUpstream(gifs=False) as upstream, override_settings(**upstream.settings()):
+            for _ in range(2):
+                response = self.client.post(reverse('fetch_breed_details'), {'breed': 'husky'}, format='json')
+                self.assertEqual(response.data['data']['image_url'], 'No image available')
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 1)
+
+    def test_errors_are_not_cached(self): # a Giphy outage isn't remembered as "no gif"
+        with FakeUpstream(error_rate=1.0, error_status=400) as upstream, override_settings(**upstream.settings()):
+            self.assertEqual(gif_cache.get('pug', 'Pug'), 'No image available')
+        self.assertIsNone(gif_cache.peek('pug', 'Pug'))
+
+    def test_snapshot_keeps_unexpired_entries(self): # what a worker saves on exit, minus what expired meanwhile
+        gif_cache.set('akita', 'https://media.giphy.test/akita.gif')
+        with override_settings(GIF_CACHE_NEGATIVE_TTL=0):
+            gif_cache.set('pug', None)
+        path = os.path.join(self.tmp_dir.name, 'gifs.json')
+        self.assertEqual(gif_cache.save_snapshot(path), 1)
+        gif_cache.clear()
+        cache.clear()
+        self.assertEqual(gif_cache.save_snapshot(path), 1) # an idle worker exiting last keeps what the others saved
+        self.assertEqual(gif_cache.load_snapshot(path), 1)
+        self.assertEqual(gif_cache.peek('akita'), 'https://media.giphy.test/akita.gif')
+        self.assertIsNone(gif_cache.peek('pug'))
+
+    def test_other_workers_lookup_is_awaited(self): # another worker is asking Giphy already, we use its answer
+        shared_key = gif_cache._cache_key('akita')
+        acquire_lock(shared_key, 5)
+        threading.Timer(0.2, cache.set, args=(shared_key, 'https://media.giphy.test/other.gif')).start()
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            self.assertEqual(gif_cache.get('akita', 'Akita'), 'https://media.giphy.test/other.gif')
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 0)
+
+    @override_settings(GIPHY_API_TIMEOUT=0.1, UPSTREAM_RETRIES=2, UPSTREAM_BACKOFF=0)
+    def test_retrying_lookup_is_awaited(self): # the other worker is past one timeout but still retrying, we keep waiting
+        self.assertAlmostEqual(get_client('giphy').max_duration(), 0.3)
+        shared_key = gif_cache._cache_key('akita')
+        acquire_lock(shared_key, get_client('giphy').max_duration())
+        threading.Timer(0.2, cache.set, args=(shared_key, 'https://media.giphy.test/other.gif')).start()
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            self.assertEqual(gif_cache.get('akita', 'Akita'), 'https://media.giphy.test/other.gif')
+        self.assertEqual(upstream.calls['/v1/gifs/search'], 0)
+
+    @override_settings(GIF_CACHE_SIZE=2)
+    def test_lru_is_bounded(self):
+        for name in ['a', 'b', 'c']:
+            gif_cache.set(name, f"https://media.giphy.test/{name}.gif")
+        self.assertEqual(gif_cache.stats()['size'], 2)
+
+class SharedCacheTest(OfflineCatalogMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(self.tmp_dir.name, 'cache'),
+        }})
+        self.cache_override.enable()
+
+    def tearDown(self):
+        cache.clear()
+        self.cache_override.disable()
+        super().tearDown()
+
+    def test_one_upstream_fetch_for_all_workers(self): # every "worker" sees a stale catalog, only one refreshes it
+        stale = BreedCatalog(CATALOG, fetched_at=time.time() - 10 ** 6)
+        mirror.publish(stale, save=False)
+        workers = [CatalogMirror() for _ in range(8)]
+        with FakeUpstream(dog_latency=0.2) as upstream, override_settings(**upstream.settings()):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                served = list(pool.map(lambda worker: worker.get(), workers))
+            for _ in range(100):
+                if not any(worker._refreshing for worker in workers):
+                    break
+                time.sleep(0.02)
+            refreshed = [worker.get() for worker in workers]
+        self.assertEqual({catalog.version for catalog in served}, {stale.version}) # nobody waited on the refresh
+        self.assertEqual(upstream.calls['/v1/breeds'], 1)
+        self.assertEqual(len({catalog.version for catalog in refreshed}), 1)
+        self.assertNotEqual(refreshed[0].version, stale.version)
+
+    def test_lock_has_one_holder(self): # FileBasedCache.add() alone lets several threads in
+        has_key = FileBasedCache.has_key
+        def slow_has_key(*args, **kwargs): # widens the gap between add()'s check and its write
+            found = has_key(*args, **kwargs)
+            time.sleep(0.05)
+            return found
+        with mock.patch.object(FileBasedCache, 'has_key', slow_has_key), ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = list(pool.map(lambda _: acquire_lock('race', 5), range(8)))
+        self.assertEqual(len([token for token in tokens if token]), 1)
+        release_lock('race', next(token for token in tokens if token))
+        self.assertIsNotNone(acquire_lock('race', 5))
+
+    def test_stale_lock_has_one_taker(self): # expired lock file, several workers take it over at once
+        expired = acquire_lock('stale', 5)
+        lock_path = _lock_path('stale')
+        os.utime(lock_path, (time.time() - 60, time.time() - 60))
+        getmtime = os.path.getmtime
+        def slow_getmtime(path): # widens the gap between the staleness check and the takeover
+            mtime = getmtime(path)
+            time.sleep(0.05)
+            return mtime
+        with mock.patch('os.path.getmtime', slow_getmtime), ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = list(pool.map(lambda _: acquire_lock('stale', 5), range(8)))
+        self.assertEqual(len([token for token in tokens if token]), 1)
+        release_lock('stale', expired) # the expired holder can't release the new one
+        self.assertIsNone(acquire_lock('stale', 5))
+        release_lock('stale', next(token for token in tokens if token))
+
+    def test_lock_guards_are_a_fixed_set(self): # locking many names leaves no file per name behind
+        for i in range(100):
+            release_lock(f'name {i}', acquire_lock(f'name {i}', 5))
+        left = [name for name in os.listdir(caches['default']._dir) if 'lock' in name]
+        self.assertLessEqual(len(left), LOCK_GUARDS)
+        self.assertTrue(all(name.endswith('.guard') for name in left))
+
+    def test_cold_workers_wait_for_one_fetch(self): # no snapshot, simultaneous first requests
+        workers = [CatalogMirror() for _ in range(4)]
+        with FakeUpstream(dog_latency=0.2) as upstream, override_settings(**upstream.settings()):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                loaded = list(pool.map(lambda worker: worker.get(), workers))
+        self.assertEqual(upstream.calls['/v1/breeds'], 1)
+        self.assertEqual(len({catalog.version for catalog in loaded}), 1)
+
+class DatabaseProfileTest(SimpleTestCase):
+
+    def connect(self, name, read_only=False): # a connection configured like the production profile, on a temp file
+        profile = sqlite_database('production', read_only=read_only)
+        wrapper = SQLiteDatabaseWrapper({**connections['default'].settings_dict, **profile, 'NAME': name}, alias='profile')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_production_pragmas(self): # applied on every new connection
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'db.sqlite3')
+        with self.connect(path).cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in ['journal_mode', 'synchronous', 'busy_timeout']}
+            cursor.execute('CREATE TABLE t (id integer)')
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000})
+        replica = self.connect(Path(path).as_uri() + '?mode=ro', read_only=True)
+        with self.assertRaises(DatabaseError), replica.cursor() as cursor:
+            cursor.execute('INSERT INTO t VALUES (1)')
+
+    def test_router_sends_admin_reads_to_replica(self): # only inside replica_reads() and outside a transaction
+        router = ReplicaRouter()
+        with mock.patch.dict(connections.settings, {REPLICA_DB: connections.settings['default']}):
+            self.assertIsNone(router.db_for_read(DogBreed))
+            with replica_reads():
+                self.assertEqual(router.db_for_read(DogBreed), REPLICA_DB)
+                self.assertEqual(router.db_for_write(DogBreed), 'default')
+                with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                    self.assertIsNone(router.db_for_read(DogBreed))
+        with mock.patch.dict(connections.settings), replica_reads():
+            connections.settings.pop(REPLICA_DB, None) # no replica configured (default profile)
+            self.assertIsNone(router.db_for_read(DogBreed))
+        self.assertFalse(router.allow_migrate(REPLICA_DB, 'dogs'))
+
+    def test_streamed_responses_read_on_replica(self): # the export generator runs after the view returned
+        view = use_replica(lambda request: StreamingHttpResponse(str(_replica_reads.get()) for _ in range(2)))
+        self.assertEqual(b''.join(view(None).streaming_content), b'TrueTrue')
+
+@override_settings(HISTORY_SINK_ENABLED=True, HISTORY_SINK_FLUSH_INTERVAL=3600, HISTORY_SINK_BATCH_SIZE=1000)
+class HistorySinkTest(TransactionTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool = override_settings(HISTORY_SPOOL_PATH=os.path.join(self.tmp_dir.name, 'spool.ndjson'))
+        self.spool.enable()
+        self.sink = HistorySink()
+
+    def tearDown(self):
+        self.spool.disable()
+        self.tmp_dir.cleanup()
+
+    def test_rows_are_written_in_one_batch(self): # the request only enqueues, flush does the insert
+        for name in ['Akita', 'Pug', 'Akita']:
+            self.sink.add(name=name, description='Loyal', image_url='https://media.giphy.test/x.gif')
+        self.assertEqual(DogBreed.objects.count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sink.flush(), 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "dogs_dogbreed"')]), 1)
+        self.assertEqual(DogBreed.objects.filter(breed__name='Akita').count(), 2)
+        self.assertEqual(BreedSearchRollup.objects.get(period='day', name='Akita').count, 2) # counted in the same transaction
+
+    def test_unwritten_rows_survive_shutdown(self): # spooled to disk when the database is unavailable, replayed later
+        searched_at = self.sink.add(name='Pug', description='Playful', image_url='No image available').time
+        with mock.patch.object(DogBreed.objects, 'bulk_create', side_effect=DatabaseError('database is locked')):
+            self.sink.shutdown()
+        self.assertEqual(self.sink.pending(), 0)
+        self.assertEqual(self.sink.replay_spool(), 1)
+        self.assertEqual(DogBreed.objects.get().time, searched_at) # original search time is kept
+
+    def test_rejected_row_is_dropped_alone(self): # the batch is split until the bad row is found, the others are written
+        bulk_create = DogBreed.objects.bulk_create
+        def reject_bad(objs, *args, **kwargs):
+            if any(dog_breed.breed.name == 'Bad' for dog_breed in objs):
+                raise IntegrityError('CHECK constraint failed')
+            return bulk_create(objs, *args, **kwargs)
+        for name in ['Akita', 'Pug', 'Bad', 'Husky', 'Beagle']:
+            self.sink.add(name=name, description='Loyal', image_url='No image available')
+        with mock.patch.object(DogBreed.objects, 'bulk_create', side_effect=reject_bad):
+            self.assertEqual(self.sink.flush(), 4)
+        self.assertEqual(self.sink.pending(), 0)
+        self.assertEqual(sorted(DogBreed.objects.values_list('breed__name', flat=True)), ['Akita', 'Beagle', 'Husky', 'Pug'])
+
+    @override_settings(HISTORY_SINK_MAX_RETRIES=3)
+    def test_retries_are_bounded(self): # rows go to the spool instead of being retried forever
+        self.sink.add(name='Pug', description='Playful', image_url='No image available')
+        with mock.patch.object(DogBreed.objects, 'bulk_create', side_effect=DatabaseError('database is locked')):
+            for _ in range(2):
+                self.sink.flush()
+                self.assertEqual(self.sink.pending(), 1)
+            self.sink.flush()
+        self.assertEqual(self.sink.pending(), 0)
+        self.assertEqual(self.sink.replay_spool(), 1)
+
+    @override_settings(HISTORY_SINK_MAX_QUEUE=2)
+    def test_queue_is_capped(self): # rows beyond the cap are spooled, not kept in memory
+        sink = HistorySink()
+        with mock.patch.object(sink, '_ensure_started'): # no background flush
+            sink.add_many([{'name': name, 'description': 'Loyal', 'image_url': 'No image available'} for name in ['Akita', 'Pug', 'Husky']])
+        self.assertEqual(sink.pending(), 2)
+        self.assertEqual(sink.replay_spool(), 1)
+
+    def test_searches_share_breed_rows(self): # the text is stored once per breed, not once per search
+        for name in ['Akita', 'Pug', 'Akita', 'Akita']:
+            self.sink.add(name=name, description='Loyal', image_url='No image available')
+        self.sink.flush()
+        self.sink.add(name='Akita', description='Calm', image_url='No image available') # new temperament, new breed row
+        self.sink.flush()
+        self.assertEqual(DogBreed.objects.count(), 5)
+        self.assertEqual(sorted(Breed.objects.values_list('name', 'description')), [('Akita', 'Calm'), ('Akita', 'Loyal'), ('Pug', 'Loyal')])
+
+class SearchHistoryPaginationTest(APITestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin_user).access_token}')
+        searched_at = timezone.now()
+        DogBreed.objects.bulk_create([ # same time for some rows, the id breaks the tie
+            DogBreed.from_details(f'Breed {i}', 'Loyal' if i % 2 else 'Calm', 'No image available',
+                     time=searched_at - timedelta(minutes=i // 2))
+            for i in range(7)
+        ])
+
+    def test_pages_follow_cursor(self): # every row exactly once, newest first
+        url, names, cursor = reverse('user_search_history'), [], None
+        while True:
+            response = self.client.get(url, {'limit': 3, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += [row['name'] for row in response.data['data']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        expected = [row.breed.name for row in DogBreed.objects.select_related('breed').order_by('-time', '-id')]
+        self.assertEqual(names, expected)
+
+    def test_page_joins_the_breeds(self): # same number of queries whatever the page size
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('user_search_history'), {'limit': 2})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('user_search_history'), {'limit': 7})
+        self.assertEqual(len(response.data['data']), 7)
+        self.assertEqual(len(large), len(small))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('user_search_history'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ndjson_export_streams_filtered_rows(self):
+        response = self.client.get(reverse('user_search_history'), {'export': 'ndjson', 'keyword': 'loyal'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(set(rows[0]), {'name', 'description', 'image_url', 'time'})
+
+    def test_json_export_keeps_response_shape(self):
+        response = self.client.get(reverse('user_search_history'), {'export': 'json'})
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body['status'], 'success')
+        self.assertEqual(len(body['data']), 7)
+
+class SearchHistoryKeywordTest(APITestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin_user).access_token}')
+        DogBreed.objects.bulk_create([ # bulk_create sends no signals, the triggers still index the new breeds
+            DogBreed.from_details('Akita', 'Docile, Alert, Friendly'),
+            DogBreed.from_details('Alaskan Husky', 'Friendly, Energetic, Loyal'),
+            DogBreed.from_details('Border Collie', 'Energetic, Alert'),
+        ])
+
+    def keyword(self, keyword):
+        response = self.client.get(reverse('user_search_history'), {'keyword': keyword})
+        return sorted(row['name'] for row in response.data['data'])
+
+    def test_prefix_and_multi_keyword(self):
+        self.assertEqual(self.keyword('friend'), ['Akita', 'Alaskan Husky'])
+        self.assertEqual(self.keyword('energetic, alert'), ['Border Collie'])
+        self.assertEqual(self.keyword('husky'), ['Alaskan Husky']) # names are indexed too
+        self.assertEqual(self.keyword('"quoted" OR'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        Breed.objects.filter(name='Akita').update(description='Calm')
+        DogBreed.objects.filter(breed__name='Border Collie').delete()
+        self.assertEqual(self.keyword('alert'), [])
+        self.assertEqual(self.keyword('calm'), ['Akita'])
+
+    def test_icontains_backend_agrees(self): # the fallback used on other databases
+        for keyword in ['friend', 'energetic alert', 'husky']:
+            fts = SQLiteFTSBackend().filter(DogBreed.objects.all(), keyword)
+            like = IContainsBackend().filter(DogBreed.objects.all(), keyword)
+            self.assertEqual(set(fts), set(like), keyword)
+
+class DeleteSearchHistoryTest(APITestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin_user).access_token}')
+        now = timezone.now()
+        DogBreed.objects.bulk_create([
+            DogBreed.from_details('Akita', 'Loyal', time=now - timedelta(days=40)),
+            DogBreed.from_details('Pug', 'Playful', time=now - timedelta(days=35)),
+            DogBreed.from_details('Border Collie', 'Alert', time=now - timedelta(days=31)),
+            DogBreed.from_details('Alaskan Husky', 'Loyal', time=now),
+        ])
+
+    def test_truncate_keeps_the_search_index_working(self): # one DELETE, the FTS trigger comes back afterwards
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('delete_all_searches'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(DogBreed.objects.count(), 0)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('SELECT "dogs_dogbreed"')]), 0) # no pks loaded
+        DogBreed.from_details('Akita', 'Loyal').save()
+        DogBreed.objects.get(breed__name='Akita').delete()
+        self.assertEqual(list(SQLiteFTSBackend().filter(DogBreed.objects.all(), 'loyal')), [])
+
+    @override_settings(HISTORY_PURGE_BATCH_SIZE=1, HISTORY_PURGE_PAUSE=0)
+    def test_older_than_purges_in_batches(self): # runs inline here since the test is inside a transaction
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('delete_all_searches') + '?older_than=' + (timezone.now() - timedelta(days=30)).date().isoformat())
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['data']['status'], 'done')
+        self.assertEqual(response.data['data']['deleted'], 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE FROM "dogs_dogbreed"')]), 3) # one pk range per batch
+        self.assertEqual(list(DogBreed.objects.values_list('breed__name', flat=True)), ['Alaskan Husky'])
+        self.assertEqual(list(SQLiteFTSBackend().filter(DogBreed.objects.all(), 'loyal')), list(DogBreed.objects.all()))
+
+        progress = self.client.get(response.data['progress_url'])
+        self.assertEqual(progress.data['data']['total'], 3)
+        self.assertEqual(self.client.get(reverse('search_history_purge', args=['unknown'])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_signals_are_honored(self): # with a receiver attached the rows go through the collector
+        deleted = []
+        receiver = lambda instance, **kwargs: deleted.append(instance.breed.name)
+        post_delete.connect(receiver, sender=DogBreed)
+        try:
+            response = self.client.delete(reverse('delete_all_searches'))
+        finally:
+            post_delete.disconnect(receiver, sender=DogBreed)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(sorted(deleted), ['Akita', 'Alaskan Husky', 'Border Collie', 'Pug'])
+
+    def test_invalid_older_than(self):
+        response = self.client.delete(reverse('delete_all_searches') + '?older_than=last-week')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+@override_settings(HISTORY_PURGE_PAUSE=0, HISTORY_RETENTION_DAYS=30)
+class SearchHistoryArchiveTest(APITestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin_user).access_token}')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.archive_dir = override_settings(HISTORY_ARCHIVE_DIR=self.tmp_dir.name)
+        self.archive_dir.enable()
+        self.old_day = bucket_start(timezone.now() - timedelta(days=40), 'day')
+        searched_at = self.old_day + timedelta(hours=12) # midday, away from the day boundaries
+        history_sink.add_many([
+            {'name': 'Akita', 'description': 'Loyal', 'image_url': 'No image available'},
+            {'name': 'Pug', 'description': 'Playful', 'image_url': 'No image available'},
+        ])
+        DogBreed.objects.update(time=searched_at)
+        history_sink.add(name='Akita', description='Loyal', image_url='No image available')
+
+    def tearDown(self):
+        self.archive_dir.disable()
+        self.tmp_dir.cleanup()
+
+    def test_expired_days_are_archived_then_deleted(self): # gzipped NDJSON per day, only recent rows stay
+        call_command('archive_search_history', stdout=io.StringIO())
+        self.assertEqual(DogBreed.objects.count(), 1)
+        self.assertEqual(archived_days(), [self.old_day])
+        with gzip.open(os.path.join(self.tmp_dir.name, f"history-{self.old_day:%Y-%m-%d}.ndjson.gz"), 'rt') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual(sorted(row['name'] for row in rows), ['Akita', 'Pug'])
+
+    def test_rerun_adds_late_rows_once(self): # replayed rows of an archived day are merged, nothing twice
+        archive_history()
+        DogBreed.from_details('Beagle', 'Curious', time=self.old_day + timedelta(hours=20)).save()
+        self.assertEqual(archive_history(), {self.old_day: 1})
+        self.assertEqual([row['name'] for row in read_archive(self.old_day)][0], 'Beagle') # still newest first
+        self.assertEqual(len(list(read_archive(self.old_day))), 3)
+
+    def test_history_streams_archived_ranges(self): # database rows first, then the archives, same filters
+        archive_history()
+        response = self.client.get(reverse('user_search_history'), {'archived': 'true', 'keyword': 'loyal'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Akita', 'Akita'])
+        self.assertEqual(set(rows[1]), {'name', 'description', 'image_url', 'time'})
+
+        since = (self.old_day + timedelta(days=1)).strftime('%Y-%m-%d')
+        response = self.client.get(reverse('user_search_history'), {'archived': 'true', 'since': since})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+        self.assertEqual(self.client.get(reverse('user_search_history'), {'until': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+class SearchHistoryStatsTest(APITestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin_user).access_token}')
+        self.sink = HistorySink()
+
+    def stats(self, **params):
+        return self.client.get(reverse('search_history_stats'), params)
+
+    def test_saved_searches_are_counted(self): # top-N and time series straight from the rollups
+        for name in ['Akita', 'Pug', 'Akita']:
+            self.sink.add(name=name, description='Loyal', image_url='No image available')
+        response = self.stats()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['top'], [{'name': 'Akita', 'count': 2}, {'name': 'Pug', 'count': 1}])
+        series = response.data['data']['series']
+        self.assertEqual(len(series), 8) # the 7 days before today and today, empty ones included
+        self.assertEqual([point['count'] for point in series], [0] * 7 + [3])
+        hourly = self.stats(period='hour', breed='pug', limit=1).data['data']
+        self.assertEqual(hourly['top'], [{'name': 'Akita', 'count': 2}])
+        self.assertEqual(sum(point['count'] for point in hourly['series']), 1)
+
+    def test_backfill_matches_the_history(self): # rows written around the sink are picked up by the command
+        now = timezone.now()
+        DogBreed.objects.bulk_create([
+            DogBreed.from_details(['Akita', 'Pug', 'Beagle'][i % 3], time=now - timedelta(hours=7 * i)) for i in range(40)
+        ])
+        self.sink.add(name='Pug', description='Playful', image_url='No image available')
+        call_command('backfill_search_rollups', batch_size=7, stdout=io.StringIO())
+        expected = count_searches(DogBreed.objects.values_list('breed__name', 'time'))
+        self.assertEqual({(r.period, r.bucket, r.name): r.count for r in BreedSearchRollup.objects.all()}, dict(expected))
+
+    @override_settings(HISTORY_PURGE_PAUSE=0)
+    def test_purge_keeps_the_rollups(self): # deleting old searches doesn't change the stats, like archiving them
+        day = bucket_start(timezone.now(), 'day') - timedelta(days=2)
+        for hours in [1, 5, 13, 30]:
+            DogBreed.from_details('Akita', time=day + timedelta(hours=hours)).save()
+        call_command('backfill_search_rollups', stdout=io.StringIO())
+        before = {(r.period, r.bucket, r.name): r.count for r in BreedSearchRollup.objects.all()}
+        response = self.client.delete(reverse('delete_all_searches') + '?older_than=' + (day + timedelta(hours=4)).strftime('%Y-%m-%dT%H:%M'))
+        self.assertEqual(response.data['data']['status'], 'done')
+        self.assertEqual(DogBreed.objects.count(), 3)
+        self.assertEqual({(r.period, r.bucket, r.name): r.count for r in BreedSearchRollup.objects.all()}, before)
+        self.client.delete(reverse('delete_all_searches'))
+        self.assertFalse(BreedSearchRollup.objects.exists()) # truncate takes the rollups along
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.stats(period='week').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stats(since='2026-02-01', until='2026-01-01').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stats(period='hour', since='2020-01-01').status_code, status.HTTP_400_BAD_REQUEST) # too many buckets
+        self.assertEqual(self.stats(limit=0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+        self.assertEqual(self.stats().status_code, status.HTTP_401_UNAUTHORIZED)
+
+class MetricsTest(OfflineCatalogMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        mirror.publish(BreedCatalog.from_api(FakeUpstream().breeds))
+
+    def test_server_timing_and_histograms(self): # phases of the request in the header, totals on /metrics
+        self.client.get(reverse('get_dog_breeds'), {'filter': 'loyal'})
+        response = self.client.get(reverse('get_dog_breeds'), {'filter': 'loyal'})
+        self.assertRegex(response['Server-Timing'], r'^cache;dur=[\d.]+, .*total;dur=[\d.]+$')
+
+        with override_settings(METRICS_TOKEN='scrape-me'):
+            metrics = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me').content.decode()
+        self.assertIn('dogs_request_duration_seconds_count{method="GET",route="get_dog_breeds",status="200"} 2', metrics)
+        self.assertIn('dogs_cache_hit_ratio{cache="breeds_response"} 0.5000', metrics)
+        self.assertIn('dogs_phase_duration_quantile_seconds{phase="render",quantile="0.95"}', metrics)
+
+    def test_upstream_calls_are_timed_from_the_fan_out_threads(self): # the gif lookup runs on the pool, it still counts for the request
+        with FakeUpstream() as upstream, override_settings(**upstream.settings()):
+            response = self.client.post(reverse('fetch_breed_details'), {'breed': 'pug'}, format='json')
+        self.assertIn('upstream_giphy;dur=', response['Server-Timing'])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('dogs_upstream_requests_total{outcome="ok",upstream="giphy"} 1', render_prometheus())
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me').status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_off_without_token(self): # fails closed, nothing is public by default
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_histogram_quantiles(self): # interpolated inside the bucket, like histogram_quantile
+        histogram = Histogram(buckets=(0.1, 0.2, 0.4))
+        for value in [0.05] * 50 + [0.15] * 45 + [0.3] * 5:
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.1)
+        self.assertAlmostEqual(histogram.quantile(0.95), 0.2)
+        self.assertAlmostEqual(histogram.quantile(0.99), 0.36)
+
+    def test_hook_overhead_within_budget(self): # one timed phase is a small part of the per request budget
+        started = time.perf_counter()
+        for _ in range(10000):
+            with timed('cache'):
+                pass
+        per_phase_us = (time.perf_counter() - started) / 10000 * 1e6
+        self.assertLess(per_phase_us * 5, settings.METRICS_OVERHEAD_BUDGET_US) # a request records about five phases
@@ -0,0 +1,355 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import weakref
+from collections import Counter
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache_utils import acache_call, acquire_lock, incr_is_atomic, release_lock
+from .metrics import count, timed
+
+
+RETRY_STATUSES = {502, 503, 504}  # 429 is not retried, hammering a rate limit only makes it worse
+
+
+class CircuitOpen(requests.ConnectionError):
+    """Raised without touching the network while an upstream's breaker is open."""
+
+
+class RateLimited(requests.RequestException):
+    """
+    The upstream answered 429, or our own budget for it is spent. `retry_after` is in
+    seconds, the views pass it on to the client with a 503 instead of pretending the
+    breed doesn't exist.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamBudget:
+    """
+    Token bucket for one upstream, shared by every worker through CACHES: UPSTREAM_BUDGETS
+    gives the refill rate (requests per second) and the bucket size. Background work like
+    the catalog refresh leaves UPSTREAM_BUDGET_RESERVE of the bucket to user requests.
+
+    The state is a single counter of tokens spent, compared with the tokens refilled since
+    the epoch, so taking a token is one cache.incr (atomic on locmem, redis and memcached).
+    On the file and database caches incr is a read then a write, the counter is only
+    updated under acquire_lock there. After a 429 the whole deployment stops calling the
+    upstream for its Retry-After.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.key = f"upstream_budget:{name}"
+        self.cooldown_key = f"upstream_cooldown:{name}"
+
+    def take(self, background=False):
+        """Spends one request, or raises RateLimited."""
+        until = cache.get(self.cooldown_key)
+        if until is not None and until > time.time():
+            raise RateLimited(f"{self.name} is rate limiting us", math.ceil(until - time.time()))
+        rate, burst = settings.UPSTREAM_BUDGETS.get(self.name, (0, 0))
+        if not rate:
+            return
+        if incr_is_atomic():
+            return self._spend(rate, burst, background)
+        token = self._lock()
+        try:
+            return self._spend(rate, burst, background)
+        finally:
+            release_lock(self.key, token)
+
+    def _lock(self):
+        deadline = time.monotonic() + settings.UPSTREAM_BUDGET_LOCK_WAIT
+        while True:
+            token = acquire_lock(self.key, settings.UPSTREAM_BUDGET_LOCK_WAIT)
+            if token is not None:
+                return token
+            if time.monotonic() > deadline:
+                raise RateLimited(f"{self.name} budget is busy", 1)
+            time.sleep(0.002)
+
+    def _spend(self, rate, burst, background):
+        refilled = int(time.time() * rate)
+        full = refilled - burst  # spent never lags further behind, idle time doesn't add up past a full bucket
+        try:
+            spent = cache.incr(self.key)
+        except ValueError:  # first request, or evicted
+            cache.add(self.key, full, timeout=None)
+            spent = cache.incr(self.key)
+        if spent <= full:
+            # Idle for a while, catch up to a full bucket. Set, not incr by a delta: the delta comes
+            # from our read, every taker that read a stale count would add its own. Two sets race
+            # harmlessly, at worst a token is counted once for two requests.
+            cache.set(self.key, full + 1, timeout=None)
+            spent = full + 1
+        allowed = refilled - (int(burst * settings.UPSTREAM_BUDGET_RESERVE) if background else 0)
+        if spent > allowed:
+            cache.decr(self.key)  # not spent after all
+            raise RateLimited(f"{self.name} budget spent", max(1, math.ceil((spent - allowed) / rate)))
+
+    async def atake(self, background=False):
+        return await acache_call(self.take, background)
+
+    def cool_down(self, response):
+        try:
+            retry_after = int(response.headers.get('Retry-After', ''))
+        except ValueError:
+            retry_after = settings.UPSTREAM_RATE_LIMIT_COOLDOWN
+        retry_after = min(max(retry_after, 1), settings.UPSTREAM_RATE_LIMIT_MAX_COOLDOWN)
+        cache.set(self.cooldown_key, time.time() + retry_after, timeout=retry_after)
+        return RateLimited(f"{self.name} answered 429", retry_after)
+
+
+class UpstreamClient:
+    """
+    Keep-alive HTTP client for one upstream (thedogapi or Giphy).
+
+    Connections are pooled per host and reused across requests of the worker. GETs get a
+    bounded timeout, are retried with jittered exponential backoff on connection errors
+    and 502/503/504, and a circuit breaker stops calling an upstream for
+    UPSTREAM_BREAKER_RESET seconds after UPSTREAM_BREAKER_THRESHOLD failures in a row.
+    Every attempt spends from the upstream's shared budget (UpstreamBudget), pass
+    background=True for calls no user is waiting on.
+    """
+
+    def __init__(self, name, timeout_setting):
+        self.name = name
+        self.timeout_setting = timeout_setting
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.UPSTREAM_POOL_SIZE)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.budget = UpstreamBudget(name)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def get(self, url, params=None, timeout=None, background=False):
+        try:
+            self._before_request()
+        except CircuitOpen:
+            count('dogs_upstream_requests_total', upstream=self.name, outcome='breaker_open')
+            raise
+        timeout = timeout if timeout is not None else getattr(settings, self.timeout_setting)
+        retries = settings.UPSTREAM_RETRIES
+
+        for attempt in range(retries + 1):
+            try:
+                self.budget.take(background)
+            except RateLimited:
+                self._rate_limited('budget_spent')
+                raise
+            self._count('requests')
+            try:
+                with timed(f'upstream_{self.name}'):
+                    response = self.session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                count('dogs_upstream_requests_total', upstream=self.name, outcome='connection_error')
+                error, response = e, None
+            else:
+                if response.status_code == 429:
+                    self._rate_limited('rate_limited')
+                    raise self.budget.cool_down(response)
+                if response.status_code not in RETRY_STATUSES:
+                    count('dogs_upstream_requests_total', upstream=self.name, outcome='ok' if response.status_code < 400 else 'error')
+                    self._record(success=True)
+                    return response
+                count('dogs_upstream_requests_total', upstream=self.name, outcome='error')
+                error = None
+            if attempt < retries:
+                self._count('retries')
+                time.sleep(settings.UPSTREAM_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+        self._record(success=False)
+        if response is not None:
+            return response  # the caller decides what a 5xx means for its endpoint
+        raise error
+
+    def max_duration(self, timeout=None):
+        """
+        Longest a get() can take: every attempt running into its timeout, plus the backoff
+        between them at its largest jitter.
+        """
+        timeout = timeout if timeout is not None else getattr(settings, self.timeout_setting)
+        retries = settings.UPSTREAM_RETRIES
+        return timeout * (retries + 1) + settings.UPSTREAM_BACKOFF * 1.5 * (2 ** retries - 1)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        # urllib3 keeps the per host counts, new_connections vs requests sent tells us the reuse
+        new_connections = sent = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                new_connections += pool.num_connections
+                sent += pool.num_requests
+        stats.update({
+            'new_connections': new_connections,
+            'pool_hits': max(sent - new_connections, 0),
+            'breaker_open': self._opened_at is not None,
+        })
+        return stats
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _rate_limited(self, outcome):
+        self._count(outcome)
+        count('dogs_upstream_requests_total', upstream=self.name, outcome=outcome)
+
+    def _before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < settings.UPSTREAM_BREAKER_RESET:
+                self.counters['breaker_rejections'] += 1
+                raise CircuitOpen(f"{self.name} circuit breaker is open")
+            # Half open: let this request through, one more failure opens it again
+            self._opened_at = None
+            self._failures = settings.UPSTREAM_BREAKER_THRESHOLD - 1
+
+    def _record(self, success):
+        with self._lock:
+            if success:
+                self._failures = 0
+                return
+            self.counters['failures'] += 1
+            self._failures += 1
+            if self._failures >= settings.UPSTREAM_BREAKER_THRESHOLD and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                self.counters['breaker_trips'] += 1
+
+
+class AsyncUpstreamClient:
+    """
+    httpx twin of UpstreamClient for the async views, with the same timeout, retries and
+    metrics. Breaker and counters are the ones of the sync client of the same upstream, so
+    sync and async views of a worker trip and respect one breaker.
+
+    httpx connections belong to the event loop that opened them, so the pools are kept per
+    loop (uvicorn runs one per worker), up to UPSTREAM_ASYNC_POOL_SIZE connections per host.
+    Requests over that wait on a semaphore rather than in httpx's own queue, which is
+    rescanned on every connection event and cost more CPU than the requests themselves
+    with a few hundred of them waiting.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.name = client.name
+        self._pools = weakref.WeakKeyDictionary()  # event loop -> (httpx.AsyncClient, asyncio.Semaphore)
+
+    def pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            size = settings.UPSTREAM_ASYNC_POOL_SIZE
+            pool = self._pools[loop] = (
+                httpx.AsyncClient(limits=httpx.Limits(max_connections=size, max_keepalive_connections=size)),
+                asyncio.Semaphore(size),
+            )
+        return pool
+
+    async def get(self, url, params=None, timeout=None, background=False):
+        try:
+            self.client._before_request()
+        except CircuitOpen:
+            count('dogs_upstream_requests_total', upstream=self.name, outcome='breaker_open')
+            raise
+        timeout = timeout if timeout is not None else getattr(settings, self.client.timeout_setting)
+        retries = settings.UPSTREAM_RETRIES
+        pool, slots = self.pool()
+
+        for attempt in range(retries + 1):
+            try:
+                await self.client.budget.atake(background)
+            except RateLimited:
+                self.client._rate_limited('budget_spent')
+                raise
+            self.client._count('requests')
+            try:
+                with timed(f'upstream_{self.name}'):
+                    async with slots:
+                        response = await pool.get(url, params=params, timeout=timeout)
+            except httpx.TransportError as e:  # connection errors and timeouts, the pool one included
+                count('dogs_upstream_requests_total', upstream=self.name, outcome='connection_error')
+                error, response = e, None
+            else:
+                if response.status_code == 429:
+                    self.client._rate_limited('rate_limited')
+                    raise self.client.budget.cool_down(response)
+                if response.status_code not in RETRY_STATUSES:
+                    count('dogs_upstream_requests_total', upstream=self.name, outcome='ok' if response.status_code < 400 else 'error')
+                    self.client._record(success=True)
+                    return response
+                count('dogs_upstream_requests_total', upstream=self.name, outcome='error')
+                error = None
+            if attempt < retries:
+                self.client._count('retries')
+                await asyncio.sleep(settings.UPSTREAM_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+        self.client._record(success=False)
+        if response is not None:
+            return response
+        raise error
+
+
+# What the callers of AsyncUpstreamClient.get catch, like requests.RequestException for the sync client
+AsyncUpstreamError = (httpx.HTTPError, CircuitOpen, RateLimited)
+
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+UPSTREAMS = {
+    'thedogapi': 'DOGS_API_TIMEOUT',
+    'giphy': 'GIPHY_API_TIMEOUT',
+}
+
+
+def get_client(name):
+    # Created on first use, so every gunicorn worker builds its own pools after the fork
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = UpstreamClient(name, UPSTREAMS[name])
+    return client
+
+
+def get_async_client(name):
+    client = _async_clients.get(name)
+    if client is None:
+        sync_client = get_client(name)
+        with _clients_lock:
+            client = _async_clients.get(name)
+            if client is None:
+                client = _async_clients[name] = AsyncUpstreamClient(sync_client)
+    return client
+
+
+def reset_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
+        _async_clients.clear()  # their pools go away with the event loops that own them
+
+
+def upstream_stats():
+    return {name: client.stats() for name, client in list(_clients.items())}
@@ -1,19 +1,37 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 from django.views.generic import TemplateView
 
 urlpatterns = [
     # Endpoint to get dogs breeds 
     path('breeds/', views.get_dog_breeds, name='get_dog_breeds'),
 
+    # Same as above as an async view (JSON only), meant to be served with SERVER_MODE=asgi
+    path('breeds/async/', async_views.get_dog_breeds_async, name='get_dog_breeds_async'),
+
     # Endpoint to get details and gif on a specific dog 
     path('breeds/details/', views.fetch_breed_details, name='fetch_breed_details'), 
 
+    # Same as above as an async view, meant to be served with SERVER_MODE=asgi
+    path('breeds/details/async/', async_views.fetch_breed_details_async, name='fetch_breed_details_async'),
+
+    # Details and gifs of several breeds in one request
+    path('breeds/details/batch/', views.fetch_breed_details_batch, name='fetch_breed_details_batch'),
+
     # Endpoint to see search history, only accessible to admin 
     path('search-history/', views.user_search_history, name='user_search_history'), 
 
+    # Most searched breeds and searches over time, from the rollups, only accessible to admin
+    path('search-history/stats/', views.search_history_stats, name='search_history_stats'),
+
     # Endpoint to delete search history, only accessible to admin
     path('search-history/delete/', views.delete_all_searches, name='delete_all_searches'),
 
+    # Progress of a background purge started by the endpoint above, only accessible to admin
+    path('search-history/delete/<str:job_id>/', views.search_history_purge, name='search_history_purge'),
+
+    # Counters of the outbound HTTP clients (connection reuse, retries, breaker), only accessible to admin
+    path('upstream-stats/', views.upstream_statistics, name='upstream_statistics'),
+
     path("webpage", TemplateView.as_view(template_name="index.html"), name="home"), 
 ]
\ No newline at end of file
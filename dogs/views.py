@@ -1,24 +1,69 @@
-import os
-from dotenv import load_dotenv
-import requests
+import hmac
+from datetime import datetime, time, timedelta
+from itertools import chain
 
-from django.core.cache import cache
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework import status
 from rest_framework.permissions import IsAdminUser
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+from .archive import archived_rows
+from .catalog import CatalogUnavailable, get_catalog
+from .db import use_replica
+from .details import resolve_breed_details, resolve_many, suggest_breeds, unique_breeds
+from .export import history_rows, stream_json, stream_ndjson
+from .history import history_sink
+from .metrics import cache_result, render_prometheus
 from .models import DogBreed
+from .pagination import InvalidCursor, keyset_page
+from .purge import PurgeJob, can_truncate, get_job, truncate_history
+from .rollups import PERIODS, bucket_count, time_series, top_breeds
+from .response_cache import PrerenderedResponse, breed_responses, etag_matches, make_etag, normalize_filters
+from .search import get_search_backend
 from .serializers import DogBreedSerializer, DogBreedHistorySerializer
+from .upstream import RateLimited, upstream_stats
 
 
-load_dotenv() # get sensible data from .env
-GIPHY_API_KEY = os.getenv('GIPHY_API_KEY')
-DOGS_API_URL = "https://api.thedogapi.com/v1/breeds"
+def rate_limited_response(error, response_class=Response):
+    """
+    503 for a RateLimited (or a CatalogUnavailable with a retry_after), saying which upstream
+    or budget refused. The async views pass JsonResponse, DRF's Response needs @api_view.
+    """
+    # Not a 404, the breed may well exist, we just can't ask the upstream right now
+    return response_class({
+        "error": "Upstream rate limited",
+        "details": f"{error}, please try again in {error.retry_after} seconds."
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(error.retry_after)})
+
+
+EXPORT_FORMATS = {
+    'json': (stream_json, 'application/json'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
+
+
+def parse_cutoff(value):
+    """'older_than' as an aware datetime, a bare date means midnight. None when it doesn't parse."""
+    try:
+        cutoff = parse_datetime(value)
+        if cutoff is None:
+            day = parse_date(value)
+            cutoff = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        return None
+    if cutoff is not None and timezone.is_naive(cutoff):
+        cutoff = timezone.make_aware(cutoff)
+    return cutoff
+
 
 
 
@@ -41,9 +86,10 @@ breed_param = openapi.Parameter(
         required=['breed']
     ),
     responses={
-        200: "Success - Returns details and gif of the dog breed",
-        400: "Bad Request - Breed not specified",
-        404: "Not Found - Breed not found in external API"
+        200: "Success - Returns details and gif of the dog breed, with 'matched_from' and 'score' when the breed was resolved from a misspelling",
+        400: "Bad Request - Breed not specified or not a string",
+        404: "Not Found - Breed not found, with 'did you mean' suggestions when the catalog is loaded",
+        503: "Service Unavailable - thedogapi is rate limiting us, retry after the Retry-After header"
     }
 )
 # I chose @api_view (function-based) instead of APIVIEW (class-based) to keep it simple as this is a small project
@@ -51,39 +97,37 @@ breed_param = openapi.Parameter(
 def fetch_breed_details(request):
     breed_name = request.data.get('breed', '')
 
-    if breed_name:
-        dog_api_url = f"https://api.thedogapi.com/v1/breeds/search?q={breed_name}" # get breed info from thedogapi API
-        response = requests.get(dog_api_url)
-
-        if response.status_code == 200 and response.json():
-            dog_data = response.json()[0]
-            dog_breed_name = dog_data.get('name', 'No name available')
-            dog_temperament = dog_data.get('temperament', 'No temperament information available')
-
-            giphy_url = f"https://api.giphy.com/v1/gifs/search?api_key={GIPHY_API_KEY}&q={breed_name}&limit=1" # get gif from giphy API
-            giphy_response = requests.get(giphy_url)
-
-            dog_image_url = "No image available"
-            if giphy_response.status_code == 200 and giphy_response.json()['data']:
-                dog_image_url = giphy_response.json()['data'][0]['images']['original']['url']
+    if not isinstance(breed_name, str):
+        return Response({
+            "error": "Invalid breed",
+            "details": "The breed name must be a string."
+        }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Save user search to database in case admin wants that info
-            dog_breed = DogBreed.objects.create(
-                name=dog_breed_name,
-                description=dog_temperament,
-                image_url=dog_image_url,
-            )
+    if breed_name:
+        try:
+            details = resolve_breed_details(breed_name) # breed from the local catalog, gif from Giphy at the same time
+        except RateLimited as e:
+            return rate_limited_response(e)
+
+        if details:
+            match = details.pop('match', None)
+            if match is None:
+                # Save user search to database in case admin wants that info
+                dog_breed = history_sink.add(**details) # queued, written in batches by a background thread
+            else:
+                dog_breed = DogBreed.from_details(**details) # a guess from a misspelling, not what the user searched for
 
             # Serialize the successful response
             serializer = DogBreedSerializer(dog_breed)
             return Response({
                 "status": "success",
-                "data": serializer.data
+                "data": {**serializer.data, **(match or {})}
             }, status=status.HTTP_200_OK)
 
         return Response({
             "error": "Breed not found",
-            "details": f"Could not find breed '{breed_name}' in external API"
+            "details": f"Could not find breed '{breed_name}' in external API",
+            "suggestions": suggest_breeds(breed_name), # "did you mean", from the local catalog
         }, status=status.HTTP_404_NOT_FOUND)
 
     return Response({
@@ -94,6 +138,62 @@ def fetch_breed_details(request):
 
 
 
+@swagger_auto_schema(
+    method='post',
+    operation_description="Fetch details and a gif for several dog breeds in one request. Repeated names are resolved once, every breed gets its own status.",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'breeds': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='Dog breed names')
+        },
+        required=['breeds']
+    ),
+    responses={
+        200: "Success - One result per distinct breed, with status 'success' (plus 'matched_from' and 'score' for a misspelling) or 'error'",
+        400: "Bad Request - No breeds or too many breeds",
+    }
+)
+@api_view(['POST'])
+def fetch_breed_details_batch(request):
+    breeds = request.data.get('breeds')
+    if not isinstance(breeds, list) or not all(isinstance(breed, str) for breed in breeds) or not unique_breeds(breeds):
+        return Response({
+            "error": "No breeds specified",
+            "details": "Please provide a list of breed names as 'breeds' in the request body."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    breed_names = unique_breeds(breeds)
+    if len(breed_names) > settings.BREEDS_BATCH_MAX:
+        return Response({
+            "error": "Too many breeds",
+            "details": f"At most {settings.BREEDS_BATCH_MAX} breeds per request."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    results = resolve_many(breed_names) # a few breeds at a time, each one overlapping its own Giphy search
+
+    matches = {breed_name: details.pop('match', None) for breed_name, details, _ in results if details}
+    # One bulk_create for the whole batch instead of one INSERT per breed, misspellings resolved by a guess aren't recorded
+    dog_breeds = iter(history_sink.add_many([details for breed_name, details, _ in results if details and not matches[breed_name]]))
+
+    items = []
+    for breed_name, details, failed in results:
+        if details:
+            match = matches[breed_name]
+            dog_breed = DogBreed.from_details(**details) if match else next(dog_breeds)
+            items.append({"breed": breed_name, "status": "success", "data": {**DogBreedSerializer(dog_breed).data, **(match or {})}})
+        elif failed:
+            items.append({"breed": breed_name, "status": "error", "error": "Could not fetch breed details, try again later"})
+        else:
+            items.append({"breed": breed_name, "status": "error", "error": "Breed not found", "suggestions": suggest_breeds(breed_name)})
+
+    return Response({
+        "status": "success",
+        "data": items
+    }, status=status.HTTP_200_OK)
+
+
+
+
 filters_param = openapi.Parameter( # adds the option on swagger to include a filter or filters
     'filter',
     openapi.IN_QUERY,
@@ -106,54 +206,66 @@ filters_param = openapi.Parameter( # adds the option on swagger to include a fil
     method='get',
     operation_description="Get a list of dog breeds from thedogapi. Optionally filter by terms.",
     manual_parameters=[filters_param],
-    responses={200: "Success - List of breeds", 500: "Internal Server Error"}
+    responses={200: "Success - List of breeds", 500: "Internal Server Error", 503: "Service Unavailable - thedogapi is rate limiting us"}
 )
 @api_view(['GET'])
 def get_dog_breeds(request):
     search_terms = request.GET.getlist('filter')
 
-    # Check if there is already a cache for breeds to optimize API calls
-    cached_breeds = cache.get('dog_breeds')
-    
-    if cached_breeds is None: # Do the API call if there is no cache
-        response = requests.get(DOGS_API_URL)
-        if response.status_code == 200:
-            breeds = response.json()
-            breed_names = [
-                {'name': breed.get('name', 'Unknown breed'), 'description': breed.get('temperament', '')}
-                for breed in breeds
-            ]
-            # Cache all the breeds for future request
-            cache.set('dog_breeds', breed_names, timeout=86400)  # Cache for 24 hours, since I assume we don't get new dog breeds every hour
-        else:
-            return Response({"error": "Failed to fetch breeds from DogsAPI"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    else:
-        breed_names = cached_breeds # If there is already a cache we use that data instead
-
-    # Apply filters if there is any
-    if search_terms:
-        search_terms = [term.lower() for term in search_terms] 
-        breed_names = [
-            breed for breed in breed_names
-            if all(term in breed['name'].lower() or term in breed['description'].lower() for term in search_terms)
-        ]
-    
-    # We only want the name of the breeds that have these specific traits
-    breed_names = [breed['name'] for breed in breed_names]
-    
-    return Response({
-        "status": "success",
-        "data": breed_names,
-    }, status=status.HTTP_200_OK)
+    # The breed list comes from the local catalog mirror, which keeps it cached and refreshes it in the background
+    try:
+        catalog = get_catalog()
+    except CatalogUnavailable as e:
+        if e.retry_after:
+            return rate_limited_response(e)
+        return Response({"error": "Failed to fetch breeds from DogsAPI"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # Same catalog version, representation and filters means the same bytes, so clients can revalidate with If-None-Match
+    terms = normalize_filters(search_terms)
+    media_type = request.accepted_media_type
+    headers = {
+        'ETag': make_etag(catalog.version, media_type, terms),
+        'Cache-Control': f"public, max-age={settings.BREEDS_CACHE_MAX_AGE}",
+        'Vary': 'Accept',
+    }
+    if etag_matches(request, headers['ETag']):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    entry = breed_responses.get(catalog.version, (media_type, terms))
+    cache_result('breeds_response', hit=entry is not None)
+    if entry is None:
+        # Apply filters if there is any, we only want the name of the breeds that have these specific traits
+        data = {
+            "status": "success",
+            "data": catalog.index.search(terms),
+        }
+        if request.accepted_renderer.format != 'json':
+            return Response(data, status=status.HTTP_200_OK, headers=headers) # browsable API, rendered every time
+        entry = (data, request.accepted_renderer.render(data, media_type, {'request': request}))
+        breed_responses.set(catalog.version, (media_type, terms), entry)
 
+    data, body = entry
+    return PrerenderedResponse(body, data, content_type=media_type, status=status.HTTP_200_OK, headers=headers)
 
 
 
+
+history_params = [
+    openapi.Parameter('keyword', openapi.IN_QUERY, description="Only searches whose name or description has words starting with all these keywords", type=openapi.TYPE_STRING),
+    openapi.Parameter('limit', openapi.IN_QUERY, description="Page size (default 100, max 1000)", type=openapi.TYPE_INTEGER),
+    openapi.Parameter('cursor', openapi.IN_QUERY, description="'next_cursor' of the previous page", type=openapi.TYPE_STRING),
+    openapi.Parameter('export', openapi.IN_QUERY, description="Stream the whole (filtered) history instead of a page", type=openapi.TYPE_STRING, enum=['json', 'ndjson']),
+    openapi.Parameter('since', openapi.IN_QUERY, description="Only searches made at or after this date or ISO 8601 datetime", type=openapi.TYPE_STRING),
+    openapi.Parameter('until', openapi.IN_QUERY, description="Only searches made before this date or ISO 8601 datetime", type=openapi.TYPE_STRING),
+    openapi.Parameter('archived', openapi.IN_QUERY, description="Also stream the searches moved to the archive files by the retention policy, after the ones in the database (export defaults to ndjson)", type=openapi.TYPE_BOOLEAN),
+]
 @swagger_auto_schema(
     method='get',
-    operation_description="Get the search history of dog breeds. Only accessible for admin. Provide your JWT token prefixed with 'Bearer'",
+    operation_description="Get the search history of dog breeds, newest first and one page at a time. Only accessible for admin. Provide your JWT token prefixed with 'Bearer'",
+    manual_parameters=history_params,
     responses={
         200: "Success - List of search history",
+        400: "Bad Request - Invalid limit, cursor, dates or export format",
         401: "Unauthorized - Invalid or missing token",
         403: "Forbidden - Admin access only"
     },
@@ -161,32 +273,131 @@ def get_dog_breeds(request):
 )
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
+@use_replica # read-only connection in the production database profile
 def user_search_history(request):
-    searches = DogBreed.objects.all()
+    searches = DogBreed.objects.select_related('breed') # the name, description and gif are stored once per breed
     
-    # Filter by keyword in the description, if 'keyword' is present in the query parameters
+    # Filter by keywords in the name or description, if 'keyword' is present in the query parameters
     keyword = request.query_params.get('keyword', None)
     if keyword:
-        searches = searches.filter(description__icontains=keyword) 
+        searches = get_search_backend().filter(searches, keyword) # full-text index on SQLite
+
+    # Optional time range, the archived searches are filtered by it too
+    since = parse_cutoff(request.query_params['since']) if 'since' in request.query_params else None
+    until = parse_cutoff(request.query_params['until']) if 'until' in request.query_params else None
+    if ('since' in request.query_params and since is None) or ('until' in request.query_params and until is None):
+        return Response({"error": "Invalid since or until", "details": "Use dates or ISO 8601 datetimes."}, status=status.HTTP_400_BAD_REQUEST)
+    if since:
+        searches = searches.filter(time__gte=since)
+    if until:
+        searches = searches.filter(time__lt=until)
+
+    # Exports stream every row with constant memory instead of building one big list
+    archived = request.query_params.get('archived') == 'true'
+    export = request.query_params.get('export') or ('ndjson' if archived else None)
+    if export:
+        if export not in EXPORT_FORMATS:
+            return Response({"error": "Invalid export format", "details": "Use 'json' or 'ndjson'."}, status=status.HTTP_400_BAD_REQUEST)
+        rows = history_rows(searches.order_by('-time', '-id'))
+        if archived:
+            # Past the retention period, read back from the daily archive files one at a time
+            rows = chain(rows, archived_rows(since, until, keyword))
+        stream, content_type = EXPORT_FORMATS[export]
+        return StreamingHttpResponse(stream(rows), content_type=content_type)
 
-    # Sort by time, newest first
-    searches = searches.order_by('-time')
+    try:
+        limit = min(int(request.query_params.get('limit', settings.HISTORY_PAGE_SIZE)), settings.HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(limit)
+        page, next_cursor = keyset_page(searches, request.query_params.get('cursor'), limit) # sorted by time, newest first
+    except (ValueError, InvalidCursor):
+        return Response({"error": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
 
-    serializer = DogBreedHistorySerializer(searches, many=True)
+    serializer = DogBreedHistorySerializer(page, many=True)
 
     return Response({
         "status": "success",
-        "data": serializer.data
+        "data": serializer.data,
+        "next_cursor": next_cursor,
         }, status=status.HTTP_200_OK)
 
 
 
 
+STATS_RANGES = {'hour': timedelta(hours=24), 'day': timedelta(days=7)}  # default since, before until
+
+stats_params = [
+    openapi.Parameter('period', openapi.IN_QUERY, description="Bucket size of the time series (default day)", type=openapi.TYPE_STRING, enum=list(PERIODS)),
+    openapi.Parameter('since', openapi.IN_QUERY, description="Date or ISO 8601 datetime, default 7 days (or 24 hours) before 'until'", type=openapi.TYPE_STRING),
+    openapi.Parameter('until', openapi.IN_QUERY, description="Date or ISO 8601 datetime, default now", type=openapi.TYPE_STRING),
+    openapi.Parameter('limit', openapi.IN_QUERY, description="Number of breeds in 'top' (default 10, max 1000)", type=openapi.TYPE_INTEGER),
+    openapi.Parameter('breed', openapi.IN_QUERY, description="Time series of this breed only", type=openapi.TYPE_STRING),
+]
+@swagger_auto_schema(
+    method='get',
+    operation_description="Most searched breeds and the number of searches per hour or day, read from rollups kept up to date as searches are saved, so the cost doesn't depend on the size of the history. Only accessible for admin.",
+    manual_parameters=stats_params,
+    responses={
+        200: "Success - Top breeds and time series",
+        400: "Bad Request - Invalid period, dates or limit, or too many buckets",
+        401: "Unauthorized - Invalid or missing token",
+        403: "Forbidden - Admin access only"
+    },
+    security=[{'Bearer': []}]
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@use_replica
+def search_history_stats(request):
+    period = request.query_params.get('period', 'day')
+    if period not in PERIODS:
+        return Response({"error": "Invalid period", "details": "Use 'hour' or 'day'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    until = parse_cutoff(request.query_params['until']) if 'until' in request.query_params else timezone.now()
+    if 'since' in request.query_params:
+        since = parse_cutoff(request.query_params['since'])
+    else:
+        since = until - STATS_RANGES[period] if until else None
+    if since is None or until is None or since >= until:
+        return Response({"error": "Invalid since or until", "details": "Use dates or ISO 8601 datetimes, since before until."}, status=status.HTTP_400_BAD_REQUEST)
+    if bucket_count(period, since, until) > settings.HISTORY_STATS_MAX_BUCKETS:
+        return Response({"error": "Too many buckets", "details": f"At most {settings.HISTORY_STATS_MAX_BUCKETS} {period}s per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = min(int(request.query_params.get('limit', settings.HISTORY_STATS_TOP)), settings.HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return Response({"error": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        "status": "success",
+        "data": {
+            "period": period,
+            "since": since,
+            "until": until,
+            "top": top_breeds(period, since, until, limit),
+            "series": time_series(period, since, until, request.query_params.get('breed')),
+        }
+    }, status=status.HTTP_200_OK)
+
+
+
+
+older_than_param = openapi.Parameter(
+    'older_than',
+    openapi.IN_QUERY,
+    description="Only delete searches made before this date or ISO 8601 datetime, runs as a background job",
+    type=openapi.TYPE_STRING
+)
 @swagger_auto_schema(
     method='delete',
-    operation_description="Deletes all the search history of dog breeds. Only accessible for admin. Provide your JWT token prefixed with 'Bearer'",
+    operation_description="Deletes all the search history of dog breeds (or the part older than 'older_than', the stats keep counting those searches). Only accessible for admin. Provide your JWT token prefixed with 'Bearer'",
+    manual_parameters=[older_than_param],
     responses={
         204: "No content - Deleted search history",
+        202: "Accepted - Purge job started, follow it at the returned progress url",
+        400: "Bad Request - Invalid older_than",
         401: "Unauthorized - Invalid or missing token",
         403: "Forbidden - Admin access only"
     },
@@ -195,15 +406,85 @@ def user_search_history(request):
 @api_view(['DELETE'])
 @permission_classes([IsAdminUser])
 def delete_all_searches(request):
+    older_than = request.query_params.get('older_than')
+    cutoff = parse_cutoff(older_than) if older_than else None
+    if older_than and cutoff is None:
+        return Response({"error": "Invalid older_than", "details": "Use a date or an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        DogBreed.objects.all().delete()
+        # Nothing listens to the deletes, so everything can go in one statement without loading the rows
+        if cutoff is None and can_truncate():
+            truncate_history()
+            return Response({
+                "status": "success",
+                "message": "All search history has been deleted."
+            }, status=status.HTTP_204_NO_CONTENT)
+
+        # Otherwise delete in small batches in the background, so new searches can still be saved meanwhile
+        job = PurgeJob(older_than=cutoff).start()
         return Response({
             "status": "success",
-            "message": "All search history has been deleted."
-        }, status=status.HTTP_204_NO_CONTENT)
+            "data": job,
+            "progress_url": reverse('search_history_purge', args=[job['id']], request=request),
+        }, status=status.HTTP_202_ACCEPTED)
     
     except Exception as e:
         return Response({
             "status": "error",
             "message": f"An error occurred while deleting records: {str(e)}"
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Progress of a search history purge started by DELETE /api/search-history/delete/. Only accessible for admin.",
+    responses={
+        200: "Success - Job status, rows deleted so far and total",
+        401: "Unauthorized - Invalid or missing token",
+        403: "Forbidden - Admin access only",
+        404: "Not Found - Unknown or expired job"
+    },
+    security=[{'Bearer': []}]
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def search_history_purge(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        return Response({"error": "Purge job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "status": "success",
+        "data": job
+    }, status=status.HTTP_200_OK)
+
+
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Connection reuse, retries and circuit breaker counters of the outbound HTTP clients of this worker. Only accessible for admin.",
+    responses={
+        200: "Success - Counters per upstream",
+        401: "Unauthorized - Invalid or missing token",
+        403: "Forbidden - Admin access only"
+    },
+    security=[{'Bearer': []}]
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def upstream_statistics(request):
+    return Response({
+        "status": "success",
+        "data": upstream_stats()
+    }, status=status.HTTP_200_OK)
+
+
+
+
+# Plain Django view, Prometheus wants text/plain and authenticates with a static bearer token rather than a JWT
+def prometheus_metrics(request):
+    if not settings.METRICS_TOKEN:
+        raise Http404("Set METRICS_TOKEN to enable /metrics")  # no token, no scraping, not even from inside the network
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse("Unauthorized\n", status=status.HTTP_401_UNAUTHORIZED, content_type='text/plain')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+from .catalog import CatalogUnavailable, mirror
+from .gif_cache import gif_cache
+from .upstream import reset_clients
+
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Everything the first request of a worker would otherwise pay for: the URLconf (and
+    with it every view module), the breed catalog from its snapshot with the search index
+    and the name matcher built, and the gif LRU from the snapshot of the last workers.
+
+    Called by dogs_project/wsgi.py and asgi.py, so with gunicorn's preload_app it runs once
+    in the master and the workers inherit the result. Nothing started here may outlive the
+    fork: no threads, and the database and upstream connections are closed at the end.
+    Returns the milliseconds spent per step.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    get_resolver().url_patterns  # imports the URLconf
+    timings['urls'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        catalog = mirror.load()  # only reaches thedogapi when there is no snapshot
+        catalog.index  # otherwise built by the first filtered request
+        catalog.matcher  # and by the first misspelled one
+    except CatalogUnavailable as e:
+        mirror.clear()  # not a failed cold fetch as far as requests are concerned, the first one tries again
+        logger.warning("Starting without a breed catalog, the first request tries again: %s", e)
+    timings['catalog'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    gifs = gif_cache.load_snapshot()
+    timings['gifs'] = time.perf_counter() - started
+
+    connections.close_all()
+    reset_clients()
+    timings = {step: round(seconds * 1000, 1) for step, seconds in timings.items()}
+    logger.info("Warm-up done, %s gifs from the snapshot, ms per step: %s", gifs, timings)
+    return timings
@@ -2,6 +2,9 @@
 ASGI config for dogs_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Async views such as ``/api/breeds/details/async/`` only run concurrently on the
+event loop when the project is served through this module, with SERVER_MODE=asgi
+gunicorn runs it in uvicorn workers (see gunicorn.conf.py).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -9,8 +12,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dogs_project.settings')
 
 application = get_asgi_application()
+
+# Catalog, gif cache and URLconf loaded before the first request (see dogs/warmup.py)
+if settings.WARM_UP_ON_START:
+    from dogs.warmup import warm_up
+    warm_up()
@@ -2,10 +2,10 @@
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
+from django.utils.functional import lazy
 import os
-from decouple import config
 
-load_dotenv() 
+load_dotenv()  # the only place .env is read, everything else gets it through the environment
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dogs.middleware.TimingMiddleware',  # first, so it times the whole stack (see dogs/metrics.py)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +55,12 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Hashed file names in production, which WhiteNoise serves with a year long max-age (STATICFILES_STORAGE is ignored since Django 5.1)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if IS_DEVELOPMENT
+                    else 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
 
 ROOT_URLCONF = 'dogs_project.urls'
 
@@ -80,12 +86,55 @@ WSGI_APPLICATION = 'dogs_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# 'production' (the default outside development) tunes SQLite for several workers saving searches while the
+# admin reads the history: WAL so readers and the writer don't block each other, synchronous=NORMAL (fsync at
+# checkpoints only, with WAL a crash can lose the last commits but not corrupt the file), memory mapped reads,
+# a busy timeout, write transactions that take the lock at BEGIN and connections kept between requests.
+# Admin reads go to a read-only connection to the same file (see dogs/db.py). 'default' is Django's plain setup.
+DATABASE_PATH = os.getenv('DATABASE_PATH', BASE_DIR / 'db.sqlite3')
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'default' if IS_DEVELOPMENT else 'production')
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5))  # seconds a connection waits for a lock before "database is locked"
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 2**20))  # bytes of the file read through mmap instead of read()
+# Django's docs advise against persistent connections under ASGI, every request may run on another thread
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', 0 if os.getenv('SERVER_MODE') == 'asgi' else 600))
+
+
+def sqlite_database(profile, read_only=False):
+    if profile == 'default':
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': DATABASE_PATH}
+    if profile != 'production':
+        raise RuntimeError(f"DATABASE_PROFILE must be 'default' or 'production', not {profile!r}")
+    pragmas = [
+        'PRAGMA journal_mode = WAL',  # stored in the file, a read-only connection can't (and needn't) set it
+        'PRAGMA synchronous = NORMAL',
+        f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}',
+    ]
+    database = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': DATABASE_PATH,
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            # A deferred transaction that reads then writes (the sink looks up breeds first) fails at once when
+            # another one got the lock meanwhile, whatever the timeout, an immediate one waits at BEGIN instead
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': '; '.join(pragmas),
+        },
     }
+    if read_only:
+        database['NAME'] = Path(DATABASE_PATH).resolve().as_uri() + '?mode=ro'
+        database['OPTIONS'] = {'timeout': SQLITE_BUSY_TIMEOUT, 'init_command': '; '.join(pragmas[1:])}
+        database['TEST'] = {'MIRROR': 'default'}
+    return database
+
+
+DATABASES = {
+    'default': sqlite_database(DATABASE_PROFILE),
 }
+if DATABASE_PROFILE == 'production':
+    DATABASES['replica'] = sqlite_database(DATABASE_PROFILE, read_only=True)
+DATABASE_ROUTERS = ['dogs.db.ReplicaRouter']
 
 
 # Password validation
@@ -131,16 +180,114 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# LocMemCache is per process, so every gunicorn worker keeps its own copy. Use CACHE_BACKEND=file, database
+# (run `manage.py createcachetable`), redis or memcached to share the breed catalog and gifs between workers.
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'unique-snowflake'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.django_cache')),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'dogs_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
     }
 }
 
+# External APIs, overridable so tests and benchmarks can point them at dogs.fake_upstream
+DOGS_API_URL = os.getenv('DOGS_API_URL', 'https://api.thedogapi.com/v1/breeds')
+GIPHY_API_URL = os.getenv('GIPHY_API_URL', 'https://api.giphy.com/v1/gifs/search')
+DOGS_API_TIMEOUT = float(os.getenv('DOGS_API_TIMEOUT', 5))  # seconds
+GIPHY_API_TIMEOUT = float(os.getenv('GIPHY_API_TIMEOUT', 2))  # seconds, after this breed details are returned without a gif
+UPSTREAM_FANOUT_WORKERS = int(os.getenv('UPSTREAM_FANOUT_WORKERS', 16))  # gif lookups at once per worker, with all busy details are answered without a gif
+BREEDS_BATCH_WORKERS = int(os.getenv('BREEDS_BATCH_WORKERS', 8))  # breeds of POST /api/breeds/details/batch/ resolved at once per worker
+BREEDS_BATCH_MAX = int(os.getenv('BREEDS_BATCH_MAX', 50))  # breeds per batch request
+
+# GET /api/breeds/ keeps its encoded responses per catalog version (see dogs/response_cache.py)
+BREEDS_RESPONSE_CACHE_SIZE = int(os.getenv('BREEDS_RESPONSE_CACHE_SIZE', 512))  # filter combinations per worker
+BREEDS_CACHE_MAX_AGE = int(os.getenv('BREEDS_CACHE_MAX_AGE', 300))  # seconds clients and proxies may reuse a response
+
+# Search history writes are queued and bulk inserted by a background thread (see dogs/history.py)
+HISTORY_SINK_ENABLED = os.getenv('HISTORY_SINK_ENABLED', 'True') == 'True'
+HISTORY_SINK_BATCH_SIZE = int(os.getenv('HISTORY_SINK_BATCH_SIZE', 500))  # rows, flush as soon as this many are waiting
+HISTORY_SINK_FLUSH_INTERVAL = float(os.getenv('HISTORY_SINK_FLUSH_INTERVAL', 1.0))  # seconds
+HISTORY_SINK_MAX_QUEUE = int(os.getenv('HISTORY_SINK_MAX_QUEUE', 10000))  # rows waiting per worker, more go to the spool
+HISTORY_SINK_MAX_RETRIES = int(os.getenv('HISTORY_SINK_MAX_RETRIES', 5))  # flushes before unwritten rows go to the spool
+HISTORY_SPOOL_PATH = os.getenv('HISTORY_SPOOL_PATH', str(BASE_DIR / 'history_spool.ndjson'))  # rows not written at shutdown
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 100))  # default page of GET /api/search-history/
+HISTORY_MAX_PAGE_SIZE = 1000
+# Keyword search of the history, 'auto' uses the FTS5 index on SQLite and a LIKE scan elsewhere, or a dotted class path
+HISTORY_SEARCH_BACKEND = os.getenv('HISTORY_SEARCH_BACKEND', 'auto')
+# Partial deletes (older_than) run in the background by pk ranges (see dogs/purge.py)
+HISTORY_PURGE_BATCH_SIZE = int(os.getenv('HISTORY_PURGE_BATCH_SIZE', 2000))  # pk range deleted per transaction
+HISTORY_PURGE_PAUSE = float(os.getenv('HISTORY_PURGE_PAUSE', 0.05))  # seconds between batches, lets the history sink write
+HISTORY_PURGE_JOB_TTL = 24 * 3600  # how long the progress of a purge can be looked up
+# Searches older than this many days are moved to gzipped NDJSON files, one per UTC day, by
+# `manage.py archive_search_history` (see dogs/archive.py), 0 keeps everything in the database
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', 90))
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', str(BASE_DIR / 'history_archive'))
+# GET /api/search-history/stats/ reads per breed hour and day counts (see dogs/rollups.py)
+HISTORY_STATS_TOP = 10  # default number of breeds in 'top'
+HISTORY_STATS_MAX_BUCKETS = 1000  # hours or days in one request
+
+# Giphy results (see dogs/gif_cache.py), kept per worker in an LRU and shared through CACHES
+GIF_CACHE_SIZE = int(os.getenv('GIF_CACHE_SIZE', 1024))  # entries per worker
+GIF_CACHE_TTL = int(os.getenv('GIF_CACHE_TTL', 6 * 3600))
+GIF_CACHE_NEGATIVE_TTL = int(os.getenv('GIF_CACHE_NEGATIVE_TTL', 600))  # for breeds Giphy has no gif for
+
+# Shared keep-alive clients for the external APIs (see dogs/upstream.py)
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 16))  # Kept-alive connections per host and worker
+UPSTREAM_ASYNC_POOL_SIZE = int(os.getenv('UPSTREAM_ASYNC_POOL_SIZE', 50))  # Connections per host and worker for the async views, more requests wait their turn
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF = float(os.getenv('UPSTREAM_BACKOFF', 0.2))  # seconds, doubled on every retry and jittered
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv('UPSTREAM_BREAKER_THRESHOLD', 5))  # Failures in a row before we stop calling an upstream
+UPSTREAM_BREAKER_RESET = int(os.getenv('UPSTREAM_BREAKER_RESET', 30))  # seconds before trying it again
+# Request budgets shared by every worker through CACHES: (requests per second, burst), a rate of 0 turns one off.
+# Giphy is not budgeted unless asked to, with a beta key (100 calls an hour) set GIPHY_BUDGET_RATE=0.0278.
+UPSTREAM_BUDGETS = {
+    'thedogapi': (float(os.getenv('THEDOGAPI_BUDGET_RATE', 5)), int(os.getenv('THEDOGAPI_BUDGET_BURST', 20))),
+    'giphy': (float(os.getenv('GIPHY_BUDGET_RATE', 0)), int(os.getenv('GIPHY_BUDGET_BURST', 20))),
+}
+UPSTREAM_BUDGET_RESERVE = 0.25  # share of a bucket only user requests may spend, background refreshes leave it alone
+UPSTREAM_BUDGET_LOCK_WAIT = 1.0  # seconds a request waits for the budget lock on the file and database caches
+UPSTREAM_RATE_LIMIT_COOLDOWN = 30  # seconds nobody calls an upstream after its 429, when it sends no Retry-After
+UPSTREAM_RATE_LIMIT_MAX_COOLDOWN = 600
+
+# Request metrics on /metrics and in Server-Timing headers (see dogs/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # /metrics wants "Authorization: Bearer <token>", it answers 404 while this is unset
+METRICS_OVERHEAD_BUDGET_US = 50  # what the middleware and the hooks may add to a request, in microseconds
+
+# Local mirror of the thedogapi breed list (see dogs/catalog.py), preloaded with `manage.py preload_breed_catalog`
+BREED_CATALOG_PATH = os.getenv('BREED_CATALOG_PATH', str(BASE_DIR / 'breed_catalog.json'))
+BREED_CATALOG_TTL = int(os.getenv('BREED_CATALOG_TTL', 86400))  # After this the catalog is refreshed in the background
+BREED_CATALOG_RETRY = int(os.getenv('BREED_CATALOG_RETRY', 60))  # Seconds between background retries while no catalog could be loaded
+BREED_CATALOG_EARLY_REFRESH = int(os.getenv('BREED_CATALOG_EARLY_REFRESH', 600))  # Average head start of the refresh before the TTL
+BREED_CATALOG_LOCK_TIMEOUT = int(os.getenv('BREED_CATALOG_LOCK_TIMEOUT', 30))  # Max time one worker holds the refresh lock
+BREED_MATCH_MIN_SCORE = 0.5  # Trigram score every word of a misspelled breed needs to be resolved to that breed (see dogs/breed_match.py)
+BREED_MATCH_AUTO_SCORE = 0.7  # and the average it needs, weaker matches only come back as suggestions on the 404
+BREED_SUGGESTION_MIN_SCORE = 0.3  # Lowest score still offered as "did you mean" on a 404
+
+# Startup warm-up (see dogs/warmup.py), run by the WSGI/ASGI modules before the first request
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'True') == 'True'
+GIF_SNAPSHOT_PATH = os.getenv('GIF_SNAPSHOT_PATH', str(BASE_DIR / 'gif_snapshot.json'))  # written by gunicorn workers when they exit
+
+# 'stateless' trusts the staff claims of the token and only checks its version (see dogs/auth.py),
+# 'database' loads the User on every request
+JWT_AUTH_MODE = os.getenv('JWT_AUTH_MODE', 'stateless')
+JWT_AUTHENTICATION_CLASSES = {
+    'stateless': 'dogs.auth.StatelessJWTAuthentication',
+    'database': 'rest_framework_simplejwt.authentication.JWTAuthentication',
+}
+JWT_TOKEN_CACHE_SIZE = int(os.getenv('JWT_TOKEN_CACHE_SIZE', 1024))  # verified tokens and user states per worker
+JWT_USER_STATE_TTL = float(os.getenv('JWT_USER_STATE_TTL', 30))  # seconds, how late the other workers see a revocation
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
     ),
 }
 
@@ -149,34 +296,46 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Tokens carry is_staff, is_superuser and the user's token version
+    'TOKEN_OBTAIN_SERIALIZER': 'dogs.auth.VersionedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'dogs.auth.VersionedTokenRefreshSerializer',
 }
 
 
 
+def static_url(path):
+    from django.templatetags.static import static  # the hashed name is only known once the apps are loaded
+    return static(path)
+
+
+# Swagger UI and ReDoc load the schema written by `manage.py generate_openapi_schema` (see dogs/openapi.py)
+OPENAPI_SPEC_URL = lazy(static_url, str)('openapi/openapi.json')
+REDOC_SETTINGS = {
+    'SPEC_URL': OPENAPI_SPEC_URL,
+}
+# Shared by both configurations, so the committed schema is the same in development and production
+SWAGGER_SECURITY_DEFINITIONS = {
+    'Bearer': {
+        'type': 'apiKey',
+        'in': 'header',
+        'name': 'Authorization'
+    }
+}
+
 if IS_DEVELOPMENT:  # local configuration
     SWAGGER_SETTINGS = {
+        'SPEC_URL': OPENAPI_SPEC_URL,
         'USE_SESSION_AUTH': False,
-        'SECURITY_DEFINITIONS': {
-        'Bearer': {
-            'type': 'apiKey',
-            'in': 'header',
-            'name': 'Authorization'
-        }
-    },
+        'SECURITY_DEFINITIONS': SWAGGER_SECURITY_DEFINITIONS,
 }
     SECURE_PROXY_SSL_HEADER = None
     SECURE_SSL_REDIRECT = False
 else:  # production conf
     SWAGGER_SETTINGS = {
+    'SPEC_URL': OPENAPI_SPEC_URL,
     'USE_HTTPS': True,
     'USE_SESSION_AUTH': False,
-    'SECURITY_DEFINITIONS': {
-        'Bearer': {
-            'type': 'apiKey',
-            'name': 'Authorization',
-            'in': 'header',
-        }
-    },  
+    'SECURITY_DEFINITIONS': SWAGGER_SECURITY_DEFINITIONS,
 }
     print(f"IS_DEVELOPMENT: {IS_DEVELOPMENT}")
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
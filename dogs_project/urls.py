@@ -1,35 +1,51 @@
+from functools import cache
+
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from rest_framework import permissions
 from django.shortcuts import redirect
+from dogs.views import prometheus_metrics
+
+
+# Swagger Schema, drf_yasg's views pull in a JSON schema validator, so they are only imported on the first docs request.
+# The UIs load the schema from the static file written by generate_openapi_schema, it is generated here only for ?format=openapi
+@cache
+def schema_view():
+    from drf_yasg.views import get_schema_view
+    from dogs.openapi import schema_info
+
+    return get_schema_view(
+        schema_info(),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+
+@cache
+def docs_view(renderer):
+    return schema_view().with_ui(renderer, cache_timeout=0)
+
+
+def swagger_ui(request, *args, **kwargs):
+    return docs_view('swagger')(request, *args, **kwargs)
+
+
+def redoc_ui(request, *args, **kwargs):
+    return docs_view('redoc')(request, *args, **kwargs)
 
-# Swagger Schema
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Dog API",
-        default_version='v1',
-        description="API to obtain dog races and images of them",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@dogapi.local"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('dogs.urls')),
     path('', lambda request: redirect('swagger/', permanent=False)),  # Redirects to swagger
-    
+    path('metrics', prometheus_metrics, name='metrics'),  # Prometheus scrape target, per worker
+
     #JWT
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    
+
     #Swagger
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
\ No newline at end of file
+    path('swagger/', swagger_ui, name='schema-swagger-ui'),
+    path('redoc/', redoc_ui, name='schema-redoc'),
+]
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dogs_project.settings')
 
 application = get_wsgi_application()
+
+# Catalog, gif cache and URLconf loaded before the first request (see dogs/warmup.py)
+if settings.WARM_UP_ON_START:
+    from dogs.warmup import warm_up
+    warm_up()
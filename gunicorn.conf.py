@@ -0,0 +1,40 @@
+"""
+gunicorn settings, picked up by `gunicorn -c gunicorn.conf.py` (see the Procfile).
+
+SERVER_MODE=wsgi (the default) runs sync workers on dogs_project.wsgi, every request in
+flight holds a whole worker while it waits on thedogapi or Giphy.
+
+SERVER_MODE=asgi runs uvicorn workers on dogs_project.asgi. The async views
+(/api/breeds/async/, /api/breeds/details/async/) wait on the upstreams on the event
+loop, so a worker serves as many of them at once as it has sockets for. The DRF views
+still work, one at a time per worker on Django's sync thread.
+
+Workers come from WEB_CONCURRENCY and the port from PORT, like with plain gunicorn.
+
+The app is preloaded, so the warm-up of dogs_project/wsgi.py and asgi.py (breed catalog,
+gif cache, URLconf, see dogs/warmup.py) runs once in the master and every worker starts
+warm. Each worker saves its gif cache when it exits, for the warm-up of the next ones.
+"""
+import os
+
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'dogs_project.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif SERVER_MODE == 'wsgi':
+    wsgi_app = 'dogs_project.wsgi:application'
+else:
+    raise RuntimeError(f"SERVER_MODE must be 'wsgi' or 'asgi', not {SERVER_MODE!r}")
+
+preload_app = True
+
+
+def worker_exit(server, worker):
+    from dogs.gif_cache import gif_cache
+
+    try:
+        gif_cache.save_snapshot()
+    except OSError as e:
+        server.log.warning("Could not save the gif cache snapshot: %s", e)